@@ -0,0 +1,212 @@
+"""
+ADAPTIVE CONCURRENCY - Tune how many fragments are fetched in parallel
+
+A fixed `--concurrent-fragments 4` is too low on a fast link and too
+aggressive for sites that answer with HTTP 429. A ConcurrencyController
+watches one download while it runs (throughput, fragment latency, errors)
+and adjusts the fragment parallelism AIMD-style:
+
+- additive increase: +1 while more parallelism still buys throughput
+- multiplicative decrease: halve on 429/503, cut by a quarter on other errors
+- -1 when latency balloons without a throughput gain (the link is saturated)
+
+The native engines read the value live. yt-dlp fixes its fragment pool when
+a download starts, so yt-dlp jobs start from the value the previous job on the
+same site ended with (ConcurrencyTuner keeps those per host).
+"""
+
+import re
+import threading
+import time
+
+from retry_policy import retry_after_of
+
+THROTTLE_STATUSES = (429, 503)
+ADJUST_INTERVAL = 1.0  # seconds of measurements per decision
+MIN_SAMPLES = 3  # fragments needed before a window counts
+HOLD_WINDOWS = 5  # steady windows before probing one step higher again
+HISTORY_LIMIT = 100
+
+_THROTTLE_RE = re.compile(r'HTTP Error (429|503)|Too Many Requests|Service Unavailable', re.I)
+_ERROR_RE = re.compile(r'Got error|Retrying fragment|HTTP Error \d{3}|timed out|Connection reset', re.I)
+
+
+class ConcurrencyController:
+    """AIMD controller for one download; thread-safe"""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, adaptive=True):
+        self.minimum = max(1, int(minimum))
+        self.maximum = max(self.minimum, int(maximum))
+        self.adaptive = adaptive
+        self._value = min(max(int(initial), self.minimum), self.maximum)
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._window_start = self._started
+        self._reset_window()
+        self._last_throughput = None
+        self._best_latency = None
+        self._probing = False  # The last change was an increase still being judged
+        self._holds = 0
+        self._last_bytes = {}  # yt-dlp progress: filename -> downloaded bytes
+        self._last_fragment = {}  # yt-dlp progress: filename -> (fragment index, time)
+        self.history = [self._entry(self._value, 'start', None)]
+        self.errors = 0  # Failed fragments over the whole download (for job metrics)
+        self.throttled = 0
+        self.retry_after = None  # Seconds the server asked to wait, when the download failed
+
+    @property
+    def value(self):
+        return self._value
+
+    def _reset_window(self):
+        self._bytes = 0
+        self._latencies = []
+        self._errors = 0
+        self._throttled = 0
+
+    def _entry(self, value, reason, throughput):
+        return {
+            't': round(time.time() - self._started, 2),
+            'value': value,
+            'reason': reason,
+            'throughput': round(throughput) if throughput is not None else None,
+        }
+
+    def record(self, nbytes, latency):
+        """One fragment arrived: nbytes in `latency` seconds"""
+        if not self.adaptive:
+            return
+        with self._lock:
+            self._bytes += nbytes
+            self._latencies.append(latency)
+            self._maybe_adjust()
+
+    def record_error(self, throttled=False):
+        """A fragment failed (throttled = the server said 429/503)"""
+        with self._lock:
+            self.errors += 1
+            self.throttled += int(throttled)
+            if not self.adaptive:
+                return
+            self._errors += 1
+            if throttled:
+                self._throttled += 1
+            self._maybe_adjust()
+
+    def _set(self, value, reason, throughput):
+        value = min(max(value, self.minimum), self.maximum)
+        if value != self._value:
+            self._probing = value > self._value
+            self._value = value
+            self.history.append(self._entry(value, reason, throughput))
+            del self.history[1:-HISTORY_LIMIT]
+
+    def _maybe_adjust(self):
+        now = time.time()
+        elapsed = now - self._window_start
+        samples = len(self._latencies) + self._errors
+        if elapsed < ADJUST_INTERVAL or samples < MIN_SAMPLES:
+            return
+        throughput = self._bytes / elapsed
+        latency = sorted(self._latencies)[len(self._latencies) // 2] if self._latencies else None
+        value = self._value
+        if self._throttled:
+            self._set(self._value // 2, 'throttled', throughput)
+        elif self._errors > samples * 0.1:
+            self._set(self._value * 3 // 4, 'errors', throughput)
+        elif self._last_throughput is None or throughput > self._last_throughput * 1.05:
+            self._set(self._value + 1, 'faster', throughput)
+        elif (self._probing or latency is not None and self._best_latency
+              and latency > self._best_latency * 2):
+            # More fragments in flight didn't make it faster, only slower per fragment
+            self._set(self._value - 1, 'saturated', throughput)
+            self._probing = False
+        elif self._holds >= HOLD_WINDOWS:
+            # Conditions change; check now and then whether more would help
+            self._set(self._value + 1, 'probe', throughput)
+        self._holds = self._holds + 1 if value == self._value else 0
+        if latency is not None:
+            self._best_latency = latency if self._best_latency is None else min(self._best_latency, latency)
+        self._last_throughput = throughput
+        self._window_start = now
+        self._reset_window()
+
+    # -- yt-dlp adapters -------------------------------------------------
+
+    def progress_hook(self, status):
+        """yt-dlp progress hook: turn fragment progress into samples"""
+        if not self.adaptive or status.get('status') != 'downloading':
+            return
+        name = status.get('filename') or status.get('tmpfilename')
+        downloaded = status.get('downloaded_bytes') or 0
+        fragment = status.get('fragment_index')
+        now = time.time()
+        with self._lock:
+            delta = downloaded - self._last_bytes.get(name, 0)
+            self._last_bytes[name] = downloaded
+            if delta > 0:
+                self._bytes += delta
+            if fragment is not None:
+                previous = self._last_fragment.get(name)
+                if previous is None or fragment != previous[0]:
+                    if previous is not None:
+                        # Fragments finish value-at-a-time, so spread the gap over them
+                        self._latencies.append((now - previous[1]) * self._value)
+                    self._last_fragment[name] = (fragment, now)
+            self._maybe_adjust()
+
+    def log_line(self, msg):
+        """Watch yt-dlp output for fragment retries and throttling"""
+        if _THROTTLE_RE.search(msg):
+            self.record_error(throttled=True)
+        elif _ERROR_RE.search(msg):
+            self.record_error()
+
+    def error_hook(self, error):
+        """yt-dlp reported an error (in-process only): keep the Retry-After the server sent, if any"""
+        retry_after = retry_after_of(error)
+        if retry_after is not None:
+            self.retry_after = retry_after
+
+    def review(self, lines):
+        """Judge a finished job by its error lines
+
+        yt-dlp subprocesses report nothing while they run, so a job that
+        ended in 429s backs the next one off right away.
+        """
+        if self.adaptive and any(_THROTTLE_RE.search(line) for line in lines):
+            with self._lock:
+                self._set(self._value // 2, 'throttled', None)
+
+    def snapshot(self):
+        """Current value and change history, for job stats"""
+        with self._lock:
+            return {
+                'current': self._value,
+                'min': self.minimum,
+                'max': self.maximum,
+                'errors': self.errors,
+                'throttled': self.throttled,
+                'history': [dict(entry) for entry in self.history],
+            }
+
+
+class ConcurrencyTuner:
+    """Hands out controllers and remembers where each website ended up"""
+
+    def __init__(self, minimum=1, maximum=16, adaptive=True):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.adaptive = adaptive
+        self._learned = {}  # host -> last value
+        self._lock = threading.Lock()
+
+    def controller(self, host, initial):
+        """A controller for one job, starting from what the host last settled on"""
+        with self._lock:
+            start = self._learned.get(host, initial) if self.adaptive else initial
+        return ConcurrencyController(start, self.minimum, self.maximum, self.adaptive)
+
+    def remember(self, host, controller):
+        with self._lock:
+            self._learned[host] = controller.value
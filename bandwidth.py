@@ -0,0 +1,267 @@
+"""
+BANDWIDTH - One speed limit for a whole batch, shared fairly between jobs
+
+Per-process `--limit-rate` can't cap what a batch uses in total, and without
+a cap nothing stops one large job from taking the whole line. A
+BandwidthManager holds the batch limit (optionally different by time of day)
+and splits it between the running jobs:
+
+- every job gets a BandwidthShare with its own token bucket
+- shares are weighted per site (HOST_WEIGHTS) and split evenly between the
+  jobs of the same site, so a site with five jobs doesn't get five slices
+- the split is max-min fair: a job that can't use its slice (slow server)
+  keeps what it uses and the rest goes to the others; it is recomputed twice
+  a second from what every job actually moved
+
+Engines report bytes as they arrive and wait for the returned delay: the
+native engines after every read (see http_pool), in-process yt-dlp from its
+progress hook (YtDlpThrottle), and yt-dlp subprocesses get --limit-rate with
+the share they start with.
+"""
+
+import asyncio
+import threading
+import time
+
+BURST_SECONDS = 0.5  # How far ahead of its rate a job may run
+REBALANCE_INTERVAL = 0.5  # seconds between re-splitting the limit
+MIN_RATE = 16 * 1024  # Nobody is throttled below this (bytes/s)
+WANTS_MORE = 0.8  # A job using this much of its share is assumed to want more
+MB = 1024 * 1024
+
+
+def parse_clock(text):
+    """'HH:MM' -> minutes after midnight"""
+    hours, _, minutes = str(text).partition(':')
+    return (int(hours) % 24) * 60 + int(minutes or 0)
+
+
+class RateSchedule:
+    """A default rate plus (start, end, rate) windows by local time of day
+
+    Windows may cross midnight ("22:00" to "06:00"). A rate of 0 or None
+    means unlimited. The first matching window wins.
+    """
+
+    def __init__(self, default=0, windows=()):
+        self.default = default or 0
+        self.windows = [(parse_clock(start), parse_clock(end), rate or 0)
+                        for start, end, rate in windows]
+
+    def rate_at(self, when=None):
+        now = time.localtime(when)
+        minute = now.tm_hour * 60 + now.tm_min
+        for start, end, rate in self.windows:
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self.default
+
+
+class BandwidthShare:
+    """One job's slice of the batch limit"""
+
+    def __init__(self, manager, host, weight=1.0):
+        self.manager = manager
+        self.host = host
+        self.weight = weight
+        self.rate = 0  # bytes/s this job may use right now, 0 = unlimited
+        self.bytes = 0
+        self.opened = time.monotonic()
+        self._tokens = 0.0
+        self._last = self.opened
+        self._window_bytes = 0
+        self._throttled = False  # Had to wait at least once since the last rebalance
+        self._demand = None  # bytes/s it was cut down to, None = gets its full fair share
+
+    def reserve(self, nbytes):
+        """Count nbytes that just arrived; returns how long to pause (seconds)"""
+        return self.manager._reserve(self, nbytes)
+
+    def throttle(self, nbytes):
+        """reserve() and sleep it off (for threads)"""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def athrottle(self, nbytes):
+        """reserve() and sleep it off (for asyncio code)"""
+        delay = self.reserve(nbytes)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def close(self):
+        self.manager._close(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BandwidthManager:
+    """Shares a (scheduled) total rate between jobs; thread-safe"""
+
+    def __init__(self, rate=0, schedule=(), host_weights=None):
+        self.schedule = RateSchedule(rate, schedule)
+        self.host_weights = {host.lower(): weight for host, weight in (host_weights or {}).items()}
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._shares = []
+        self._limit = self.schedule.rate_at()
+        self._last_rebalance = time.monotonic()
+
+    @property
+    def limit(self):
+        """Current total limit in bytes/s (0 = unlimited)"""
+        return self._limit
+
+    def host_weight(self, host):
+        """Configured weight of a site; 'example.com' also covers its subdomains"""
+        host = host.lower()
+        while host:
+            if host in self.host_weights:
+                return self.host_weights[host]
+            host = host.partition('.')[2]
+        return 1.0
+
+    def open(self, host, weight=1.0):
+        """Start a job on `host`; close the returned share when it ends"""
+        share = BandwidthShare(self, host, weight)
+        with self._lock:
+            self._shares.append(share)
+            self._allocate(time.monotonic())
+        return share
+
+    def _close(self, share):
+        with self._lock:
+            if share in self._shares:
+                self._shares.remove(share)
+                self._allocate(time.monotonic())
+
+    def _reserve(self, share, nbytes):
+        now = time.monotonic()
+        with self._lock:
+            share.bytes += nbytes
+            share._window_bytes += nbytes
+            self.bytes += nbytes
+            if now - self._last_rebalance >= REBALANCE_INTERVAL:
+                self._rebalance(now)
+            if not share.rate:
+                return 0.0
+            self._refill(share, now)
+            if share._demand is not None and share._tokens < nbytes:
+                # A job that was idle (extracting, post-processing) or slow
+                # picked up again: give it its fair share now, not next round
+                share._demand = None
+                self._allocate(now)
+                self._refill(share, now)
+            share._tokens -= nbytes
+            if share._tokens >= 0:
+                return 0.0
+            share._throttled = True
+            return -share._tokens / share.rate
+
+    @staticmethod
+    def _refill(share, now):
+        if share.rate:
+            share._tokens = min(share.rate * BURST_SECONDS,
+                                share._tokens + (now - share._last) * share.rate)
+        share._last = now
+
+    def _rebalance(self, now):
+        """Measure what every job used since the last round, then re-split the limit"""
+        elapsed = now - self._last_rebalance
+        self._last_rebalance = now
+        self._limit = self.schedule.rate_at()
+        for share in self._shares:
+            used = share._window_bytes / elapsed if elapsed > 0 else 0
+            wants_more = (not share.rate or share._throttled or used >= share.rate * WANTS_MORE
+                          or now - share.opened < REBALANCE_INTERVAL * 2)
+            # None = takes whatever it gets (new, unlimited, or held back by its share)
+            share._demand = None if wants_more else used * 1.25
+            share._window_bytes = 0
+            share._throttled = False
+        self._allocate(now)
+
+    def _allocate(self, now):
+        """Water-fill the limit over the shares by weight and demand"""
+        jobs_per_host = {}
+        for share in self._shares:
+            jobs_per_host[share.host] = jobs_per_host.get(share.host, 0) + 1
+        rates = {}
+        if self._limit:
+            remaining = float(self._limit)
+            pending = list(self._shares)
+            weights = {s: self.host_weight(s.host) * s.weight / jobs_per_host[s.host] for s in pending}
+            while pending:
+                total_weight = sum(weights[s] for s in pending) or 1.0
+                satisfied = [s for s in pending if s._demand is not None
+                             and s._demand <= remaining * weights[s] / total_weight]
+                if not satisfied:
+                    for s in pending:
+                        rates[s] = remaining * weights[s] / total_weight
+                        s._demand = None  # Gets its full share, nothing to give back
+                    break
+                for s in satisfied:
+                    rates[s] = s._demand
+                    remaining -= s._demand
+                    pending.remove(s)
+        for share in self._shares:
+            self._refill(share, now)
+            share.rate = max(MIN_RATE, int(rates[share])) if share in rates else 0
+            # Debt run up at a higher rate mustn't turn into a long stall at a lower one
+            share._tokens = max(share._tokens, -share.rate * BURST_SECONDS)
+
+    def snapshot(self):
+        """{'limit', 'bytes', 'jobs': [{'host', 'rate', 'bytes'}]} for status displays"""
+        with self._lock:
+            return {
+                'limit': self._limit,
+                'bytes': self.bytes,
+                'jobs': [{'host': s.host, 'rate': s.rate, 'bytes': s.bytes} for s in self._shares],
+            }
+
+
+class YtDlpThrottle:
+    """yt-dlp session monitor that keeps an in-process download within its share
+
+    Keeps `ratelimit` in the live YoutubeDL params at the share's rate (plain
+    HTTP downloads smooth themselves with it) and sleeps in the progress
+    hook when the job is ahead of its budget, which also covers fragment
+    downloads that run on their own copy of the params.
+    """
+
+    def __init__(self, share):
+        self.share = share
+        self.params = None
+        self._last = {}  # file -> downloaded bytes
+        self._lock = threading.Lock()
+
+    def attach(self, params):
+        """Called by YtDlpSession with the params dict of the running download"""
+        self.params = params
+        self._sync()
+
+    def _sync(self):
+        if self.params is not None:
+            rate = self.share.rate or None
+            if self.params.get('ratelimit') != rate:
+                self.params['ratelimit'] = rate
+
+    def count(self, name, downloaded):
+        """Report a file's downloaded_bytes; returns the pause its share asks for"""
+        if downloaded is None:
+            return 0.0
+        with self._lock:
+            delta = downloaded - self._last.get(name, 0)
+            self._last[name] = downloaded
+        return self.share.reserve(delta) if delta > 0 else 0.0
+
+    def progress_hook(self, status):
+        if status.get('status') != 'downloading':
+            return
+        delay = self.count(status.get('tmpfilename') or status.get('filename'), status.get('downloaded_bytes'))
+        self._sync()
+        if delay > 0:
+            time.sleep(delay)
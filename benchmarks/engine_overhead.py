@@ -0,0 +1,147 @@
+"""
+BENCHMARK - Per-URL overhead of the subprocess engine vs the in-process engine
+
+Serves a handful of small synthetic .mp4 files from a local HTTP server and
+downloads them with both engines, using the options from
+VideoDownloader.build_yt_dlp_command. The files are tiny on purpose, so the
+numbers are dominated by per-URL overhead (process startup, yt_dlp import,
+extractor setup, new connections) rather than by transfer time.
+
+Usage:
+    python benchmarks/engine_overhead.py [--urls 20] [--size-kb 64]
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import video_downloader  # noqa: E402
+import ytdlp_engine  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like a real CDN
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(directory):
+    """Serve a directory on a free localhost port; returns (server, base_url)"""
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def make_media(directory, count, size_kb):
+    for i in range(count):
+        with open(os.path.join(directory, f"clip{i}.mp4"), "wb") as f:
+            f.write(os.urandom(size_kb * 1024))
+
+
+def configure_downloader(output_dir):
+    """Options that work without ffmpeg or network access"""
+    video_downloader.OUTPUT_DIR = output_dir
+    video_downloader.EMBED_SUBS = False
+    video_downloader.SKIP_ADS = False
+    video_downloader.EXTRACT_M3U8_HLS = False
+    video_downloader.MAX_CONCURRENT_DOWNLOADS = 1
+    downloader = video_downloader.VideoDownloader()
+    return downloader
+
+
+def build_command(downloader, url):
+    cmd = downloader.build_yt_dlp_command(url)
+    if not shutil.which("ffmpeg"):
+        cmd.remove('--add-metadata')  # Needs ffmpeg, not what we're measuring
+    if not shutil.which(cmd[0]):
+        cmd[:1] = [sys.executable, "-m", "yt_dlp"]
+    return cmd + ['--quiet']
+
+
+def bench_subprocess(downloader, urls):
+    timings = []
+    for url in urls:
+        start = time.perf_counter()
+        result = subprocess.run(build_command(downloader, url), capture_output=True)
+        timings.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"subprocess download failed: {result.stderr.decode(errors='replace')}")
+    return timings
+
+
+def bench_inprocess(downloader, urls):
+    timings = []
+    start = time.perf_counter()
+    pool = ytdlp_engine.SessionPool.from_command(build_command(downloader, 'URL'))
+    setup = time.perf_counter() - start
+    try:
+        for url in urls:
+            start = time.perf_counter()
+            info, _output = pool.download(url)
+            timings.append(time.perf_counter() - start)
+            if info is None:
+                raise RuntimeError(f"in-process download failed: {url}")
+    finally:
+        pool.close()
+    # Session setup is a one-off cost, charge it to the first URL
+    timings[0] += setup
+    return timings
+
+
+def summarize(name, timings):
+    return {
+        "engine": name,
+        "urls": len(timings),
+        "total_s": sum(timings),
+        "mean_ms": statistics.mean(timings) * 1000,
+        "median_ms": statistics.median(timings) * 1000,
+        "first_ms": timings[0] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--urls", type=int, default=20, help="number of URLs per engine")
+    parser.add_argument("--size-kb", type=int, default=64, help="size of each synthetic file")
+    args = parser.parse_args()
+
+    if not ytdlp_engine.is_available():
+        print("❌ yt_dlp must be importable to benchmark the in-process engine")
+        return 1
+
+    with tempfile.TemporaryDirectory() as media_dir, tempfile.TemporaryDirectory() as out_dir:
+        make_media(media_dir, args.urls, args.size_kb)
+        server, base_url = start_server(media_dir)
+        try:
+            urls = [f"{base_url}/clip{i}.mp4" for i in range(args.urls)]
+            results = []
+            for name, bench in (("subprocess", bench_subprocess), ("inprocess", bench_inprocess)):
+                downloader = configure_downloader(os.path.join(out_dir, name))
+                results.append(summarize(name, bench(downloader, urls)))
+        finally:
+            server.shutdown()
+
+    print(f"{'engine':<12}{'urls':>6}{'total s':>10}{'mean ms':>10}{'median ms':>11}{'first ms':>10}")
+    for r in results:
+        print(f"{r['engine']:<12}{r['urls']:>6}{r['total_s']:>10.2f}{r['mean_ms']:>10.1f}"
+              f"{r['median_ms']:>11.1f}{r['first_ms']:>10.1f}")
+    speedup = results[0]["median_ms"] / results[1]["median_ms"]
+    print(f"\n⚡ In-process engine: {speedup:.1f}x less overhead per URL (median)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
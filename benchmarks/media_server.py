@@ -0,0 +1,305 @@
+"""
+SYNTHETIC MEDIA SERVER - Local MP4, HLS and DASH content for benchmarks
+
+Generates real (decodable) media once with ffmpeg - x264 at a constant bit
+rate, so file and segment sizes come out as configured - and serves it from
+memory on a localhost port, under as many URLs as a benchmark asks for:
+
+    /mp4/clip<N>.mp4           one file, with Range support
+    /hls/clip<N>.m3u8          media playlist, segments under /hls/clip<N>/
+    /dash/clip<N>.mpd          video + audio, segments under /dash/clip<N>/
+
+Every request can be delayed (latency + random jitter) and media requests
+can fail with 503 at a given rate; the random source is seeded so runs are
+repeatable. The server keeps per-URL counters (first request, first and
+last byte sent, bytes, requests, injected errors) from which the benchmark
+works out time-to-first-byte and transfer time.
+
+Without ffmpeg only MP4 is available, filled with random bytes (enough for
+engines that don't post-process).
+"""
+
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHUNK = 64 * 1024
+CLIP_SECONDS = 10  # Length of the generated MP4
+FPS = 25
+
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.mpd': 'application/dash+xml',
+    '.m4s': 'video/iso.segment',
+}
+
+
+def _x264_cbr(bits_per_second):
+    rate = str(int(bits_per_second))
+    return ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+            '-b:v', rate, '-minrate', rate, '-maxrate', rate, '-bufsize', rate,
+            '-x264-params', 'nal-hrd=cbr:force-cfr=1']
+
+
+def _sources(seconds):
+    return ['-f', 'lavfi', '-i', f'testsrc2=size=640x360:rate={FPS}:duration={seconds}',
+            '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={seconds}']
+
+
+def _ffmpeg(ffmpeg, args):
+    result = subprocess.run([ffmpeg, '-y', '-loglevel', 'error'] + args, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()[-300:]}")
+
+
+def make_mp4(ffmpeg, path, size_bytes):
+    """A CLIP_SECONDS long MP4 of roughly size_bytes (random bytes without ffmpeg)"""
+    if ffmpeg is None:
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size_bytes))
+        return
+    _ffmpeg(ffmpeg, _sources(CLIP_SECONDS) + _x264_cbr(size_bytes * 8 / CLIP_SECONDS)
+            + ['-c:a', 'aac', '-b:a', '64k', '-movflags', '+faststart', path])
+
+
+def make_hls(ffmpeg, directory, segments, segment_bytes, segment_seconds):
+    """index.m3u8 + seg00000.ts... with `segments` segments of about segment_bytes"""
+    seconds = segments * segment_seconds
+    _ffmpeg(ffmpeg, _sources(seconds) + _x264_cbr(segment_bytes * 8 / segment_seconds) + [
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+        '-c:a', 'aac', '-b:a', '64k',
+        '-f', 'hls', '-hls_time', str(segment_seconds), '-hls_list_size', '0',
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(directory, 'seg%05d.ts'),
+        os.path.join(directory, 'index.m3u8')])
+
+
+def make_dash(ffmpeg, directory, segments, segment_bytes, segment_seconds):
+    """manifest.mpd with separate video and audio tracks, `segments` segments each"""
+    seconds = segments * segment_seconds
+    _ffmpeg(ffmpeg, _sources(seconds) + _x264_cbr(segment_bytes * 8 / segment_seconds) + [
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+        '-c:a', 'aac', '-b:a', '64k', '-map', '0:v', '-map', '1:a',
+        '-f', 'dash', '-seg_duration', str(segment_seconds),
+        '-use_template', '1', '-use_timeline', '0',
+        '-init_seg_name', 'init-$RepresentationID$.m4s',
+        '-media_seg_name', 'chunk-$RepresentationID$-$Number%05d$.m4s',
+        '-adaptation_sets', 'id=0,streams=v id=1,streams=a',
+        os.path.join(directory, 'manifest.mpd')])
+
+
+class MediaLibrary:
+    """The generated files, loaded into memory: {kind: {name: bytes}}"""
+
+    def __init__(self, directory, ffmpeg=None, mp4_bytes=8 * 1024 * 1024,
+                 segments=20, segment_bytes=256 * 1024, segment_seconds=2):
+        self.ffmpeg = ffmpeg
+        self.files = {}
+        kinds = {'mp4': lambda d: make_mp4(ffmpeg, os.path.join(d, 'clip.mp4'), mp4_bytes)}
+        if ffmpeg is not None:
+            kinds['hls'] = lambda d: make_hls(ffmpeg, d, segments, segment_bytes, segment_seconds)
+            kinds['dash'] = lambda d: make_dash(ffmpeg, d, segments, segment_bytes, segment_seconds)
+        for kind, make in kinds.items():
+            folder = os.path.join(directory, kind)
+            os.makedirs(folder, exist_ok=True)
+            make(folder)
+            self.files[kind] = {}
+            for name in os.listdir(folder):
+                with open(os.path.join(folder, name), 'rb') as f:
+                    self.files[kind][name] = f.read()
+
+    @property
+    def kinds(self):
+        return list(self.files)
+
+    def size(self, kind):
+        """Bytes one clip of this kind transfers (manifests included)"""
+        return sum(len(data) for data in self.files[kind].values())
+
+
+class ItemStats:
+    """What the server saw for one URL (clip)"""
+
+    __slots__ = ('first_request', 'first_byte', 'last_byte', 'bytes', 'requests', 'errors')
+
+    def __init__(self):
+        self.first_request = None
+        self.first_byte = None
+        self.last_byte = None
+        self.bytes = 0
+        self.requests = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass  # Clients dropping keep-alive connections is normal here
+
+
+class MediaServer:
+    """Serves a MediaLibrary on 127.0.0.1 with injected latency, jitter and errors"""
+
+    def __init__(self, library, latency=0.0, jitter=0.0, error_rate=0.0, seed=1):
+        self.library = library
+        self.latency = latency  # seconds before every response
+        self.jitter = jitter  # +/- seconds added at random
+        self.error_rate = error_rate  # share of media requests answered with 503
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.items = {}  # 'hls/clip3' -> ItemStats
+        self.server = _Server(('127.0.0.1', 0), MediaHandler)
+        self.server.media = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def url(self, kind, index):
+        ext = {'mp4': 'mp4', 'hls': 'm3u8', 'dash': 'mpd'}[kind]
+        return f"{self.base_url}/{kind}/clip{index}.{ext}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """Forget the counters (between benchmark scenarios)"""
+        with self._lock:
+            self.items = {}
+
+    def stats(self, item):
+        with self._lock:
+            return self.items.setdefault(item, ItemStats())
+
+    def delay(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(0.0, self.latency + jitter)
+
+    def inject_error(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def resolve(self, path):
+        """URL path -> (item, body, content type, is media) or None"""
+        match = re.match(r'^/(mp4|hls|dash)/clip(\d+)(\.\w+|/[\w.-]+)$', path)
+        if match is None or match.group(1) not in self.library.files:
+            return None
+        kind, index, rest = match.groups()
+        files = self.library.files[kind]
+        item = f"{kind}/clip{index}"
+        if kind == 'mp4' and rest == '.mp4':
+            body = files['clip.mp4']
+        elif kind == 'hls' and rest == '.m3u8':
+            # Segment URIs are relative, point them below this clip's folder
+            body = re.sub(rb'(?m)^(seg\d+\.ts)$', f'clip{index}/'.encode() + rb'\1', files['index.m3u8'])
+        elif kind == 'dash' and rest == '.mpd':
+            body = re.sub(rb'(initialization|media)="', rb'\1="' + f'clip{index}/'.encode(),
+                          files['manifest.mpd'])
+        elif rest.startswith('/') and rest[1:] in files and not rest.endswith(('.m3u8', '.mpd')):
+            body = files[rest[1:]]
+        else:
+            return None
+        ext = os.path.splitext(path)[1]
+        media = ext not in ('.m3u8', '.mpd')
+        return item, body, CONTENT_TYPES.get(ext, 'application/octet-stream'), media
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like a real CDN
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(head=True)
+
+    def do_GET(self):
+        self._serve()
+
+    def _serve(self, head=False):
+        media = self.server.media
+        resolved = media.resolve(self.path.split('?')[0])
+        delay = media.delay()
+        if delay:
+            time.sleep(delay)
+        if resolved is None:
+            return self._empty(404)
+        item, body, content_type, is_media = resolved
+        stats = media.stats(item)
+        now = time.time()
+        with media._lock:
+            stats.requests += 1
+            if stats.first_request is None:
+                stats.first_request = now
+        if is_media and media.inject_error():
+            with media._lock:
+                stats.errors += 1
+            return self._empty(503)
+
+        start, end = 0, len(body) - 1
+        status = 200
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', '').strip())
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+            else:
+                start = max(0, len(body) - int(match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', f'"{len(body)}"')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        self.end_headers()
+        if head:
+            return
+        try:
+            for offset in range(start, end + 1, CHUNK):
+                data = body[offset:min(end + 1, offset + CHUNK)]
+                self.wfile.write(data)
+                now = time.time()
+                with media._lock:
+                    if is_media and stats.first_byte is None:
+                        stats.first_byte = now
+                    stats.bytes += len(data)
+                    stats.last_byte = now
+        except (ConnectionError, OSError):
+            pass  # Client went away (cancelled, or an engine closed a connection early)
+
+    def _empty(self, code):
+        self.send_response(code)
+        self.send_header('Content-Length', '0')
+        if code == 503:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
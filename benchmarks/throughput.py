@@ -0,0 +1,341 @@
+"""
+BENCHMARK - Throughput, overhead, TTFB, CPU and memory of every download path
+
+Starts the synthetic media server (media_server.py) and downloads the same
+clips through each download path:
+
+    native      CLI with the built-in HLS/DASH/range engines
+    inprocess   CLI with yt-dlp sessions (DOWNLOAD_ENGINE = "inprocess")
+    subprocess  CLI with one yt-dlp process per URL
+    gui         the GUI's run_download (needs a display)
+
+Every scenario (content x path) runs in a fresh Python process, so CPU time
+and peak memory belong to that scenario alone. Per scenario it reports:
+
+- throughput: size of the clips that arrived / wall time of the batch
+  (bytes sent again after injected errors don't count)
+- per-URL time, and overhead: per-URL time minus the time the server spent
+  sending that URL's bytes (process start, extraction, manifests, retries,
+  post-processing)
+- TTFB: job start until the server sent the first media byte
+- CPU seconds (including yt-dlp and ffmpeg child processes) and peak RSS
+
+Results are written as JSON; --compare OLD.json prints the change against an
+earlier run and exits with 1 if a scenario got slower than --tolerance.
+
+Usage:
+    python benchmarks/throughput.py [--content mp4,hls,dash] [--paths native,inprocess,subprocess,gui]
+        [--urls 4] [--parallel 1] [--latency-ms 20 --jitter-ms 10 --error-rate 0.02]
+        [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from media_server import MediaLibrary, MediaServer  # noqa: E402
+
+CONTENT = ('mp4', 'hls', 'dash')
+PATHS = ('native', 'inprocess', 'subprocess', 'gui')
+MB = 1024 * 1024
+
+
+def rusage():
+    """(cpu seconds, peak RSS MB of this process, peak RSS MB of any child) so far"""
+    if resource is None:
+        return time.process_time(), None, None
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    me = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = me.ru_utime + me.ru_stime + children.ru_utime + children.ru_stime
+    return cpu, me.ru_maxrss * scale / MB, children.ru_maxrss * scale / MB
+
+
+# ---- Scenario side (runs in its own process) -------------------------------
+
+def run_cli(path, urls, out_dir, parallel):
+    import video_downloader
+    from download_scheduler import DownloadJob, DownloadScheduler
+
+    video_downloader.OUTPUT_DIR = out_dir
+    video_downloader.EMBED_SUBS = False
+    video_downloader.SKIP_ADS = False
+    video_downloader.USE_DOWNLOAD_ARCHIVE = False
+    video_downloader.USE_JOB_JOURNAL = False
+    video_downloader.DEDUPLICATE = False  # Every clip URL serves the same bytes
+    video_downloader.USE_PROBE_CACHE = False  # Every run starts cold
+    video_downloader.MAX_CONCURRENT_DOWNLOADS = parallel
+    engine = 'native' if path == 'native' else 'yt-dlp'
+    video_downloader.HLS_ENGINE = video_downloader.DASH_ENGINE = video_downloader.DIRECT_ENGINE = engine
+    video_downloader.DOWNLOAD_ENGINE = 'subprocess' if path == 'subprocess' else 'inprocess'
+
+    downloader = video_downloader.VideoDownloader()
+    downloader.session_pool = downloader.create_session_pool()
+    jobs = [DownloadJob(index, url) for index, url in enumerate(urls, 1)]
+    try:
+        DownloadScheduler(parallel, parallel).run(
+            jobs, lambda job: downloader.download_video(job.url, stats=job.stats))
+    finally:
+        downloader.close_engines()
+    return [{'url': job.url, 'ok': bool(job.success), 'start': job.started_at, 'end': job.finished_at}
+            for job in jobs]
+
+
+def run_gui(urls, out_dir):
+    import tkinter as tk
+    import video_downloader_gui
+
+    root = tk.Tk()
+    root.withdraw()
+    app = video_downloader_gui.VideoDownloaderGUI(root)
+    app.output_dir.set(out_dir)
+    app.skip_ads.set(False)
+    app.skip_downloaded.set(False)
+    session_pool = app.create_session_pool()
+    results = []
+    try:
+        # The GUI downloads one URL after the other
+        for url in urls:
+            start = time.time()
+            returncode = app.run_download(url, None, session_pool, None)
+            results.append({'url': url, 'ok': returncode == 0, 'start': start, 'end': time.time()})
+    finally:
+        if session_pool is not None:
+            session_pool.close()
+        root.destroy()
+    return results
+
+
+def run_scenario(spec):
+    """Child process entry: download spec['urls'] on spec['path'], return timings + rusage"""
+    if spec['path'] == 'gui':
+        try:
+            import tkinter
+            tkinter.Tk().destroy()
+        except Exception as e:  # No display, or Tk missing
+            return {'skipped': f"GUI can't start here ({e.__class__.__name__})"}
+    started = time.time()
+    # Keep the downloaders' own output out of the JSON on stdout
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if spec['path'] == 'gui':
+            jobs = run_gui(spec['urls'], spec['out_dir'])
+        else:
+            jobs = run_cli(spec['path'], spec['urls'], spec['out_dir'], spec['parallel'])
+    cpu, rss, child_rss = rusage()
+    return {'jobs': jobs, 'start': started, 'end': time.time(),
+            'cpu_s': cpu, 'peak_rss_mb': rss, 'peak_child_rss_mb': child_rss}
+
+
+# ---- Harness side ------------------------------------------------------------
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def summarize(content, path, result, server, items, clip_bytes):
+    """Merge the scenario's own timings with what the server saw"""
+    summary = {'content': content, 'path': path}
+    if 'skipped' in result or 'error' in result:
+        summary.update({key: result[key] for key in ('skipped', 'error') if key in result})
+        return summary
+    per_url, overhead, ttfb = [], [], []
+    sent = 0
+    for job, item in zip(result['jobs'], items):
+        stats = server.stats(item)
+        sent += stats.bytes
+        elapsed = job['end'] - job['start']
+        per_url.append(elapsed * 1000)
+        if stats.first_byte is not None:
+            ttfb.append((stats.first_byte - job['start']) * 1000)
+            overhead.append(max(0.0, elapsed - (stats.last_byte - stats.first_byte)) * 1000)
+    wall = result['end'] - result['start']
+    ok = sum(1 for job in result['jobs'] if job['ok'])
+    summary.update({
+        'urls': len(result['jobs']),
+        'ok': ok,
+        'wall_s': wall,
+        'bytes': clip_bytes * ok,
+        'bytes_sent': sent,
+        'throughput_mbps': clip_bytes * ok / MB / wall if wall > 0 else None,
+        'per_url_ms': {'median': percentile(per_url, 0.5), 'p95': percentile(per_url, 0.95),
+                       'mean': statistics.mean(per_url) if per_url else None},
+        'overhead_ms': {'median': percentile(overhead, 0.5), 'p95': percentile(overhead, 0.95)},
+        'ttfb_ms': {'median': percentile(ttfb, 0.5), 'p95': percentile(ttfb, 0.95)},
+        'cpu_s': result['cpu_s'],
+        'peak_rss_mb': result['peak_rss_mb'],
+        'peak_child_rss_mb': result['peak_child_rss_mb'],
+        'requests': sum(server.stats(item).requests for item in items),
+        'injected_errors': sum(server.stats(item).errors for item in items),
+    })
+    return summary
+
+
+def run_in_child(spec, timeout):
+    try:
+        process = subprocess.run([sys.executable, __file__, '--scenario', json.dumps(spec)],
+                                 capture_output=True, text=True, timeout=timeout, cwd=str(ROOT))
+    except subprocess.TimeoutExpired:
+        return {'error': f"timed out after {timeout}s"}
+    lines = process.stdout.strip().splitlines()
+    if process.returncode != 0 or not lines:
+        return {'error': (process.stderr.strip().splitlines() or ['no output'])[-1]}
+    return json.loads(lines[-1])
+
+
+def environment():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'ffmpeg': shutil.which('ffmpeg'),
+        'when': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    try:
+        from yt_dlp.version import __version__ as version
+        info['yt_dlp'] = version
+    except ImportError:
+        info['yt_dlp'] = None
+    try:
+        info['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=str(ROOT),
+                                        capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        info['commit'] = None
+    return info
+
+
+def fmt(value, spec='.1f'):
+    return '-' if value is None else format(value, spec)
+
+
+def print_table(scenarios):
+    print(f"{'content':<8}{'path':<12}{'ok':>6}{'MB/s':>9}{'url ms':>9}{'ovh ms':>9}"
+          f"{'ttfb ms':>9}{'cpu s':>8}{'rss MB':>8}")
+    for s in scenarios:
+        if 'urls' not in s:
+            print(f"{s['content']:<8}{s['path']:<12}  {s.get('skipped') or 'ERROR: ' + s.get('error', '')}")
+            continue
+        print(f"{s['content']:<8}{s['path']:<12}{s['ok']:>3}/{s['urls']:<2}{fmt(s['throughput_mbps']):>9}"
+              f"{fmt(s['per_url_ms']['median'], '.0f'):>9}{fmt(s['overhead_ms']['median'], '.0f'):>9}"
+              f"{fmt(s['ttfb_ms']['median'], '.0f'):>9}{fmt(s['cpu_s'], '.2f'):>8}"
+              f"{fmt(max(s['peak_rss_mb'] or 0, s['peak_child_rss_mb'] or 0), '.0f'):>8}")
+
+
+def compare(scenarios, settings, baseline_path, tolerance):
+    """Print the change against an earlier results file; returns False on a regression"""
+    with open(baseline_path, encoding='utf-8') as f:
+        old_report = json.load(f)
+    baseline = {(s['content'], s['path']): s for s in old_report['scenarios']}
+    print(f"\n📈 Compared with {baseline_path} (tolerance {tolerance:.0%}):")
+    ignored = ('content', 'paths', 'timeout', 'tolerance')
+    changed = sorted(key for key, value in settings.items()
+                     if key not in ignored and old_report.get('settings', {}).get(key) != value)
+    if changed:
+        print(f"   ⚠️  Different settings ({', '.join(changed)}) - the numbers aren't comparable")
+    ok = True
+    for s in scenarios:
+        old = baseline.get((s['content'], s['path']))
+        if old is None or not old.get('throughput_mbps') or not s.get('throughput_mbps'):
+            continue
+        change = s['throughput_mbps'] / old['throughput_mbps'] - 1
+        overhead_new, overhead_old = s['overhead_ms']['median'], old['overhead_ms']['median']
+        overhead = (f", overhead {overhead_old:.0f} -> {overhead_new:.0f} ms"
+                    if overhead_new is not None and overhead_old is not None else "")
+        slower = change < -tolerance
+        ok = ok and not slower
+        print(f"   {'❌' if slower else '✅'} {s['content']}/{s['path']}: throughput "
+              f"{old['throughput_mbps']:.1f} -> {s['throughput_mbps']:.1f} MB/s ({change:+.0%}){overhead}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--content', default=','.join(CONTENT), help="comma-separated: mp4,hls,dash")
+    parser.add_argument('--paths', default=','.join(PATHS), help="comma-separated: " + ','.join(PATHS))
+    parser.add_argument('--urls', type=int, default=4, help="URLs per scenario")
+    parser.add_argument('--parallel', type=int, default=1, help="downloads at once (CLI paths)")
+    parser.add_argument('--mp4-mb', type=float, default=8, help="size of the MP4 clip")
+    parser.add_argument('--segments', type=int, default=20, help="HLS/DASH segments per clip")
+    parser.add_argument('--segment-kb', type=int, default=256, help="size of one HLS/DASH video segment")
+    parser.add_argument('--segment-seconds', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=0, help="delay before every response")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="random +/- on top of the latency")
+    parser.add_argument('--error-rate', type=float, default=0, help="share of media requests failing with 503")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=int, default=600, help="seconds per scenario")
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='OLD_JSON', help="results of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed throughput drop for --compare")
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)  # Internal: run one scenario
+    args = parser.parse_args()
+
+    if args.scenario:
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return 0
+
+    ffmpeg = shutil.which('ffmpeg')
+    with tempfile.TemporaryDirectory() as media_dir, tempfile.TemporaryDirectory() as out_dir:
+        print("🎞️  Generating synthetic media...")
+        library = MediaLibrary(media_dir, ffmpeg, int(args.mp4_mb * MB), args.segments,
+                               args.segment_kb * 1024, args.segment_seconds)
+        server = MediaServer(library, args.latency_ms / 1000, args.jitter_ms / 1000,
+                             args.error_rate, args.seed).start()
+        scenarios = []
+        try:
+            for content in args.content.split(','):
+                for path in args.paths.split(','):
+                    if content not in library.kinds:
+                        result = {'skipped': "needs ffmpeg to generate the media"}
+                    elif ffmpeg is None and path != 'native':
+                        result = {'skipped': "yt-dlp post-processing needs ffmpeg"}
+                    else:
+                        print(f"⏱️  {content} via {path}...")
+                        server.reset()
+                        spec = {'path': path, 'parallel': args.parallel,
+                                'urls': [server.url(content, i) for i in range(args.urls)],
+                                'out_dir': os.path.join(out_dir, f"{content}-{path}")}
+                        result = run_in_child(spec, args.timeout)
+                    items = [f"{content}/clip{i}" for i in range(args.urls)]
+                    clip_bytes = library.size(content) if content in library.kinds else 0
+                    scenarios.append(summarize(content, path, result, server, items, clip_bytes))
+        finally:
+            server.stop()
+
+    report = {
+        'environment': environment(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('scenario', 'output', 'compare')},
+        'scenarios': scenarios,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print()
+    print_table(scenarios)
+    print(f"\n💾 Results saved to {args.output}")
+    if args.compare and not compare(scenarios, report['settings'], args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
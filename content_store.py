@@ -0,0 +1,336 @@
+"""
+CONTENT STORE - One copy of every video, whichever URL it came from
+
+Mirrors and reposts of a video come with their own URLs and titles, so the
+download archive can't tell them apart and the output folder fills up with
+identical multi-GB files. The content store keeps an index of the files in
+the output folder (SQLite, next to them) by size and content hash. When a
+finished download turns out to have the same content as a file that is
+already there, it is replaced by a hardlink to that file - or a reflink, a
+copy-on-write clone, on filesystems that have them - and takes no space.
+
+- Files are grouped by size first: a content hash is only computed when
+  another file has exactly the same size, so indexing a folder of unique
+  videos costs one stat() per file
+- Post-processing embeds each source's own title and tags, so copies of
+  one video from two sites end up different. The size and hash of every
+  file as it was downloaded are kept too, and a new download is compared
+  (and linked) before it is post-processed
+- The range engine hashes a direct download while writing it
+  (ContentHasher follows the finished start of the file while it's still
+  in the page cache), so those never need a second read
+- Pre-check: before a direct download starts, files of the same size are
+  compared with the first and last MiB fetched from the server; when that
+  fingerprint matches the transfer is skipped and the file linked instead
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+BLOCK_SIZE = 1024 * 1024
+FINGERPRINT_BYTES = 1024 * 1024  # Compared at each end of a file for the pre-check
+VIDEO_EXTS = ('.mp4', '.mkv', '.webm', '.mov', '.avi', '.m4v', '.flv', '.ts',
+              '.m4a', '.mp3', '.opus', '.ogg', '.wav')
+LINK_MODES = ('hardlink', 'reflink')
+FICLONE = 0x40049409  # Linux ioctl that makes dst share src's blocks (btrfs, XFS, bcachefs...)
+
+# source_*: the file as it was downloaded, before post-processing changed it
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    fingerprint TEXT,
+    digest TEXT,
+    source_size INTEGER,
+    source_digest TEXT
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+CREATE INDEX IF NOT EXISTS files_source_size ON files (source_size);
+"""
+
+
+def _new_hash():
+    return hashlib.blake2b(digest_size=20)
+
+
+def fingerprint_ranges(size):
+    """(start, end) byte ranges, end inclusive, that make up a file's fingerprint"""
+    if size <= 2 * FINGERPRINT_BYTES:
+        return [(0, size - 1)] if size else []
+    return [(0, FINGERPRINT_BYTES - 1), (size - FINGERPRINT_BYTES, size - 1)]
+
+
+def fingerprint_of(size, parts):
+    """Fingerprint from the size and the data of fingerprint_ranges(size), in order"""
+    hasher = _new_hash()
+    hasher.update(str(size).encode())
+    for data in parts:
+        hasher.update(data)
+    return hasher.hexdigest()
+
+
+def file_fingerprint(path, size):
+    parts = []
+    with open(path, 'rb') as f:
+        for start, end in fingerprint_ranges(size):
+            f.seek(start)
+            parts.append(f.read(end + 1 - start))
+    return fingerprint_of(size, parts)
+
+
+def file_digest(path):
+    """Content hash of a whole file"""
+    hasher = _new_hash()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(BLOCK_SIZE), b''):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+class ContentHasher:
+    """Hashes a file while it's being written, as far as it's complete from the start
+
+    A sequential writer hands over its data with update(); one that writes
+    chunks out of order calls follow(path, end) whenever the complete part
+    at the start of the file has grown to `end` bytes.
+    """
+
+    def __init__(self):
+        self._hash = _new_hash()
+        self.position = 0
+        self._file = None
+
+    def update(self, data):
+        self._hash.update(data)
+        self.position += len(data)
+
+    def follow(self, path, end):
+        if self.position >= end:
+            return
+        if self._file is None:
+            self._file = open(path, 'rb')
+        self._file.seek(self.position)
+        while self.position < end:
+            data = self._file.read(min(BLOCK_SIZE, end - self.position))
+            if not data:
+                break
+            self.update(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _reflink(source, target):
+    import fcntl  # Not on Windows; the OSError below covers that too
+    with open(source, 'rb') as src, open(target, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def link_file(source, target, mode='hardlink'):
+    """Make target a link (or clone) of source, replacing what's at target atomically
+
+    Raises OSError when the filesystem can't do it (e.g. different drives,
+    or no reflink support); target is left as it was then.
+    """
+    temp = target + '.dedup'
+    try:
+        if mode == 'reflink':
+            try:
+                _reflink(source, temp)
+            except ImportError:
+                raise OSError("reflinks need Linux") from None
+        else:
+            os.link(source, temp)
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+class ContentStore:
+    """Size/hash index of the files in a folder, safe to share between threads"""
+
+    def __init__(self, path, link_mode='hardlink'):
+        self.path = str(path)
+        if link_mode not in LINK_MODES:
+            raise ValueError(f"link_mode must be one of {', '.join(LINK_MODES)}")
+        self.link_mode = link_mode
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._link_lock = threading.Lock()  # One find-and-link at a time, so two copies can't link to each other
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def scan(self, directory):
+        """Bring the index up to date with the video files in a folder; returns how many there are"""
+        found = {}
+        for root, _dirs, names in os.walk(directory):
+            for name in names:
+                if name.lower().endswith(VIDEO_EXTS):
+                    path = os.path.abspath(os.path.join(root, name))
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (st.st_size, st.st_mtime)
+        prefix = os.path.join(os.path.abspath(directory), '')
+        with self._lock, self._db:
+            known = {path: (size, mtime) for path, size, mtime in self._db.execute(
+                'SELECT path, size, mtime FROM files WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))}
+            self._db.executemany('DELETE FROM files WHERE path = ?',
+                                 [(path,) for path in known if path not in found])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO files (path, size, mtime) VALUES (?, ?, ?)',
+                [(path, size, mtime) for path, (size, mtime) in found.items() if known.get(path) != (size, mtime)])
+        return len(found)
+
+    def _remember(self, path, size, mtime, fingerprint=None, digest=None, source_size=None, source_digest=None):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (path, size, mtime, fingerprint, digest, source_size, source_digest))
+
+    def _forget(self, path):
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+    def _store_hash(self, path, column, value):
+        with self._lock, self._db:
+            self._db.execute(f'UPDATE files SET {column} = ? WHERE path = ?', (value, path))
+
+    def _candidates(self, size, exclude=None):
+        """Indexed files of this size (now or as downloaded) that are still what the index says
+
+        Yields dicts with the path, whether its current size matches, its
+        fingerprint/digest (None if not worked out yet) and the digest of
+        its downloaded form if that had this size.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT path, size, mtime, fingerprint, digest, source_size, source_digest FROM files '
+                'WHERE size = ? OR source_size = ?', (size, size)).fetchall()
+        for path, known_size, mtime, fingerprint, digest, source_size, source_digest in rows:
+            if path == exclude:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._forget(path)
+                continue
+            if (st.st_size, st.st_mtime) != (known_size, mtime):
+                self._remember(path, st.st_size, st.st_mtime)  # Changed since: nothing known holds
+                if st.st_size != size:
+                    continue
+                fingerprint = digest = source_digest = None
+            yield {'path': path, 'same_size': st.st_size == size, 'fingerprint': fingerprint,
+                   'digest': digest, 'source': source_digest if source_size == size else None}
+
+    def has_size(self, size):
+        """Whether a pre-check for a file of this size is worth the two range requests"""
+        return any(candidate['same_size'] for candidate in self._candidates(size))
+
+    def match_fingerprint(self, size, fingerprint):
+        """An indexed file with this size and fingerprint, or None"""
+        for candidate in self._candidates(size):
+            if not candidate['same_size']:
+                continue
+            known = candidate['fingerprint']
+            if known is None:
+                try:
+                    known = file_fingerprint(candidate['path'], size)
+                except OSError:
+                    continue
+                self._store_hash(candidate['path'], 'fingerprint', known)
+            if known == fingerprint:
+                return candidate['path']
+        return None
+
+    def find(self, path, digest=None):
+        """(indexed file with the same content or None, path's digest if it had to be worked out)"""
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        for candidate in self._candidates(size, exclude=path):
+            if digest is None:
+                digest = file_digest(path)
+            if candidate['source'] == digest:
+                return candidate['path'], digest
+            if not candidate['same_size']:
+                continue
+            known = candidate['digest']
+            if known is None:
+                try:
+                    known = file_digest(candidate['path'])
+                except OSError:
+                    continue
+                self._store_hash(candidate['path'], 'digest', known)
+            if known == digest:
+                return candidate['path'], digest
+        return None, digest
+
+    def digest(self, path):
+        """Content hash of an indexed file (worked out now if the index has none yet)"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime, digest FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[2] and (row[0], row[1]) == (st.st_size, st.st_mtime):
+            return row[2]
+        digest = file_digest(path)
+        self._remember(path, st.st_size, st.st_mtime, digest=digest)
+        return digest
+
+    def add(self, path, digest=None, source=None):
+        """Index a file; source is (size, digest) of what was downloaded, if post-processing changed it"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        source_size, source_digest = source or (None, None)
+        self._remember(path, st.st_size, st.st_mtime, digest=digest,
+                       source_size=source_size, source_digest=source_digest)
+
+    def deduplicate(self, path, digest=None):
+        """Replace a new file with a link to an indexed file of the same content
+
+        Returns that file's path, or None when the content is new (the file
+        is indexed then). Raises OSError if linking fails.
+        """
+        path = os.path.abspath(path)
+        with self._link_lock:
+            existing, digest = self.find(path, digest)
+            if existing is None or os.path.samefile(existing, path):
+                self.add(path, digest)
+                return None
+            link_file(existing, path, self.link_mode)
+            self._relink(existing, path)
+        return existing
+
+    def link(self, existing, path):
+        """Put a link to an indexed file at path (a download the pre-check found to be a duplicate)"""
+        path = os.path.abspath(path)
+        with self._link_lock:
+            link_file(existing, path, self.link_mode)
+            self._relink(existing, path)
+
+    def _relink(self, existing, path):
+        """Index path as a copy of existing"""
+        with self._lock:
+            row = self._db.execute('SELECT fingerprint, digest, source_size, source_digest FROM files '
+                                   'WHERE path = ?', (existing,)).fetchone()
+        st = os.stat(path)
+        self._remember(path, st.st_size, st.st_mtime, *(row or ()))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
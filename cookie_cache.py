@@ -0,0 +1,172 @@
+"""
+COOKIE CACHE - Read the browser's cookies once per session, not once per video
+
+`--cookies-from-browser` makes every yt-dlp run open the browser's cookie
+database again, copy it and decrypt every cookie in it - seconds per video,
+and it fails outright while the browser holds a lock on the file. The cache
+extracts them once (through yt-dlp's own extractor) and hands every job the
+cookies of its website only:
+
+- in-process sessions get them put into their cookie jar
+- yt-dlp processes get a small Netscape cookie file (`--cookies`) that is
+  deleted when the job ends
+- the cookies are read again only when the database file changes (the
+  browser logged in or refreshed a session) or when a cookie a job needs
+  has expired since they were read
+- when reading fails, jobs run without cookies and it's tried again once
+  the database changes, or after RETRY_SECONDS
+"""
+
+import copy
+import os
+import re
+import tempfile
+import threading
+import time
+
+import ytdlp_engine
+from download_scheduler import get_host
+
+RETRY_SECONDS = 300  # After a failed read, try again this soon even if the database looks unchanged
+
+_DB_PATH_RE = re.compile(r'Extracting cookies from: "(.+)"')
+
+
+class _ExtractLogger:
+    """Logger for yt-dlp's cookie extraction: notes the database path, passes warnings on"""
+
+    def __init__(self, log=None):
+        self.log = log
+        self.database = None
+
+    def debug(self, message):
+        match = _DB_PATH_RE.search(message)
+        if match:
+            self.database = match.group(1)
+
+    def info(self, message):
+        self.debug(message)
+
+    def warning(self, message, only_once=False):
+        if self.log is not None:
+            self.log(f"⚠️  Cookies: {message}", "WARNING")
+
+    def error(self, message):
+        if self.log is not None:
+            self.log(f"❌ Cookies: {message}", "ERROR")
+
+    def progress_bar(self):
+        return None
+
+
+def _file_state(path):
+    """What changes when the browser writes its cookie database (WAL/journal included)"""
+    state = []
+    for name in (path, path + '-wal', path + '-journal'):
+        try:
+            st = os.stat(name)
+        except OSError:
+            state.append(None)
+        else:
+            state.append((st.st_mtime_ns, st.st_size))
+    return tuple(state)
+
+
+def matches_site(cookie_domain, site):
+    """Whether a cookie set for cookie_domain belongs to a site (a get_host() name)"""
+    domain = cookie_domain.lstrip('.').lower()
+    return domain == site or domain.endswith('.' + site) or site.endswith('.' + domain)
+
+
+class BrowserCookieCache:
+    """The cookies of one browser (profile), shared by all jobs; thread-safe
+
+    `browser` is what --cookies-from-browser takes ("chrome",
+    "firefox:default-release", ...). log(message, level) receives warnings.
+    """
+
+    def __init__(self, browser, log=None):
+        self.browser = browser
+        self.log = log
+        self._lock = threading.Lock()
+        self._cookies = None  # Cookies of the last read, None before the first
+        self._loaded_at = 0.0
+        self._database = None
+        self._state = None
+        self.error = None
+        self.generation = 0  # Goes up with every read, so holders of older copies notice
+        self.reads = 0
+
+    def _spec(self):
+        _urls, params = ytdlp_engine.options_from_command(['yt-dlp', '--cookies-from-browser', self.browser])
+        return params['cookiesfrombrowser']
+
+    def _read(self):
+        yt_dlp = ytdlp_engine.load_yt_dlp()
+        logger = _ExtractLogger(self.log)
+        self.reads += 1
+        self._loaded_at = time.time()
+        try:
+            browser, profile, keyring, container = self._spec()
+            jar = yt_dlp.cookies.extract_cookies_from_browser(
+                browser, profile, logger, keyring=keyring, container=container)
+        except Exception as e:  # Locked or unreadable database, no keyring, bad browser name...
+            self._cookies = []
+            self.error = str(e) or type(e).__name__
+            if self.log is not None:
+                self.log(f"⚠️  Could not read {self.browser} cookies ({self.error}) - "
+                         f"downloading without them (close the browser and it's tried again)", "WARNING")
+        else:
+            self._cookies = list(jar)
+            self.error = None
+            if self.log is not None:
+                self.log(f"🍪 Read {len(self._cookies)} cookies from {self.browser}", "INFO")
+        self._database = logger.database
+        self._state = _file_state(self._database) if self._database else None
+        self.generation += 1
+
+    def _stale(self, cookies):
+        if self._cookies is None:
+            return True
+        if self._database and _file_state(self._database) != self._state:
+            return True
+        now = time.time()
+        if self.error is not None:
+            return now - self._loaded_at >= RETRY_SECONDS
+        # Expired since the last read: the browser has probably renewed it by now
+        return any(cookie.expires and self._loaded_at < cookie.expires <= now for cookie in cookies)
+
+    def cookies_for(self, url):
+        """(generation, the cookies of url's website), read from the browser if needed"""
+        site = get_host(url)
+        with self._lock:
+            cookies = [cookie for cookie in self._cookies or () if matches_site(cookie.domain, site)]
+            if self._stale(cookies):
+                self._read()
+                cookies = [cookie for cookie in self._cookies if matches_site(cookie.domain, site)]
+            return self.generation, cookies
+
+    def apply(self, session, url):
+        """Bring an in-process YtDlpSession's cookie jar up to date for url's website"""
+        generation, cookies = self.cookies_for(url)
+        if session.cookie_generation != generation:
+            jar = session.ydl.cookiejar
+            for cookie in cookies:
+                jar.set_cookie(copy.copy(cookie))
+            session.cookie_generation = generation
+
+    def write_file(self, url):
+        """A Netscape cookie file with url's cookies, for `--cookies` (None if there are none)
+
+        The caller deletes the file; yt-dlp writes its cookies back into it on exit.
+        """
+        _generation, cookies = self.cookies_for(url)
+        if not cookies:
+            return None
+        fd, path = tempfile.mkstemp(prefix='yt-dlp-cookies-', suffix='.txt')  # Readable by us only
+        os.close(fd)
+        jar = ytdlp_engine.load_yt_dlp().cookies.YoutubeDLCookieJar(path)
+        for cookie in cookies:
+            jar.set_cookie(copy.copy(cookie))  # save() rewrites session cookies' expiry
+        jar.save()
+        return path
@@ -0,0 +1,442 @@
+"""
+DASH ENGINE - Native downloader for .mpd streams
+
+DASH keeps video and audio in separate tracks. The usual route downloads
+each track to its own temporary file and only then merges them, which takes
+twice the disk space and leaves the merge waiting on the slower track. This
+engine instead:
+
+1. Parses the MPD (SegmentTemplate with $Number$/$Time$ and SegmentTimeline,
+   SegmentList, and SegmentBase with a sidx index range)
+2. Picks the best video representation under MAX_QUALITY and the best audio
+3. Downloads both tracks at the same time, segments in parallel per track
+4. Streams both straight into ffmpeg through a loopback HTTP feed, so the
+   only file written is the final .mp4
+
+Multi-period manifests and DRM-protected streams raise DashError so the
+caller can fall back to yt-dlp.
+"""
+
+import asyncio
+import math
+import os
+import queue
+import re
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+from adaptive_concurrency import THROTTLE_STATUSES
+from disk_space import finish_file
+from http_pool import ConnectionPool, HttpError, fetch_ordered
+
+SEGMENT_RETRIES = 3
+
+
+class DashError(Exception):
+    """The manifest can't be handled by the native engine"""
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _children(element, name):
+    return [child for child in element if _local(child.tag) == name] if element is not None else []
+
+
+def _child(element, name):
+    found = _children(element, name)
+    return found[0] if found else None
+
+
+def _first_of(*elements):
+    return next((element for element in elements if element is not None), None)
+
+
+def _base_url(element, base):
+    node = _child(element, 'BaseURL')
+    return urljoin(base, node.text.strip()) if node is not None and node.text else base
+
+
+def parse_duration(value):
+    """ISO 8601 duration (PT1H2M3.5S) to seconds"""
+    match = re.match(
+        r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:([\d.]+)S)?)?$', (value or '').strip())
+    if not match:
+        return None
+    days, hours, minutes, seconds = match.groups()
+    return (int(days or 0) * 86400 + int(hours or 0) * 3600
+            + int(minutes or 0) * 60 + float(seconds or 0))
+
+
+def _fill_template(template, rep_id, bandwidth, number=None, time_=None):
+    def replace(match):
+        name, fmt = match.group(1), match.group(2)
+        if name == '':
+            return '$'
+        value = {'RepresentationID': rep_id, 'Bandwidth': bandwidth,
+                 'Number': number, 'Time': time_}.get(name)
+        if value is None:
+            return match.group(0)
+        if fmt and name != 'RepresentationID':
+            return fmt % int(value)
+        return str(value)
+    return re.sub(r'\$(\w*)(%0\d+d)?\$', replace, template)
+
+
+def parse_sidx(data, index_start):
+    """Return the (offset, length) byte ranges listed in a sidx box"""
+    pos = data.find(b'sidx')
+    if pos < 4:
+        raise DashError("No sidx box in index range")
+    box_start = pos - 4
+    box_size = struct.unpack('>I', data[box_start:pos])[0]
+    version = data[pos + 4]
+    p = pos + 8 + 4 + 4  # version/flags, reference_ID, timescale
+    if version == 0:
+        _earliest, first_offset = struct.unpack('>II', data[p:p + 8])
+        p += 8
+    else:
+        _earliest, first_offset = struct.unpack('>QQ', data[p:p + 16])
+        p += 16
+    count = struct.unpack('>H', data[p + 2:p + 4])[0]
+    p += 4
+    offset = index_start + box_start + box_size + first_offset
+    ranges = []
+    for _ in range(count):
+        size = struct.unpack('>I', data[p:p + 4])[0] & 0x7FFFFFFF
+        ranges.append((offset, size))
+        offset += size
+        p += 12
+    return ranges
+
+
+class Representation:
+    """One selectable track: its attributes and how to find its segments"""
+
+    def __init__(self, element, adaptation, base_url, period_duration):
+        attrs = dict(adaptation.attrib)
+        attrs.update(element.attrib)
+        self.id = attrs.get('id', '')
+        self.bandwidth = int(attrs.get('bandwidth') or 0)
+        self.width = int(attrs['width']) if attrs.get('width') else None
+        self.height = int(attrs['height']) if attrs.get('height') else None
+        mime = attrs.get('mimeType') or ''
+        content = attrs.get('contentType') or mime.split('/')[0]
+        self.kind = content if content in ('video', 'audio') else 'other'
+        self.codecs = attrs.get('codecs')
+        self.base_url = base_url
+        self.duration = period_duration
+        self.element = element
+        self.adaptation = adaptation
+        self.index_range = None  # Set for SegmentBase: (start, end) of the sidx box
+        self.segments = self._build_segments()  # [(url, (start, end) or None)], init first
+
+    def _template(self):
+        merged = {}
+        timeline = None
+        for node in (_child(self.adaptation, 'SegmentTemplate'), _child(self.element, 'SegmentTemplate')):
+            if node is not None:
+                merged.update(node.attrib)
+                timeline = _first_of(_child(node, 'SegmentTimeline'), timeline)
+        return (merged, timeline) if merged else (None, None)
+
+    def _build_segments(self):
+        template, timeline = self._template()
+        if template is not None:
+            return self._template_segments(template, timeline)
+        seg_list = _first_of(_child(self.element, 'SegmentList'), _child(self.adaptation, 'SegmentList'))
+        if seg_list is not None:
+            return self._list_segments(seg_list)
+        seg_base = _first_of(_child(self.element, 'SegmentBase'), _child(self.adaptation, 'SegmentBase'))
+        if seg_base is not None and seg_base.get('indexRange'):
+            start, end = (int(v) for v in seg_base.get('indexRange').split('-'))
+            self.index_range = (start, end)
+            init = _child(seg_base, 'Initialization')
+            init_range = init.get('range') if init is not None else None
+            init_start, init_end = (int(v) for v in init_range.split('-')) if init_range else (0, start - 1)
+            return [(self.base_url, (init_start, init_end))]  # Media ranges are read from the sidx later
+        return [(self.base_url, None)]  # A single plain file
+
+    def _template_segments(self, t, timeline):
+        rep_id, bandwidth = self.id, self.bandwidth
+        segments = []
+        if t.get('initialization'):
+            segments.append((urljoin(self.base_url, _fill_template(t['initialization'], rep_id, bandwidth)), None))
+        media = t.get('media')
+        if not media:
+            raise DashError("SegmentTemplate without media attribute")
+        number = int(t.get('startNumber', 1))
+        timescale = int(t.get('timescale', 1))
+        if timeline is not None:
+            time_ = 0
+            entries = _children(timeline, 'S')
+            end_time = (self.duration or 0) * timescale + int(t.get('presentationTimeOffset', 0))
+            for i, s in enumerate(entries):
+                time_ = int(s.get('t', time_))
+                d = int(s.get('d'))
+                repeat = int(s.get('r', 0))
+                if repeat < 0:
+                    next_t = int(entries[i + 1].get('t')) if i + 1 < len(entries) and entries[i + 1].get('t') else end_time
+                    repeat = max(0, math.ceil((next_t - time_) / d) - 1)
+                for _ in range(repeat + 1):
+                    segments.append((urljoin(self.base_url, _fill_template(media, rep_id, bandwidth, number, time_)), None))
+                    time_ += d
+                    number += 1
+        else:
+            if not t.get('duration') or not self.duration:
+                raise DashError("Can't work out the segment count (live stream?)")
+            count = math.ceil(self.duration * timescale / int(t['duration']))
+            for n in range(number, number + count):
+                segments.append((urljoin(self.base_url, _fill_template(media, rep_id, bandwidth, n)), None))
+        return segments
+
+    def _list_segments(self, seg_list):
+        def byte_range(value):
+            return tuple(int(v) for v in value.split('-')) if value else None
+        segments = []
+        init = _child(seg_list, 'Initialization')
+        if init is not None:
+            segments.append((urljoin(self.base_url, init.get('sourceURL') or ''), byte_range(init.get('range'))))
+        for node in _children(seg_list, 'SegmentURL'):
+            segments.append((urljoin(self.base_url, node.get('media') or ''), byte_range(node.get('mediaRange'))))
+        return segments
+
+
+def parse_mpd(text, mpd_url):
+    """Return every Representation in a static single-period MPD"""
+    root = ET.fromstring(text)
+    if root.get('type') == 'dynamic':
+        raise DashError("Live DASH streams are not supported")
+    periods = _children(root, 'Period')
+    if len(periods) != 1:
+        raise DashError(f"Manifest has {len(periods)} periods, only single-period is supported")
+    period = periods[0]
+    duration = parse_duration(period.get('duration') or root.get('mediaPresentationDuration'))
+    base = _base_url(period, _base_url(root, mpd_url))
+    representations = []
+    for adaptation in _children(period, 'AdaptationSet'):
+        if _children(adaptation, 'ContentProtection'):
+            raise DashError("Stream is DRM protected")
+        adaptation_base = _base_url(adaptation, base)
+        for element in _children(adaptation, 'Representation'):
+            if _children(element, 'ContentProtection'):
+                raise DashError("Stream is DRM protected")
+            representations.append(
+                Representation(element, adaptation, _base_url(element, adaptation_base), duration))
+    return representations
+
+
+def choose_tracks(representations, max_height):
+    """Best video under max_height plus best audio (either may be missing)"""
+    max_height = int(max_height)
+    videos = [r for r in representations if r.kind == 'video']
+    audios = [r for r in representations if r.kind == 'audio']
+    tracks = []
+    if videos:
+        fitting = [r for r in videos if r.height is None or r.height <= max_height] or \
+            [min(videos, key=lambda r: (r.height or 0, r.bandwidth))]
+        tracks.append(max(fitting, key=lambda r: (r.height or 0, r.bandwidth)))
+    if audios:
+        tracks.append(max(audios, key=lambda r: r.bandwidth))
+    if not tracks:
+        raise DashError("No audio or video representations found")
+    return tracks
+
+
+class TrackFeeds:
+    """Loopback HTTP server that hands track data to ffmpeg as it arrives
+
+    Each track gets a bounded queue; a producer blocks once ffmpeg falls
+    behind, so at most `max_chunks` pieces per track sit in memory.
+    """
+
+    def __init__(self, names, max_chunks=8):
+        self.queues = {name: queue.Queue(max_chunks) for name in names}
+        self.closed = threading.Event()
+        feeds = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                track = feeds.queues.get(self.path.strip('/'))
+                if track is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.end_headers()
+                try:
+                    while True:
+                        data = track.get()
+                        if data is None:
+                            return
+                        self.wfile.write(data)
+                except OSError:
+                    feeds.closed.set()  # ffmpeg went away
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, name):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/{name}"
+
+    def put(self, name, data):
+        """Queue data for a track (blocking); raises DashError if the muxer stopped"""
+        while not self.closed.is_set():
+            try:
+                self.queues[name].put(data, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise DashError("Muxer stopped reading")
+
+    def close(self):
+        self.closed.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DashDownloader:
+    """Downloads one DASH stream, muxing audio and video on the fly"""
+
+    def __init__(self, url, output_path, max_height=1080, concurrency=8,
+                 buffer_segments=16, headers=None, verify=True, on_progress=None, controller=None,
+                 bandwidth=None, fsync='resume'):
+        self.url = url
+        self.output_path = os.path.splitext(str(output_path))[0] + '.mp4'
+        self.max_height = max_height
+        # A ConcurrencyController (optional) sets how many fetchers per track run
+        self.controller = controller
+        self.concurrency = controller.maximum if controller is not None else concurrency
+        self.buffer_segments = buffer_segments
+        self.headers = headers or {}
+        self.verify = verify
+        self.on_progress = on_progress
+        self.bandwidth = bandwidth  # BandwidthShare, optional
+        self.fsync = fsync  # One of disk_space.FSYNC_POLICIES
+        self.stats = {'tracks': [], 'segments': 0, 'segments_done': 0, 'bytes': 0,
+                      'retries': 0, 'connections': 0, 'elapsed': 0.0}
+
+    def download(self):
+        """Blocking entry point; returns the path of the finished file"""
+        return asyncio.run(self.run())
+
+    async def run(self):
+        ffmpeg = shutil.which('ffmpeg')
+        if not ffmpeg:
+            raise DashError("ffmpeg is needed to mux DASH streams")
+        started = time.time()
+        # Both tracks run at once, each with its own set of segment fetchers
+        pool = ConnectionPool(max_per_host=self.concurrency * 2, headers=self.headers, verify=self.verify,
+                              bandwidth=self.bandwidth)
+        try:
+            text = (await pool.get(self.url)).decode('utf-8', 'replace')
+            tracks = choose_tracks(parse_mpd(text, self.url), self.max_height)
+            for track in tracks:
+                if track.index_range is not None:
+                    await self._resolve_index(pool, track)
+            self.stats['tracks'] = [
+                {'kind': t.kind, 'id': t.id, 'bandwidth': t.bandwidth, 'height': t.height} for t in tracks]
+            self.stats['segments'] = sum(len(t.segments) for t in tracks)
+            await self._download_and_mux(ffmpeg, pool, tracks)
+        finally:
+            self.stats['connections'] = pool.connections_opened
+            await pool.close()
+        self.stats['elapsed'] = time.time() - started
+        return self.output_path
+
+    async def _resolve_index(self, pool, track):
+        """Turn a SegmentBase index range into explicit segment byte ranges"""
+        start, end = track.index_range
+        index = await pool.get(track.base_url, {'Range': f"bytes={start}-{end}"})
+        init = track.segments[0]
+        track.segments = [init] + [
+            (track.base_url, (offset, offset + size - 1)) for offset, size in parse_sidx(index, start)]
+
+    async def _fetch(self, pool, segment):
+        url, byte_range = segment
+        headers = {'Range': f"bytes={byte_range[0]}-{byte_range[1]}"} if byte_range else None
+        for attempt in range(SEGMENT_RETRIES + 1):
+            started = time.time()
+            try:
+                data = await pool.get(url, headers)
+                if self.controller is not None:
+                    self.controller.record(len(data), time.time() - started)
+                return data
+            except (HttpError, ConnectionError, OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as e:
+                if self.controller is not None:
+                    self.controller.record_error(isinstance(e, HttpError) and e.status in THROTTLE_STATUSES)
+                if attempt == SEGMENT_RETRIES or (isinstance(e, HttpError) and e.status in (401, 403, 404)):
+                    raise
+                self.stats['retries'] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def _download_track(self, pool, track, feeds):
+        loop = asyncio.get_running_loop()
+
+        async def write(index, data):
+            await loop.run_in_executor(None, feeds.put, track.kind, data)
+            self.stats['segments_done'] += 1
+            self.stats['bytes'] += len(data)
+            if self.on_progress:
+                self.on_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': self.stats['bytes'],
+                    'fragment_index': self.stats['segments_done'],
+                    'fragment_count': self.stats['segments'],
+                })
+
+        await fetch_ordered(
+            track.segments, lambda segment: self._fetch(pool, segment), write,
+            self.concurrency, self.buffer_segments, self.controller)
+        await loop.run_in_executor(None, feeds.put, track.kind, None)
+
+    async def _download_and_mux(self, ffmpeg, pool, tracks):
+        loop = asyncio.get_running_loop()
+        feeds = TrackFeeds([t.kind for t in tracks])
+        part_path = self.output_path + '.part'
+        cmd = [ffmpeg, '-y', '-loglevel', 'error']
+        for track in tracks:
+            cmd += ['-seekable', '0', '-i', feeds.url(track.kind)]
+        for i in range(len(tracks)):
+            cmd += ['-map', f'{i}:{"v" if tracks[i].kind == "video" else "a"}:0']
+        cmd += ['-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', part_path]
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        muxer = loop.run_in_executor(None, process.communicate)
+        # If ffmpeg dies early, unblock the producers instead of waiting forever
+        muxer.add_done_callback(lambda _f: feeds.closed.set())
+        downloads = [asyncio.ensure_future(self._download_track(pool, t, feeds)) for t in tracks]
+        try:
+            try:
+                await asyncio.gather(*downloads)
+            finally:
+                # One track failed: stop the other too instead of feeding a muxer that's going away
+                for task in downloads:
+                    task.cancel()
+                await asyncio.gather(*downloads, return_exceptions=True)
+            _stdout, stderr = await muxer
+        except BaseException:
+            process.kill()
+            process.wait()  # Reap it, or it lingers as a zombie
+            # A half-written mp4 can't be resumed, and nothing else would clean it up
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        finally:
+            feeds.close()
+        if process.returncode != 0:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise DashError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[-300:]}")
+        finish_file(part_path, self.output_path, self.fsync)
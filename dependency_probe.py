@@ -0,0 +1,178 @@
+"""
+DEPENDENCY PROBE - Find yt-dlp and ffmpeg without slowing down startup
+
+Checking tools the obvious way (`yt-dlp --version`, `ffmpeg -version`) spawns
+a process per tool on every start, which costs from a few hundred ms to
+seconds on Windows. This probe:
+
+- runs on a background thread, so the window/CLI doesn't wait for it
+- reads the yt_dlp package version straight from its version.py
+- caches what the executables reported in a small JSON file, keyed by
+  executable path + modification time + size, so a warm start spawns
+  nothing and an upgraded tool is noticed right away
+"""
+
+import importlib.util
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+
+from probe_cache import default_cache_dir
+
+CACHE_FILE = 'dependencies.json'
+VERSION_TIMEOUT = 10  # seconds a `--version` call may take
+
+_VERSION_RE = re.compile(r"""__version__\s*=\s*['"]([^'"]+)['"]""")
+
+
+def file_key(path):
+    """Cache key for an executable: path, mtime and size"""
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}"
+
+
+def yt_dlp_module_info():
+    """{'found', 'path', 'version'} for the importable yt_dlp package, without importing it"""
+    try:
+        spec = importlib.util.find_spec('yt_dlp')
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        return {'found': False, 'path': None, 'version': None}
+    version = None
+    if spec.origin and os.path.isfile(spec.origin):
+        try:
+            with open(os.path.join(os.path.dirname(spec.origin), 'version.py'), encoding='utf-8') as f:
+                match = _VERSION_RE.search(f.read())
+            version = match.group(1) if match else None
+        except OSError:
+            pass
+    if version is None:
+        # Frozen builds (PyInstaller) have no source files to read
+        try:
+            from yt_dlp.version import __version__ as version
+        except ImportError:
+            return {'found': False, 'path': None, 'version': None}
+    return {'found': True, 'path': spec.origin, 'version': version}
+
+
+class DependencyProbe:
+    """Looks up yt-dlp and ffmpeg once per start, in the background, with an on-disk cache"""
+
+    def __init__(self, cache_path=None, ffmpeg_paths=()):
+        self.cache_path = str(cache_path or os.path.join(default_cache_dir(), CACHE_FILE))
+        self.ffmpeg_paths = list(ffmpeg_paths)  # Fallback locations when ffmpeg isn't on PATH
+        self.results = None
+        self._thread = None
+
+    def start(self, callback=None):
+        """Probe on a background thread; callback(results) runs there when done"""
+        def run():
+            self.run()
+            if callback is not None:
+                callback(self.results)
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        """Results of start(), probing in this thread if it was never started"""
+        if self._thread is None:
+            return self.run()
+        self._thread.join(timeout)
+        return self.results
+
+    def run(self):
+        """Probe everything now; returns the results dict (also kept in self.results)
+
+        {'yt_dlp_module': info, 'yt-dlp': info, 'ffmpeg': info,
+         'elapsed': seconds, 'spawned': processes started}
+        where info is {'found', 'path', 'version', 'cached'}.
+        """
+        started = time.perf_counter()
+        cache = self._load_cache()
+        spawned = 0
+        results = {'yt_dlp_module': dict(yt_dlp_module_info(), cached=False)}
+        ffmpeg = shutil.which('ffmpeg') or next(
+            (path for path in self.ffmpeg_paths if os.path.exists(path)), None)
+        for name, path, args in (('yt-dlp', shutil.which('yt-dlp'), ['--version']),
+                                 ('ffmpeg', ffmpeg, ['-version'])):
+            if path is None:
+                results[name] = {'found': False, 'path': None, 'version': None, 'cached': False}
+                continue
+            try:
+                key = file_key(path)
+            except OSError:
+                key = None
+            if key is not None and key in cache:
+                results[name] = dict(cache[key], cached=True)
+                continue
+            spawned += 1
+            info = {'found': False, 'path': path, 'version': None}
+            try:
+                result = subprocess.run([path] + args, capture_output=True, text=True,
+                                        errors='replace', timeout=VERSION_TIMEOUT)
+                if result.returncode == 0:
+                    info['found'] = True
+                    info['version'] = self._parse_version(name, result.stdout)
+            except (OSError, subprocess.SubprocessError):
+                pass
+            if key is not None and info['found']:
+                # Entries for an older build of the same file are stale now
+                for old in [k for k, v in cache.items() if v.get('path') == path]:
+                    del cache[old]
+                cache[key] = info
+            results[name] = dict(info, cached=False)
+        if spawned:
+            self._save_cache(cache)
+        results['elapsed'] = time.perf_counter() - started
+        results['spawned'] = spawned
+        self.results = results
+        return results
+
+    @staticmethod
+    def _parse_version(name, output):
+        line = output.strip().splitlines()[0] if output.strip() else ''
+        if name == 'ffmpeg':
+            # "ffmpeg version 6.1.1-full_build-www.gyan.dev Copyright ..."
+            words = line.split()
+            return words[2] if len(words) > 2 and words[1] == 'version' else line
+        return line
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                cache = json.load(f)
+            return cache if isinstance(cache, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            tmp_path = self.cache_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f, indent=1)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass  # A read-only cache folder only costs the next start some time
+
+    def invalidate(self):
+        """Forget cached results (e.g. after installing or upgrading a tool)"""
+        try:
+            os.remove(self.cache_path)
+        except OSError:
+            pass
+
+
+def describe(results):
+    """One-line summary of how long probing took and whether the cache helped"""
+    if results['spawned']:
+        how = f"{results['spawned']} tool(s) checked"
+    else:
+        how = "all from cache"
+    return f"{results['elapsed'] * 1000:.0f} ms, {how}"
@@ -0,0 +1,217 @@
+"""
+DISK SPACE - Don't start downloads the output drive can't hold
+
+A download that runs out of disk space fails at the very end - usually while
+the video and audio are merged, after every byte was fetched. DiskBudget
+checks first: each job reserves its expected size (from the formats found
+at extraction, times a headroom for the copy post-processing writes) before
+its transfer starts, and only starts if that fits next to what the running
+jobs still need. A job that doesn't fit waits for running ones to finish,
+or fails straight away when nothing is running that could free anything.
+What a job has written already comes off its reservation as its progress
+events arrive.
+
+Direct files are preallocated at their full size (the range engine), so a
+full drive shows up before the transfer instead of at 95%.
+
+fsync policy (FSYNC_POLICIES), how hard the engines push data to the disk:
+
+    none    never; fastest, but a power cut can lose recently finished files
+    resume  before every resume map update and once a file is complete (default)
+    full    as resume, and the folder too after a finished file is renamed
+            into place, so the new name itself survives a power cut
+"""
+
+import errno
+import os
+import shutil
+import threading
+
+FSYNC_POLICIES = ('none', 'resume', 'full')
+WAIT_POLL = 5.0  # seconds between free space checks while a job waits
+
+
+class DiskSpaceError(Exception):
+    """The download doesn't fit on the drive"""
+
+
+def _format_size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    if fmt.get('tbr') and duration:
+        return fmt['tbr'] * 1000 / 8 * duration  # tbr is in kbit/s
+    return None
+
+
+def expected_size(info, max_height=None):
+    """Bytes a download of this extraction result will likely need (None if there's no telling)
+
+    On the generous side: for raw (not yet format-selected) results the
+    largest formats within max_height are assumed.
+    """
+    if not info or info.get('_type') in ('playlist', 'multi_video'):
+        return None
+    duration = info.get('duration')
+    if info.get('requested_formats'):
+        sizes = [_format_size(fmt, duration) for fmt in info['requested_formats']]
+        return int(sum(sizes)) if all(sizes) else None
+    formats = info.get('formats')
+    if not formats:
+        size = _format_size(info, duration)
+        return int(size) if size else None
+    combined, video, audio = [0], [0], [0]
+    for fmt in formats:
+        height = fmt.get('height')
+        if max_height and height and height > int(max_height):
+            continue
+        size = _format_size(fmt, duration)
+        if not size:
+            continue
+        if fmt.get('vcodec') == 'none':
+            audio.append(size)
+        elif fmt.get('acodec') == 'none':
+            video.append(size)
+        else:
+            combined.append(size)
+    size = max(max(combined), max(video) + max(audio))
+    return int(size) if size else None
+
+
+def preallocate(fd, size):
+    """Reserve the full file size up front (sparse file if the filesystem can't allocate)
+
+    Raises DiskSpaceError when the drive is too full for it.
+    """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise DiskSpaceError(f"Not enough disk space for {size / 1024 ** 2:.0f} MB") from e
+            # e.g. filesystems without fallocate support
+    os.ftruncate(fd, size)
+
+
+def sync_directory(path):
+    """Make renames in a folder durable (a no-op where folders can't be opened, e.g. Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def sync_file(path):
+    """Flush a file another process wrote (e.g. ffmpeg) to the disk"""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # Windows can't fsync a read-only handle; the file is still complete
+    finally:
+        os.close(fd)
+
+
+def finish_file(temp_path, path, fsync='resume'):
+    """Move a finished temp file into place with one atomic rename, synced as the policy says"""
+    if fsync != 'none':
+        sync_file(temp_path)
+    os.replace(temp_path, path)
+    if fsync == 'full':
+        sync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+class Reservation:
+    """Disk space held for one download; what it writes comes off it"""
+
+    def __init__(self, budget, amount):
+        self.budget = budget
+        self.amount = amount
+        self._written = {}  # filename -> bytes downloaded so far
+
+    @property
+    def outstanding(self):
+        return max(0, self.amount - sum(self._written.values()))
+
+    def track(self, event):
+        """Count a ProgressEvent's downloaded bytes as used"""
+        if event.phase == 'download' and event.downloaded:
+            self._written[event.filename] = event.downloaded
+
+    def watch(self, callback=None):
+        """Wrap a progress callback so the reservation follows the download"""
+        def progress(event):
+            self.track(event)
+            if callback is not None:
+                callback(event)
+        return progress
+
+    def release(self):
+        self.budget._release(self)
+
+
+class DiskBudget:
+    """Admission control for the downloads writing to one folder; thread-safe
+
+    `min_free` bytes are always left free; a download reserves its
+    expected size times `headroom`.
+    """
+
+    def __init__(self, path, min_free=0, headroom=1.0):
+        self.path = str(path)
+        self.min_free = min_free
+        self.headroom = headroom
+        self._cond = threading.Condition()
+        self._reservations = []
+        self.waited = 0  # Jobs that had to wait for space
+
+    def free(self):
+        return shutil.disk_usage(self.path).free
+
+    def reserve(self, size, headroom=None, on_wait=None):
+        """Hold space for a download of `size` bytes (None: unknown, just check the minimum)
+
+        Waits while downloads that are still running hold the space it
+        needs; on_wait(message) is called once if it has to. Raises
+        DiskSpaceError when it can't fit even with those done.
+        """
+        headroom = self.headroom if headroom is None else headroom
+        amount = int(size * headroom) if size else 0
+        waiting = False
+        with self._cond:
+            while True:
+                held = sum(reservation.outstanding for reservation in self._reservations)
+                free = self.free()
+                available = free - self.min_free - held
+                if available > 0 and amount <= available:
+                    reservation = Reservation(self, amount)
+                    self._reservations.append(reservation)
+                    return reservation
+                message = f"{free / 1024 ** 2:.0f} MB free (keeping {self.min_free / 1024 ** 2:.0f} MB free)"
+                if amount:
+                    message = f"needs about {amount / 1024 ** 2:.0f} MB, {message}"
+                if not held:
+                    raise DiskSpaceError(f"Not enough disk space in {self.path}: {message}")
+                if not waiting:
+                    waiting = True
+                    self.waited += 1
+                    if on_wait is not None:
+                        on_wait(f"Waiting for running downloads to finish: {message}, "
+                                f"{held / 1024 ** 2:.0f} MB of it still needed by them")
+                self._cond.wait(WAIT_POLL)
+
+    def _release(self, reservation):
+        with self._cond:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+                self._cond.notify_all()
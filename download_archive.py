@@ -0,0 +1,238 @@
+"""
+DOWNLOAD ARCHIVE - Remember what was already downloaded
+
+A small SQLite database (kept in the output folder) that records every
+finished download by extractor + video id + requested format. Before a URL is
+queued it is looked up here, so reruns skip finished videos without any
+network round trip.
+
+Every URL spelling seen for a video (watch?v=, youtu.be/, shorts/, the
+canonical webpage URL, ...) is stored too, so all of them hit the same entry.
+Both tables are keyed by their primary-key index, which keeps lookups fast
+with hundreds of thousands of entries.
+
+For playlist sync it also remembers which entries of a playlist were
+downloaded, and whether the playlist was ever gone through to the end: only
+then can a rerun stop enumerating once it reaches entries it knows.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import ytdlp_engine
+
+# Query parameters that never change which video a URL points to
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'igshid', 'si', 'feature', 'ref', 'ref_src', 'pp',
+    'ab_channel', 'app', 'mc_cid', 'mc_eid',
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    format_id TEXT,
+    title TEXT,
+    filepath TEXT,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (extractor, video_id, format)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist TEXT PRIMARY KEY,
+    synced_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS playlist_entries (
+    playlist TEXT NOT NULL,
+    entry_id TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    PRIMARY KEY (playlist, entry_id)
+) WITHOUT ROWID;
+"""
+
+
+def canonical_url(url):
+    """Normalise a URL so trivially different spellings compare equal"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    netloc = host if parts.port is None else f"{host}:{parts.port}"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith('utm_')
+    )
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit((parts.scheme.lower(), netloc, path, urlencode(query), ''))
+
+
+_extractor_cache = {}
+
+
+def extractor_key_for_url(url):
+    """Work out (extractor, video_id) from the URL alone, without any network access
+
+    Uses yt-dlp's URL patterns when yt_dlp is importable. Returns None when
+    the id can't be known before extraction (e.g. generic web pages).
+    """
+    if url in _extractor_cache:
+        return _extractor_cache[url]
+    key = None
+    yt_dlp = ytdlp_engine.load_yt_dlp()
+    if yt_dlp is not None:
+        for ie in yt_dlp.extractor.gen_extractor_classes():
+            if ie.ie_key() == 'Generic' or not ie.suitable(url):
+                continue
+            video_id = ie.get_temp_id(url)
+            if video_id:
+                key = (ie.ie_key().lower(), str(video_id))
+            break
+    if len(_extractor_cache) > 10000:
+        _extractor_cache.clear()
+    _extractor_cache[url] = key
+    return key
+
+
+class DownloadArchive:
+    """SQLite-backed record of finished downloads, safe to share between threads"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def resolve(self, url):
+        """Return (extractor, video_id) for a URL if it can be known offline"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT extractor, video_id FROM urls WHERE url = ?', (canonical_url(url),)
+            ).fetchone()
+        if row:
+            return row
+        return extractor_key_for_url(url)
+
+    def lookup(self, url, fmt):
+        """Return the archived entry for this URL + format, or None
+
+        Entries whose file has been deleted since don't count, so removing
+        a video from the output folder is enough to download it again.
+        """
+        key = self.resolve(url)
+        if key is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT extractor, video_id, format, format_id, title, filepath, downloaded_at '
+                'FROM downloads WHERE extractor = ? AND video_id = ? AND format = ?',
+                (key[0], key[1], fmt),
+            ).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(
+            ('extractor', 'video_id', 'format', 'format_id', 'title', 'filepath', 'downloaded_at'), row))
+        if entry['filepath'] and not os.path.exists(entry['filepath']):
+            return None
+        return entry
+
+    def record(self, fmt, extractor, video_id, urls=(), format_id=None, title=None, filepath=None):
+        """Store a finished download and every URL it was reached through"""
+        extractor = extractor.lower()
+        video_id = str(video_id)
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (extractor, video_id, fmt, format_id, title, filepath, time.time()),
+            )
+            self._db.executemany(
+                'INSERT OR REPLACE INTO urls VALUES (?, ?, ?)',
+                [(canonical_url(u), extractor, video_id) for u in set(urls) if u],
+            )
+
+    def record_info(self, fmt, info, url=None):
+        """Record a download from a yt-dlp info dict (playlists record every entry)"""
+        if info is None:
+            return
+        if info.get('_type') == 'playlist':
+            for entry in info.get('entries') or []:
+                self.record_info(fmt, entry)
+            return
+        extractor = info.get('extractor_key') or info.get('ie_key')
+        if not extractor or not info.get('id'):
+            return
+        downloads = info.get('requested_downloads') or [{}]
+        self.record(
+            fmt, extractor, info['id'],
+            urls=(url, info.get('original_url'), info.get('webpage_url')),
+            format_id=info.get('format_id'),
+            title=info.get('title'),
+            filepath=downloads[0].get('filepath') or info.get('filepath'),
+        )
+
+    # Template for `--print-to-file after_move:...` so subprocess downloads
+    # can report the same fields as the in-process info dict
+    PRINT_TEMPLATE = (
+        'after_move:%(extractor_key)s\t%(id)s\t%(format_id)s\t'
+        '%(original_url)s\t%(webpage_url)s\t%(filepath)s\t%(title)s'
+    )
+
+    def record_printed(self, fmt, path, url=None):
+        """Record downloads listed in a PRINT_TEMPLATE output file"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            fields = line.split('\t')
+            if len(fields) != 7 or fields[0] == 'NA' or fields[1] == 'NA':
+                continue
+            extractor, video_id, format_id, original_url, webpage_url, filepath, title = fields
+            self.record(
+                fmt, extractor, video_id,
+                urls=(url, original_url, webpage_url),
+                format_id=format_id, title=title, filepath=filepath,
+            )
+
+    def playlist_synced(self, url):
+        """When every entry of a playlist was last downloaded (or found downloaded), or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT synced_at FROM playlists WHERE playlist = ?', (canonical_url(url),)).fetchone()
+        return row[0] if row else None
+
+    def knows_entry(self, url, entry_id):
+        """Whether this entry of the playlist was downloaded before"""
+        with self._lock:
+            return self._db.execute(
+                'SELECT 1 FROM playlist_entries WHERE playlist = ? AND entry_id = ?',
+                (canonical_url(url), str(entry_id))).fetchone() is not None
+
+    def record_entry(self, url, entry_id):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO playlist_entries VALUES (?, ?, ?)',
+                             (canonical_url(url), str(entry_id), time.time()))
+
+    def mark_synced(self, url):
+        """Every entry of the playlist is downloaded; later syncs may stop at known entries"""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?)', (canonical_url(url), time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
@@ -0,0 +1,390 @@
+"""
+DOWNLOAD DAEMON - Keep running and take download jobs over a local HTTP API
+
+Started with `python video_downloader.py --daemon`. The worker pool (a
+DownloadScheduler with the usual global and per-site limits) and the shared
+yt-dlp sessions, archive and metadata cache stay up between jobs, so new
+URLs start downloading right away. Anything that speaks HTTP can drive it;
+the CLI does so with --submit/--jobs/--cancel/--priority (see DaemonClient).
+
+API (JSON in and out, bound to 127.0.0.1 by default):
+
+    GET    /status            worker and job counts, uptime, bandwidth
+    GET    /jobs[?state=...]  every job the daemon knows about
+    POST   /jobs              {"urls": [...], "priority": 0} -> the new jobs
+    GET    /jobs/<id>         one job: state, progress, error, timings
+    PATCH  /jobs/<id>         {"priority": 5} -> move a waiting job up/down
+    DELETE /jobs/<id>         cancel a job (waiting or running)
+
+Requests with a body must be sent as application/json, and requests a web
+page sends (with an Origin header other than the daemon's own address) are
+refused: browsers send form-like POSTs cross-site without asking first, so
+any page the user opens could otherwise queue or cancel downloads.
+
+Job states are the ones of the job journal (queued, extracting,
+downloading, postprocessing, done, failed) plus cancelled. Higher
+priorities run first, equal ones in submission order. A running job is
+stopped at its next progress update; whatever it downloaded stays as .part
+files, so submitting the URL again continues from there.
+"""
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from download_scheduler import DownloadCancelled, DownloadJob, DownloadScheduler
+from job_journal import DONE, EXTRACTING, FAILED, PHASE_STATES, QUEUED
+
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+KEEP_FINISHED = 1000  # Finished jobs remembered for status queries, oldest dropped first
+MAX_BODY = 1024 * 1024  # Largest request body accepted (bytes)
+
+
+class DaemonJob(DownloadJob):
+    """A submitted URL with its state and latest progress"""
+
+    def __init__(self, index, url, priority=0):
+        super().__init__(index, url, priority)
+        self.state = QUEUED
+        self.submitted_at = time.time()
+        self.progress = None  # Latest ProgressEvent as a dict
+        self.cancel_requested = threading.Event()
+
+    def report(self, event):
+        """Progress callback for the engines; raises DownloadCancelled after cancel"""
+        if self.cancel_requested.is_set():
+            raise DownloadCancelled("Cancelled over the API")
+        self.state = PHASE_STATES.get(event.phase, self.state)
+        self.progress = dict(event.as_dict(), fraction=event.fraction)
+
+    def as_dict(self):
+        return {
+            'id': self.index,
+            'url': self.url,
+            'host': self.host,
+            'priority': self.priority,
+            'state': self.state,
+            'error': self.error,
+            'progress': self.progress,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration': self.duration,
+            'stats': {key: value for key, value in self.stats.items() if _is_json(value)},
+        }
+
+
+def _is_json(value):
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+class DownloadDaemon:
+    """Job table + persistent worker pool + HTTP API
+
+    worker(job) does the actual download (VideoDownloader.run_daemon_job):
+    it should pass job.report as the progress callback and return True on
+    success (why it failed can go in job.stats['error']). status() extra
+    fields come from the optional `status` callable.
+    """
+
+    def __init__(self, worker, max_workers=3, max_per_host=2, status=None):
+        self.worker = worker
+        self.extra_status = status
+        self.scheduler = DownloadScheduler(max_workers, max_per_host)
+        self.started = time.time()
+        self.server = None
+        self._lock = threading.Lock()
+        self._jobs = {}  # id -> DaemonJob, in submission order
+        self._next_id = 1
+
+    def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """Start the workers and the HTTP server (on a background thread)"""
+        self.scheduler.start(self._run_job)
+        self.server = ThreadingHTTPServer((host, port), ApiHandler)
+        self.server.daemon_threads = True
+        self.server.downloads = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def close(self, timeout=None):
+        """Stop taking requests, cancel waiting jobs and let running ones finish"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        with self._lock:
+            waiting = [job for job in self._jobs.values() if job.state == QUEUED]
+        for job in waiting:
+            self.cancel(job.index)
+        self.scheduler.stop(timeout)
+
+    def submit(self, urls, priority=0):
+        """Queue URLs; returns the new jobs"""
+        jobs = []
+        with self._lock:
+            for url in urls:
+                job = DaemonJob(self._next_id, url, priority)
+                self._next_id += 1
+                self._jobs[job.index] = job
+                jobs.append(job)
+        for job in jobs:
+            self.scheduler.submit(job)
+        return jobs
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, state=None):
+        with self._lock:
+            return [job for job in self._jobs.values() if state is None or job.state == state]
+
+    def cancel(self, job_id):
+        """Cancel a job; returns it (None if unknown). Finished jobs are left as they are"""
+        job = self.job(job_id)
+        if job is None or job.state in FINISHED_STATES:
+            return job
+        job.cancel_requested.set()
+        if self.scheduler.withdraw(job):
+            job.state = CANCELLED
+            job.finished_at = time.time()
+            self._forget_old()
+        return job
+
+    def reprioritise(self, job_id, priority):
+        """Give a job another priority; returns it (None if unknown)"""
+        job = self.job(job_id)
+        if job is not None:
+            self.scheduler.reprioritise(job, priority)
+        return job
+
+    def status(self):
+        counts = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.state] = counts.get(job.state, 0) + 1
+        status = {
+            'uptime': time.time() - self.started,
+            'workers': self.scheduler.max_workers,
+            'max_per_host': self.scheduler.max_per_host,
+            'jobs': counts,
+        }
+        if self.extra_status is not None:
+            status.update(self.extra_status())
+        return status
+
+    def _run_job(self, job):
+        job.state = EXTRACTING
+        success = False
+        try:
+            success = bool(self.worker(job))
+        except DownloadCancelled:
+            pass
+        except Exception as e:
+            job.error = str(e)
+            raise
+        finally:
+            if job.cancel_requested.is_set():
+                job.state = CANCELLED
+            else:
+                job.state = DONE if success else FAILED
+                if not success and job.error is None:
+                    job.error = job.stats.get('error') or "Download failed"
+            job.finished_at = time.time()
+            self._forget_old()
+        return success
+
+    def _forget_old(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+            for job_id in finished[:max(0, len(finished) - KEEP_FINISHED)]:
+                del self._jobs[job_id]
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a DownloadDaemon (self.server.downloads)"""
+
+    server_version = 'VideoDownloaderDaemon/1'
+
+    def log_message(self, format, *args):
+        pass  # Job output is logged by the downloader, not every request
+
+    def do_GET(self):
+        if not self._same_origin():
+            return
+        daemon = self.server.downloads
+        parts, query = self._route()
+        if parts == ['status']:
+            return self._reply(200, daemon.status())
+        if parts == ['jobs']:
+            state = query.get('state', [None])[0]
+            return self._reply(200, {'jobs': [job.as_dict() for job in daemon.jobs(state)]})
+        if len(parts) == 2 and parts[0] == 'jobs':
+            return self._job_reply(daemon.job(self._job_id(parts[1])))
+        self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self._same_origin():
+            return
+        parts, _query = self._route()
+        if parts != ['jobs']:
+            return self._reply(404, {'error': 'Not found'})
+        body = self._body()
+        if body is None:
+            return
+        urls = body.get('urls') or ([body['url']] if body.get('url') else [])
+        if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u.strip() for u in urls):
+            return self._reply(400, {'error': 'Expected {"urls": ["https://...", ...]}'})
+        priority = self._priority(body)
+        if priority is None:
+            return
+        jobs = self.server.downloads.submit([u.strip() for u in urls], priority)
+        self._reply(201, {'jobs': [job.as_dict() for job in jobs]})
+
+    def do_PATCH(self):
+        if not self._same_origin():
+            return
+        parts, _query = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._reply(404, {'error': 'Not found'})
+        body = self._body()
+        if body is None:
+            return
+        priority = self._priority(body)
+        if priority is None:
+            return
+        self._job_reply(self.server.downloads.reprioritise(self._job_id(parts[1]), priority))
+
+    def do_DELETE(self):
+        if not self._same_origin():
+            return
+        parts, _query = self._route()
+        if len(parts) != 2 or parts[0] != 'jobs':
+            return self._reply(404, {'error': 'Not found'})
+        self._job_reply(self.server.downloads.cancel(self._job_id(parts[1])))
+
+    def _same_origin(self):
+        """False (after replying 403) for a request a web page on another site sent"""
+        origin = self.headers.get('Origin')
+        if origin is None or origin == f"http://{self.headers.get('Host')}":
+            return True
+        self._reply(403, {'error': 'Cross-origin requests are not allowed'})
+        return False
+
+    def _route(self):
+        url = urlsplit(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    @staticmethod
+    def _job_id(text):
+        try:
+            return int(text)
+        except ValueError:
+            return None
+
+    def _priority(self, body):
+        priority = body.get('priority', 0)
+        if isinstance(priority, bool) or not isinstance(priority, int):
+            self._reply(400, {'error': 'priority must be an integer'})
+            return None
+        return priority
+
+    def _body(self):
+        """The JSON object sent with the request, or None after replying with an error"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reply(400, {'error': 'Bad Content-Length'})
+            return None
+        if length > MAX_BODY:
+            self._reply(413, {'error': 'Request body too large'})
+            return None
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self._reply(415, {'error': 'Send the body as application/json'})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self._reply(400, {'error': 'Expected a JSON object'})
+            return None
+        return body
+
+    def _job_reply(self, job):
+        if job is None:
+            return self._reply(404, {'error': 'No such job'})
+        self._reply(200, job.as_dict())
+
+    def _reply(self, code, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class DaemonError(Exception):
+    """The daemon isn't reachable or rejected a request"""
+
+
+class DaemonClient:
+    """Talks to a running daemon (used by the CLI's --submit/--jobs/--cancel/--priority)"""
+
+    def __init__(self, url=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error')
+            except ValueError:
+                message = None
+            raise DaemonError(message or f"HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            raise DaemonError(f"No daemon at {self.url} ({getattr(e, 'reason', e)})")
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def submit(self, urls, priority=0):
+        return self._request('POST', '/jobs', {'urls': list(urls), 'priority': priority})['jobs']
+
+    def jobs(self, state=None):
+        return self._request('GET', '/jobs' + (f'?state={state}' if state else ''))['jobs']
+
+    def job(self, job_id):
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def cancel(self, job_id):
+        return self._request('DELETE', f'/jobs/{job_id}')
+
+    def reprioritise(self, job_id, priority):
+        return self._request('PATCH', f'/jobs/{job_id}', {'priority': priority})
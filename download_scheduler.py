@@ -0,0 +1,371 @@
+"""
+DOWNLOAD SCHEDULER - Run several downloads at the same time
+
+Runs download jobs on a small pool of worker threads with two limits:
+- a global limit (how many downloads run at once)
+- a per-host limit (how many of those may talk to the same website)
+
+A worker never sits waiting on a busy host: it takes the next queued job
+whose website still has a free slot, so one slow site can't stall the batch.
+Jobs are handed back in their original order so summaries stay readable.
+
+run() works through a fixed list. start()/submit() keep the workers
+waiting for more jobs instead (used by the daemon), where waiting jobs can
+be withdrawn or given another priority. A running job that is done with the
+network (post-processing) can hand its site's slot on with release_host().
+feed() adds the jobs of an iterable as it produces them (a playlist that is
+still being enumerated); run() doesn't return before every feed ran dry.
+
+With a RetryPolicy (retry_policy.py), a failed job the policy wants tried
+again goes back into the queue behind every job that hasn't had a try yet,
+not to start before its backoff ran out; sites the policy paused get no
+jobs until their pause is over, and the waiting jobs of a site it gave up
+on fail without running.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+
+
+class DownloadCancelled(Exception):
+    """Raised from a progress callback to stop a running download"""
+
+
+def get_host(url):
+    """Return the host name a URL counts against for per-host limits"""
+    host = (urlsplit(url).hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or 'local'
+
+
+class DownloadJob:
+    """One URL in a batch, plus what happened to it"""
+
+    def __init__(self, index, url, priority=0):
+        self.index = index
+        self.url = url
+        self.host = get_host(url)
+        self.priority = priority  # Higher runs first; equal priorities run in index order
+        self.source = None  # (playlist URL, entry id) for a job found in a playlist
+        self.lease = None  # Job id in a shared JobQueue, for a job leased from one
+        self.attempts = 0  # Retries so far
+        self.not_before = 0.0  # A retried job waits for its backoff
+        self.success = None  # None = not run yet, True/False once finished
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.stats = {}
+
+    @property
+    def duration(self):
+        """Seconds the job took (0 if it never ran)"""
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+    def __repr__(self):
+        return f"DownloadJob({self.index}, {self.url!r}, success={self.success})"
+
+
+class DownloadScheduler:
+    """Runs jobs concurrently with a global and a per-host limit
+
+    Feeds stop reading ahead once `max_queued` of their jobs are waiting
+    (unlimited if None). on_retry(job, delay) is called when `retry` (a
+    RetryPolicy) queues a failed job again, on_done(job) once a job is
+    finished for good.
+    """
+
+    def __init__(self, max_workers=3, max_per_host=2, max_queued=None, retry=None, on_retry=None,
+                 on_done=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_queued = max(1, int(max_queued)) if max_queued else None
+        self._cond = threading.Condition()
+        self._queues = OrderedDict()  # host -> deque of waiting jobs
+        self._active = {}  # host -> number of running jobs
+        self._released = set()  # Running jobs that no longer count against their host
+        self._cancelled = False
+        self._serving = False  # Workers wait for submit() when the queue runs empty
+        self._feeding = 0  # Feeds still producing jobs; workers wait for them too
+        self._fed = []  # Jobs that came from feeds during run()
+        self._idle = 0  # Workers waiting for a job they're allowed to start
+        self.retry = retry
+        self.on_retry = on_retry
+        self.on_done = on_done
+        self._worker = None
+        self._threads = []
+
+    @staticmethod
+    def _order(job):
+        # Retries run after everything that hasn't been tried yet
+        return (-job.priority, job.attempts, job.index)
+
+    def _enqueue(self, job):
+        """Insert a job into its host queue, keeping the queue in run order"""
+        queue = self._queues.setdefault(job.host, deque())
+        pos = len(queue)
+        while pos and self._order(queue[pos - 1]) > self._order(job):
+            pos -= 1
+        queue.insert(pos, job)
+
+    def _dequeue(self, job):
+        queue = self._queues.get(job.host)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del self._queues[job.host]
+        return True
+
+    def cancel(self):
+        """Stop handing out new jobs (running ones finish normally)"""
+        with self._cond:
+            self._cancelled = True
+            self._cond.notify_all()
+
+    def start(self, worker):
+        """Start the workers and keep them waiting for submit()ted jobs until stop()"""
+        with self._cond:
+            self._cancelled = False
+            self._serving = True
+        self._worker = worker
+        self._threads = []
+        self._add_workers(self.max_workers)
+
+    def _add_workers(self, count):
+        for _ in range(count):
+            thread = threading.Thread(target=self._worker_loop, args=(self._worker,), daemon=True)
+            self._threads.append(thread)
+            thread.start()
+
+    def submit(self, job):
+        """Queue a job for the workers of start()"""
+        with self._cond:
+            self._enqueue(job)
+            self._cond.notify_all()
+
+    def feed(self, jobs):
+        """Queue the jobs of an iterable as it produces them, consuming it on a thread of its own"""
+        with self._cond:
+            self._feeding += 1
+            alive = sum(1 for thread in self._threads if thread.is_alive())
+        # run() may have started fewer workers than allowed, for a short list
+        self._add_workers(self.max_workers - alive)
+        threading.Thread(target=self._feed_loop, args=(jobs,), daemon=True).start()
+
+    def _host_limit(self, host):
+        if self.retry is not None:
+            return self.retry.host_limit(host, self.max_per_host)
+        return self.max_per_host
+
+    def _startable(self, host):
+        """Whether a waiting job of the host could start now, if a worker were free"""
+        if self._active.get(host, 0) >= self._host_limit(host):
+            return False
+        if self.retry is not None and self.retry.host_wait(host):
+            return False
+        now = time.time()
+        return any(job.not_before <= now for job in self._queues[host])
+
+    def _feed_full(self):
+        if self.max_queued is None:
+            return False
+        queued = sum(len(queue) for queue in self._queues.values())
+        if queued < self.max_queued:
+            return False
+        if queued >= self.max_queued * 10:
+            return True
+        # Keep reading while workers sit idle because every waiting job is held
+        # back by its site's limit (or pause, or backoff): they need jobs from other sites
+        return not self._idle or any(self._startable(host) for host in self._queues)
+
+    def _feed_loop(self, jobs):
+        iterator = iter(jobs)
+        try:
+            for job in iterator:
+                with self._cond:
+                    while self._feed_full() and not self._cancelled:
+                        self._cond.wait()
+                    if self._cancelled:
+                        break
+                    self._enqueue(job)
+                    self._fed.append(job)
+                    self._cond.notify_all()
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            with self._cond:
+                self._feeding -= 1
+                self._cond.notify_all()
+
+    def withdraw(self, job):
+        """Take a job out of the queue; False if it already started (or finished)"""
+        with self._cond:
+            return self._dequeue(job)
+
+    def reprioritise(self, job, priority):
+        """Change a job's priority; a waiting job moves to its new place in the queue"""
+        with self._cond:
+            queued = self._dequeue(job)
+            job.priority = priority
+            if queued:
+                self._enqueue(job)
+
+    def release_host(self, job):
+        """A running job stopped talking to its website; let the next one from there start"""
+        with self._cond:
+            if job in self._released:
+                return
+            self._released.add(job)
+            self._active[job.host] -= 1
+            self._cond.notify_all()
+
+    def stop(self, timeout=None):
+        """Stop the workers of start() once their current jobs are done"""
+        with self._cond:
+            self._serving = False
+            self._cancelled = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def run(self, jobs, worker, feeds=()):
+        """Call worker(job) for every job and return the jobs in index order
+
+        worker should return True on success. Exceptions are caught and
+        recorded on the job so one broken URL never takes down the batch.
+        Jobs fed in while it runs are part of the result, including those of
+        `feeds` (iterables of jobs, read as the queue empties).
+        """
+        jobs = list(jobs)
+        with self._cond:
+            self._cancelled = False
+            self._queues.clear()
+            self._active.clear()
+            self._released.clear()
+            self._fed = []
+            for job in jobs:
+                self._enqueue(job)
+
+        self._worker = worker
+        self._threads = []
+        self._add_workers(min(self.max_workers, len(jobs)))
+        for feed in feeds:
+            self.feed(feed)
+        # Join with a timeout so Ctrl+C still reaches the main thread; feeds can add workers meanwhile
+        while True:
+            alive = [thread for thread in self._threads if thread.is_alive()]
+            if not alive:
+                break
+            alive[0].join(0.5)
+        self._threads = []
+        with self._cond:
+            return sorted(jobs + self._fed, key=lambda job: job.index)
+
+    def _next_job(self):
+        """Take the first waiting job (highest priority, then oldest) whose host has a free slot"""
+        while True:
+            job, dropped = self._take_job()
+            if not dropped:
+                return job
+            # Outside the lock: on_done may talk to a shared queue
+            if self.on_done is not None:
+                for dropped_job in dropped:
+                    self.on_done(dropped_job)
+
+    def _take_job(self):
+        """(next job or None, []) - or (None, jobs failed unrun because their host was given up on)"""
+        with self._cond:
+            while True:
+                if self.retry is not None:
+                    dropped = [job for host in [host for host in self._queues if self.retry.gave_up(host)]
+                               for job in self._drop(host, f"Skipped: {host} kept failing")]
+                    if dropped:
+                        self._cond.notify_all()  # Feeds waiting for room in the queue
+                        return None, dropped
+                if self._cancelled or not (self._queues or self._serving or self._feeding):
+                    return None, []
+                best = None
+                wake = None  # Seconds until a paused host or a backing-off job is due
+                now = time.time()
+                for host, queue in self._queues.items():
+                    if self._active.get(host, 0) >= self._host_limit(host):
+                        continue
+                    paused = self.retry.host_wait(host) if self.retry is not None else 0
+                    if paused:
+                        wake = paused if wake is None else min(wake, paused)
+                        continue
+                    job = queue[0]
+                    if job.not_before > now:
+                        # Only retries back off, and one further back may be due sooner
+                        due = min(queued.not_before for queued in queue) - now
+                        wake = due if wake is None else min(wake, due)
+                        job = next((queued for queued in queue if queued.not_before <= now), None)
+                        if job is None:
+                            continue
+                    if best is None or self._order(job) < self._order(best):
+                        best = job
+                if best is not None:
+                    self._dequeue(best)
+                    self._active[best.host] = self._active.get(best.host, 0) + 1
+                    return best, []
+                # Every host with waiting work is at its limit or paused (or nothing is waiting)
+                self._idle += 1
+                try:
+                    self._cond.wait(wake)
+                finally:
+                    self._idle -= 1
+
+    def _drop(self, host, error):
+        """Fail the waiting jobs of a host without running them; returns them"""
+        now = time.time()
+        jobs = self._queues.pop(host)
+        for job in jobs:
+            job.success = False
+            job.error = error
+            job.started_at = job.finished_at = now
+        return jobs
+
+    def _finish(self, job, retry_in=None):
+        with self._cond:
+            if job in self._released:
+                self._released.discard(job)
+            else:
+                self._active[job.host] -= 1
+            if retry_in is not None and not self._cancelled:
+                job.not_before = time.time() + retry_in
+                self._enqueue(job)
+            self._cond.notify_all()
+
+    def _worker_loop(self, worker):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            job.started_at = time.time()
+            job.success = None
+            job.error = None
+            retry_in = None
+            try:
+                job.success = bool(worker(job))
+            except Exception as e:
+                job.success = False
+                job.error = str(e)
+            finally:
+                job.finished_at = time.time()
+                if self.retry is not None and job.success is not None:
+                    if job.success:
+                        self.retry.succeeded(job)
+                    else:
+                        retry_in = self.retry.failed(job)
+                        if retry_in is not None and self.on_retry is not None and not self._cancelled:
+                            self.on_retry(job, retry_in)
+                if (retry_in is None or self._cancelled) and self.on_done is not None:
+                    self.on_done(job)
+                self._finish(job, retry_in)
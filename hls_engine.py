@@ -0,0 +1,412 @@
+"""
+HLS ENGINE - Native asyncio downloader for .m3u8 streams
+
+Replaces `--external-downloader ffmpeg` for HLS: ffmpeg fetches segments one
+after another over its own connections and reports nothing useful while it
+runs. This engine:
+
+1. Parses the master playlist and picks the best variant under MAX_QUALITY
+2. Parses the media playlist (EXT-X-KEY AES-128, EXT-X-BYTERANGE, EXT-X-MAP)
+3. Fetches many segments at once over pooled keep-alive connections
+4. Writes them to the output strictly in order through a bounded reorder
+   buffer, so memory use stays flat no matter how long the stream is
+5. Remuxes the result to .mp4 with ffmpeg (stream copy) when ffmpeg exists,
+   next to the output, and renames it into place only once it's complete
+
+Segments land in the .part file in order, so a small resume map next to it
+(segments written + byte length) is enough to continue an interrupted
+download from the first missing segment.
+
+Live playlists (no EXT-X-ENDLIST) are downloaded as the current snapshot.
+SAMPLE-AES and DRM-protected streams are not supported and raise HlsError.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from urllib.parse import urljoin, urlsplit
+
+from adaptive_concurrency import THROTTLE_STATUSES
+from disk_space import finish_file
+from download_archive import canonical_url
+from http_pool import ConnectionPool, HttpError, fetch_ordered
+
+SEGMENT_RETRIES = 3
+RESUME_SAVE_INTERVAL = 1.0  # seconds between resume map updates
+
+
+class HlsError(Exception):
+    """The stream can't be handled by the native engine"""
+
+
+class Segment:
+    """One media segment (or an EXT-X-MAP init section)"""
+
+    def __init__(self, index, uri, duration=0.0, byterange=None, key=None, sequence=0):
+        self.index = index
+        self.uri = uri
+        self.duration = duration
+        self.byterange = byterange  # (length, offset) or None
+        self.key = key  # dict(method, uri, iv) or None
+        self.sequence = sequence
+
+    def range_header(self):
+        if self.byterange is None:
+            return None
+        length, offset = self.byterange
+        return {'Range': f"bytes={offset}-{offset + length - 1}"}
+
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text):
+    """Parse an attribute list like BANDWIDTH=1280000,RESOLUTION=1280x720"""
+    return {key: value.strip('"') for key, value in _ATTR_RE.findall(text)}
+
+
+def _lines(text):
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def is_master_playlist(text):
+    return '#EXT-X-STREAM-INF' in text
+
+
+def parse_master_playlist(text, base_url):
+    """Return the variants of a master playlist plus its alternative renditions"""
+    variants = []
+    renditions = []
+    lines = _lines(text)
+    for i, line in enumerate(lines):
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            uri = next((l for l in lines[i + 1:] if not l.startswith('#')), None)
+            if uri is None:
+                continue
+            width = height = None
+            if 'RESOLUTION' in attrs and 'x' in attrs['RESOLUTION']:
+                width, height = (int(v) for v in attrs['RESOLUTION'].split('x', 1))
+            variants.append({
+                'uri': urljoin(base_url, uri),
+                'bandwidth': int(attrs.get('BANDWIDTH') or attrs.get('AVERAGE-BANDWIDTH') or 0),
+                'width': width,
+                'height': height,
+                'codecs': attrs.get('CODECS'),
+                'audio': attrs.get('AUDIO'),
+            })
+        elif line.startswith('#EXT-X-MEDIA:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            if attrs.get('URI'):
+                attrs['URI'] = urljoin(base_url, attrs['URI'])
+            renditions.append(attrs)
+    return variants, renditions
+
+
+def choose_variant(variants, max_height):
+    """Highest-bandwidth variant no taller than max_height (lowest one if none fit)"""
+    if not variants:
+        raise HlsError("Master playlist has no variants")
+    max_height = int(max_height)
+    fitting = [v for v in variants if v['height'] is None or v['height'] <= max_height]
+    if fitting:
+        return max(fitting, key=lambda v: (v['height'] or 0, v['bandwidth']))
+    return min(variants, key=lambda v: (v['height'] or 0, v['bandwidth']))
+
+
+def parse_media_playlist(text, base_url):
+    """Return (segments, init_segment, is_endlist) for a media playlist"""
+    if not text.lstrip().startswith('#EXTM3U'):
+        raise HlsError("Not an HLS playlist")
+    segments = []
+    init = None
+    key = None
+    sequence = 0
+    duration = 0.0
+    byterange = None
+    last_end = {}  # uri -> end offset of previous byte range (for implicit offsets)
+    endlist = False
+
+    def parse_byterange(value, uri):
+        length, _, offset = value.partition('@')
+        length = int(length)
+        offset = int(offset) if offset else last_end.get(uri, 0)
+        last_end[uri] = offset + length
+        return length, offset
+
+    for line in _lines(text):
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = line.split(':', 1)[1]
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128':
+                key = {'method': method, 'uri': urljoin(base_url, attrs['URI']), 'iv': attrs.get('IV')}
+            else:
+                raise HlsError(f"Unsupported encryption: {method}")
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            uri = urljoin(base_url, attrs['URI'])
+            init = Segment(-1, uri, key=key)
+            if attrs.get('BYTERANGE'):
+                init.byterange = parse_byterange(attrs['BYTERANGE'], uri)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            endlist = True
+        elif not line.startswith('#'):
+            uri = urljoin(base_url, line)
+            segment = Segment(len(segments), uri, duration, key=key, sequence=sequence)
+            if byterange is not None:
+                segment.byterange = parse_byterange(byterange, uri)
+            segments.append(segment)
+            sequence += 1
+            duration = 0.0
+            byterange = None
+    return segments, init, endlist
+
+
+def _aes128_decrypt(data, key, iv):
+    """AES-128-CBC decrypt and strip PKCS#7 padding, using whatever AES is installed"""
+    try:
+        from Cryptodome.Cipher import AES
+    except ImportError:
+        try:
+            from Crypto.Cipher import AES
+        except ImportError:
+            AES = None
+    if AES is not None:
+        plain = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    else:
+        try:
+            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+            decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+            plain = decryptor.update(data) + decryptor.finalize()
+        except ImportError:
+            from yt_dlp.aes import aes_cbc_decrypt_bytes  # Pure Python fallback
+            plain = aes_cbc_decrypt_bytes(data, key, iv)
+    pad = plain[-1] if plain else 0
+    return plain[:-pad] if 0 < pad <= 16 else plain
+
+
+class HlsDownloader:
+    """Downloads one HLS stream to a file"""
+
+    def __init__(self, url, output_path, max_height=1080, concurrency=8,
+                 buffer_segments=32, headers=None, verify=True, on_progress=None, controller=None,
+                 bandwidth=None, fsync='resume'):
+        self.url = url
+        self.output_path = str(output_path)
+        self.max_height = max_height
+        # With a ConcurrencyController, `concurrency` workers exist but only
+        # controller.value of them fetch at any moment
+        self.controller = controller
+        self.concurrency = controller.maximum if controller is not None else concurrency
+        self.buffer_segments = max(buffer_segments, self.concurrency)
+        self.headers = headers or {}
+        self.verify = verify
+        self.on_progress = on_progress
+        self.bandwidth = bandwidth  # BandwidthShare, optional
+        self.fsync = fsync  # One of disk_space.FSYNC_POLICIES
+        self._keys = {}
+        self.stats = {
+            'segments': 0, 'segments_done': 0, 'bytes': 0, 'resumed_bytes': 0, 'retries': 0,
+            'connections': 0, 'requests': 0, 'variant': None, 'elapsed': 0.0,
+        }
+
+    def download(self):
+        """Blocking entry point; returns the path of the finished file"""
+        return asyncio.run(self.run())
+
+    async def run(self):
+        started = time.time()
+        pool = ConnectionPool(max_per_host=self.concurrency, headers=self.headers, verify=self.verify,
+                              bandwidth=self.bandwidth)
+        try:
+            segments, init = await self._load_playlists(pool)
+            extension = '.mp4' if init is not None else '.ts'
+            stream_path = os.path.splitext(self.output_path)[0] + extension + '.part'
+            await self._download_segments(pool, segments, init, stream_path)
+        finally:
+            self.stats['connections'] = pool.connections_opened
+            self.stats['requests'] = pool.requests_sent
+            await pool.close()
+        self.stats['elapsed'] = time.time() - started
+        return self._finalize(stream_path)
+
+    async def _load_playlists(self, pool):
+        text = (await pool.get(self.url)).decode('utf-8', 'replace')
+        base_url = self.url
+        if is_master_playlist(text):
+            variants, renditions = parse_master_playlist(text, self.url)
+            variant = choose_variant(variants, self.max_height)
+            if variant['audio'] and any(
+                    r.get('GROUP-ID') == variant['audio'] and r.get('TYPE') == 'AUDIO' and r.get('URI')
+                    for r in renditions):
+                raise HlsError("Separate audio renditions need the yt-dlp downloader")
+            self.stats['variant'] = {k: variant[k] for k in ('bandwidth', 'width', 'height')}
+            base_url = variant['uri']
+            text = (await pool.get(base_url)).decode('utf-8', 'replace')
+        segments, init, _endlist = parse_media_playlist(text, base_url)
+        if not segments:
+            raise HlsError("Playlist has no segments")
+        self.stats['segments'] = len(segments)
+        return segments, init
+
+    async def _fetch(self, pool, segment):
+        """Download (and decrypt) one segment, retrying transient failures"""
+        key = None
+        for attempt in range(SEGMENT_RETRIES + 1):
+            started = time.time()
+            try:
+                if segment.key is not None and key is None:
+                    # A key that failed to load is retried like the segment itself
+                    key = await self._get_key(pool, segment.key['uri'])
+                data = await pool.get(segment.uri, segment.range_header())
+                if self.controller is not None:
+                    self.controller.record(len(data), time.time() - started)
+                break
+            except (HttpError, ConnectionError, OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as e:
+                if self.controller is not None:
+                    self.controller.record_error(isinstance(e, HttpError) and e.status in THROTTLE_STATUSES)
+                if attempt == SEGMENT_RETRIES or (isinstance(e, HttpError) and e.status in (401, 403, 404)):
+                    raise
+                self.stats['retries'] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        if segment.key is not None:
+            iv = segment.key['iv']
+            if iv:
+                iv = bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv).rjust(16, b'\0')
+            else:
+                iv = segment.sequence.to_bytes(16, 'big')
+            # Decrypting can be slow (pure Python AES fallback), keep it off the event loop
+            data = await asyncio.get_running_loop().run_in_executor(None, _aes128_decrypt, data, key, iv)
+        return data
+
+    async def _get_key(self, pool, uri):
+        if uri not in self._keys:
+            self._keys[uri] = asyncio.ensure_future(pool.get(uri))
+        future = self._keys[uri]
+        try:
+            return await future
+        except Exception:
+            # Don't hand a failed fetch to every later segment: the next one tries again
+            if self._keys.get(uri) is future:
+                del self._keys[uri]
+            raise
+
+    def _load_resume_map(self, map_path, stream_path, playlist_url, count):
+        """(segments, bytes) already in the .part file from an earlier attempt"""
+        try:
+            with open(map_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if (saved['playlist'] != playlist_url or saved['segments'] != count
+                    or os.path.getsize(stream_path) < saved['bytes']):
+                return 0, 0
+            return saved['done'], saved['bytes']
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0, 0
+
+    def _save_resume_map(self, f, map_path, playlist_url, count, done):
+        # The segment data has to be on disk before the map says it is
+        f.flush()
+        if self.fsync != 'none':
+            os.fsync(f.fileno())
+        tmp_path = map_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as m:
+            json.dump({'playlist': playlist_url, 'segments': count,
+                       'done': done, 'bytes': f.tell()}, m)
+        os.replace(tmp_path, map_path)
+
+    async def _download_segments(self, pool, segments, init, stream_path):
+        """Fetch segments concurrently, write them in order via a bounded buffer"""
+        loop = asyncio.get_running_loop()
+        map_path = stream_path + '.json'
+        playlist_url = segments[0].uri if init is None else init.uri
+        skip, offset = self._load_resume_map(map_path, stream_path, playlist_url, len(segments))
+        last_save = time.time()
+
+        async def write(index, data):
+            nonlocal last_save
+            await loop.run_in_executor(None, f.write, data)
+            self.stats['segments_done'] += 1
+            self.stats['bytes'] += len(data)
+            if time.time() - last_save >= RESUME_SAVE_INTERVAL:
+                await loop.run_in_executor(None, self._save_resume_map, f, map_path,
+                                           playlist_url, len(segments), skip + index + 1)
+                last_save = time.time()
+            if self.on_progress:
+                self.on_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': self.stats['resumed_bytes'] + self.stats['bytes'],
+                    'fragment_index': skip + index + 1,
+                    'fragment_count': len(segments),
+                })
+
+        with open(stream_path, 'r+b' if skip else 'wb') as f:
+            if skip:
+                # Drop whatever was written after the last saved segment
+                f.truncate(offset)
+                f.seek(offset)
+                self.stats['resumed_bytes'] = offset
+                self.stats['segments_done'] = skip
+            elif init is not None:
+                f.write(await self._fetch(pool, init))
+            try:
+                await fetch_ordered(
+                    segments[skip:], lambda segment: self._fetch(pool, segment), write,
+                    self.concurrency, self.buffer_segments, self.controller)
+            except BaseException:
+                self._save_resume_map(f, map_path, playlist_url, len(segments), self.stats['segments_done'])
+                raise
+        if os.path.exists(map_path):
+            os.remove(map_path)
+
+    def _finalize(self, stream_path):
+        """Remux to .mp4 if ffmpeg is around, otherwise keep the raw stream"""
+        ffmpeg = shutil.which('ffmpeg')
+        target = os.path.splitext(self.output_path)[0] + '.mp4'
+        if ffmpeg:
+            if self.on_progress:
+                self.on_progress({'status': 'started', 'postprocessor': 'Remux'})
+            # Written beside the output, so a remux that doesn't finish never looks like a video
+            temp = target + '.remux'
+            result = subprocess.run(
+                [ffmpeg, '-y', '-loglevel', 'error', '-i', stream_path, '-c', 'copy',
+                 '-movflags', '+faststart', '-f', 'mp4', temp],
+                capture_output=True)
+            if result.returncode == 0:
+                finish_file(temp, target, self.fsync)
+                os.remove(stream_path)
+                return target
+            if os.path.exists(temp):
+                os.remove(temp)
+        final = stream_path[:-len('.part')]
+        finish_file(stream_path, final, self.fsync)
+        return final
+
+
+def output_name_for_url(url):
+    """File name (without extension) for a bare stream URL
+
+    Ends in a short hash of the URL: cdn1/show/index.m3u8 and
+    cdn2/show/index.m3u8 must not overwrite each other.
+    """
+    parts = [p for p in urlsplit(url).path.split('/') if p]
+    stem = os.path.splitext(parts[-1])[0] if parts else ''
+    generic = {'master', 'playlist', 'index', 'manifest', 'chunklist', 'prog_index', 'stream'}
+    if stem.lower() in generic and len(parts) > 1:
+        stem = f"{parts[-2]}_{stem}"
+    stem = re.sub(r'[\\/:*?"<>|]+', '_', stem) or 'stream'
+    digest = hashlib.sha1(canonical_url(url).encode('utf-8')).hexdigest()[:8]
+    return f"{stem}_{digest}"
@@ -0,0 +1,309 @@
+"""
+HTTP POOL - Small asyncio HTTP/1.1 client with keep-alive connection pooling
+
+The native stream engines fetch hundreds of small segments from the same
+CDN. Opening a new TCP + TLS connection for each one costs more than the
+segment itself, so this client keeps connections open and hands them back to
+a per-host pool once a response has been fully read.
+
+Only what the engines need is implemented: GET/HEAD, Content-Length and
+chunked bodies, redirects, and streaming reads for large responses.
+"""
+
+import asyncio
+import ssl
+from urllib.parse import urljoin, urlsplit
+
+DEFAULT_USER_AGENT = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+
+
+class HttpError(Exception):
+    """Raised for non-2xx responses"""
+
+    def __init__(self, status, url, headers=None):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+        self.headers = headers or {}
+
+
+class Response:
+    """An HTTP response whose body is read from a pooled connection"""
+
+    def __init__(self, pool, key, conn, method, url, status, reason, headers):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # lower-case names
+        self._done = method == 'HEAD' or status in (204, 304) or 100 <= status < 200
+        self._chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        length = headers.get('content-length')
+        self._remaining = int(length) if length is not None and not self._chunked else None
+        if self._remaining == 0:
+            self._done = True
+        self._keep_alive = headers.get('connection', '').lower() != 'close' and (
+            self._chunked or self._remaining is not None or self._done)
+
+    @property
+    def content_length(self):
+        length = self.headers.get('content-length')
+        return int(length) if length is not None else None
+
+    async def _read_chunked(self, reader):
+        line = await reader.readline()
+        size = int(line.split(b';', 1)[0].strip() or b'0', 16)
+        if size == 0:
+            # Skip trailers up to the blank line
+            while (await reader.readline()).strip():
+                pass
+            self._done = True
+            return b''
+        data = await reader.readexactly(size)
+        await reader.readexactly(2)  # CRLF after each chunk
+        return data
+
+    async def iter_chunks(self, size=256 * 1024):
+        """Yield the body in pieces; the connection is released at the end"""
+        reader = self._conn[0]
+        timeout = self._pool.timeout
+        try:
+            while not self._done:
+                if self._chunked:
+                    data = await asyncio.wait_for(self._read_chunked(reader), timeout)
+                elif self._remaining is not None:
+                    data = await asyncio.wait_for(reader.read(min(size, self._remaining)), timeout)
+                    if not data:
+                        raise ConnectionError("Connection closed mid-response")
+                    self._remaining -= len(data)
+                    if self._remaining == 0:
+                        self._done = True
+                else:
+                    data = await asyncio.wait_for(reader.read(size), timeout)
+                    if not data:
+                        self._done = True
+                if data:
+                    if self._pool.bandwidth is not None:
+                        await self._pool.bandwidth.athrottle(len(data))
+                    yield data
+        finally:
+            self.release()
+
+    async def read(self):
+        """Read the whole body"""
+        parts = []
+        async for data in self.iter_chunks():
+            parts.append(data)
+        return b''.join(parts)
+
+    def release(self):
+        """Give the connection back (or close it if the body wasn't finished)"""
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool._release(self._key, conn, reusable=self._done and self._keep_alive)
+
+
+class ConnectionPool:
+    """Keep-alive connections per (scheme, host, port), with a per-host limit
+
+    With a `bandwidth` share (see bandwidth.py) body reads pause whenever the
+    job is ahead of its rate.
+    """
+
+    def __init__(self, max_per_host=8, timeout=30, headers=None, verify=True, bandwidth=None):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.bandwidth = bandwidth
+        self.headers = {'User-Agent': DEFAULT_USER_AGENT, 'Accept': '*/*'}
+        self.headers.update(headers or {})
+        self._ssl = ssl.create_default_context()
+        if not verify:
+            self._ssl.check_hostname = False
+            self._ssl.verify_mode = ssl.CERT_NONE
+        self._idle = {}  # key -> list of (reader, writer)
+        self._limits = {}  # key -> asyncio.Semaphore
+        self.connections_opened = 0
+        self.requests_sent = 0
+
+    def _limit(self, key):
+        if key not in self._limits:
+            self._limits[key] = asyncio.Semaphore(self.max_per_host)
+        return self._limits[key]
+
+    async def _connect(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(
+                host, port, ssl=self._ssl if scheme == 'https' else None,
+                server_hostname=host if scheme == 'https' else None,
+                limit=1024 * 1024),
+            self.timeout)
+        self.connections_opened += 1
+        return reader, writer, False
+
+    def _release(self, key, conn, reusable):
+        reader, writer = conn
+        if reusable and not writer.is_closing():
+            self._idle.setdefault(key, []).append(conn)
+        else:
+            writer.close()
+        self._limit(key).release()
+
+    async def open(self, method, url, headers=None, max_redirects=5):
+        """Send a request and return a Response with the body still unread
+
+        Follows redirects and raises HttpError for non-2xx statuses. The
+        caller must read the body (read/iter_chunks) or call release().
+        """
+        for _ in range(max_redirects + 1):
+            response = await self._send(method, url, headers)
+            if response.status in (301, 302, 303, 307, 308) and 'location' in response.headers:
+                await response.read()
+                url = urljoin(url, response.headers['location'])
+                if response.status == 303:
+                    method = 'GET'
+                continue
+            if not 200 <= response.status < 300:
+                response.release()
+                raise HttpError(response.status, url, response.headers)
+            return response
+        raise HttpError(310, url)
+
+    async def get(self, url, headers=None):
+        """GET a URL and return its whole body"""
+        response = await self.open('GET', url, headers)
+        return await response.read()
+
+    async def _send(self, method, url, headers):
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        request_headers['Host'] = parts.netloc.rsplit('@', 1)[-1]
+        request_headers.setdefault('Connection', 'keep-alive')
+        head = f"{method} {path} HTTP/1.1\r\n" + ''.join(
+            f"{name}: {value}\r\n" for name, value in request_headers.items()) + "\r\n"
+
+        await self._limit(key).acquire()
+        writer = None
+        try:
+            # A pooled connection may have been closed by the server while idle;
+            # retry once on a fresh connection in that case
+            for attempt in range(2):
+                reader, writer, reused = await self._connect(key)
+                try:
+                    writer.write(head.encode('latin-1'))
+                    await writer.drain()
+                    status_line = await asyncio.wait_for(reader.readline(), self.timeout)
+                    if not status_line:
+                        raise ConnectionError("Connection closed before response")
+                    break
+                except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                    writer.close()
+                    if not reused or attempt:
+                        raise
+            self.requests_sent += 1
+            _version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            response_headers = {}
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.timeout)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+        except BaseException:
+            if writer is not None:
+                writer.close()
+            self._limit(key).release()
+            raise
+        return Response(self, key, (reader, writer), method, url, int(status), reason, response_headers)
+
+    async def close(self):
+        for conns in self._idle.values():
+            for _reader, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+
+async def fetch_ordered(items, fetch, write, concurrency=8, buffer_size=32, limiter=None):
+    """Fetch items concurrently but hand the results to write() strictly in order
+
+    fetch(item) and write(index, data) are coroutines. At most `buffer_size`
+    results are held in memory waiting for an earlier item to finish, so a
+    single slow item throttles the fetchers instead of growing the buffer.
+
+    With a `limiter` (anything with a live `.value`, e.g. a
+    ConcurrencyController) only that many of the `concurrency` workers run.
+    """
+    buffer_size = max(buffer_size, concurrency)
+    # A slot is reserved *before* an item is handed to a worker, in order,
+    # so the item the writer is waiting for always has a slot
+    slots = asyncio.Semaphore(buffer_size)
+    work = asyncio.Queue()
+    ready = {}
+    ready_event = asyncio.Event()
+
+    async def dispatcher():
+        for index, item in enumerate(items):
+            await slots.acquire()
+            await work.put((index, item))
+        for _ in range(concurrency):
+            await work.put(None)
+
+    async def worker(number):
+        while True:
+            while limiter is not None and number >= limiter.value:
+                await asyncio.sleep(0.1)
+            job = await work.get()
+            if job is None:
+                return
+            index, item = job
+            ready[index] = await fetch(item)
+            ready_event.set()
+
+    async def writer():
+        for index in range(len(items)):
+            while index not in ready:
+                ready_event.clear()
+                await ready_event.wait()
+            await write(index, ready.pop(index))
+            slots.release()
+
+    tasks = [asyncio.ensure_future(dispatcher())]
+    tasks += [asyncio.ensure_future(worker(number)) for number in range(concurrency)]
+    writer_task = asyncio.ensure_future(writer())
+    try:
+        # The writer finishing means every item arrived; a failing fetch
+        # raises here right away instead of leaving the writer waiting
+        pending = {writer_task, *tasks}
+        while writer_task in pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    raise task.exception()
+    finally:
+        for task in [writer_task] + tasks:
+            task.cancel()
+        # asyncio.wait_for (before 3.12) can swallow a cancel that races a finished read;
+        # a worker that lives on that way must find the end marker instead of waiting forever
+        for _ in range(concurrency):
+            work.put_nowait(None)
+        await asyncio.gather(writer_task, *tasks, return_exceptions=True)
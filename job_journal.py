@@ -0,0 +1,160 @@
+"""
+JOB JOURNAL - Pick an interrupted batch up where it stopped
+
+A small SQLite database (kept in the output folder) with one row per job of
+a batch and the state it last reached:
+
+    queued -> extracting -> downloading -> postprocessing -> done / failed
+
+Every state change is committed right away, so after a crash, a closed
+window or Ctrl+C the journal still knows which jobs finished. Starting the
+same URL list again resumes that batch: finished jobs are skipped and the
+rest run again, continuing from the .part files yt-dlp and the native
+engines leave behind. Failed jobs get another try on resume as well.
+
+A batch is identified by its URLs (in order) and the requested format, so
+a different URL list starts a new batch instead.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from download_archive import canonical_url
+
+QUEUED = 'queued'
+EXTRACTING = 'extracting'
+DOWNLOADING = 'downloading'
+POSTPROCESSING = 'postprocessing'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (QUEUED, EXTRACTING, DOWNLOADING, POSTPROCESSING, DONE, FAILED)
+
+# ProgressEvent phase -> job state
+PHASE_STATES = {'download': DOWNLOADING, 'postprocess': POSTPROCESSING}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    format TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS jobs (
+    batch TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (batch, idx)
+) WITHOUT ROWID;
+"""
+
+
+def batch_id(urls, fmt):
+    """Stable id for a URL list + format"""
+    digest = hashlib.sha1(fmt.encode('utf-8'))
+    for url in urls:
+        digest.update(b'\n' + canonical_url(url).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class JobJournal:
+    """SQLite-backed job states of the current batch, safe to share between threads"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self.batch = None
+        self._states = {}  # idx -> state, so repeated updates don't touch the database
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def open_batch(self, urls, fmt):
+        """Start or resume the batch for these URLs; returns {idx: state} (1-based)
+
+        A batch that already ran to the end starts over with every job queued.
+        """
+        urls = list(urls)
+        self.batch = batch_id(urls, fmt)
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                'SELECT finished_at FROM batches WHERE id = ?', (self.batch,)).fetchone()
+            if row is not None and row[0] is None:
+                self._states = dict(self._db.execute(
+                    'SELECT idx, state FROM jobs WHERE batch = ?', (self.batch,)).fetchall())
+            else:
+                self._states = {idx: QUEUED for idx in range(1, len(urls) + 1)}
+                self._db.execute('DELETE FROM jobs WHERE batch = ?', (self.batch,))
+                self._db.execute('INSERT OR REPLACE INTO batches VALUES (?, ?, ?, ?, NULL)',
+                                 (self.batch, fmt, len(urls), now))
+                self._db.executemany(
+                    'INSERT INTO jobs (batch, idx, url, state, updated_at) VALUES (?, ?, ?, ?, ?)',
+                    [(self.batch, idx, url, QUEUED, now) for idx, url in enumerate(urls, 1)])
+            # Finished batches are only kept until the next one starts
+            self._db.execute('DELETE FROM jobs WHERE batch IN '
+                             '(SELECT id FROM batches WHERE finished_at IS NOT NULL AND id != ?)',
+                             (self.batch,))
+            self._db.execute('DELETE FROM batches WHERE finished_at IS NOT NULL AND id != ?',
+                             (self.batch,))
+        return dict(self._states)
+
+    def set_state(self, idx, state, error=None):
+        """Record that job idx reached `state` (no-op if it's already there)"""
+        with self._lock:
+            if self._states.get(idx) == state and error is None:
+                return
+            self._states[idx] = state
+            with self._db:
+                self._db.execute(
+                    'UPDATE jobs SET state = ?, error = ?, updated_at = ?, '
+                    'attempts = attempts + ? WHERE batch = ? AND idx = ?',
+                    (state, error, time.time(), int(state == EXTRACTING), self.batch, idx))
+
+    def track(self, idx, event):
+        """Move job idx along with a ProgressEvent (cheap enough to call for every event)"""
+        state = PHASE_STATES.get(event.phase)
+        if state is not None and self._states.get(idx) != state:
+            self.set_state(idx, state)
+
+    def finish_batch(self):
+        """Mark the batch complete if no job is left unfinished; returns whether it was"""
+        with self._lock:
+            if any(state not in (DONE, FAILED) for state in self._states.values()):
+                return False
+            with self._db:
+                self._db.execute('UPDATE batches SET finished_at = ? WHERE id = ?',
+                                 (time.time(), self.batch))
+            return True
+
+    def unfinished_batch(self):
+        """URLs of the most recent batch that didn't run to the end, or None"""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id FROM batches WHERE finished_at IS NULL '
+                'ORDER BY created_at DESC LIMIT 1').fetchone()
+            if row is None:
+                return None
+            return [url for (url,) in self._db.execute(
+                'SELECT url FROM jobs WHERE batch = ? ORDER BY idx', (row[0],))]
+
+    def counts(self):
+        """{state: number of jobs} for the current batch"""
+        with self._lock:
+            counts = {}
+            for state in self._states.values():
+                counts[state] = counts.get(state, 0) + 1
+            return counts
@@ -0,0 +1,376 @@
+"""
+JOB METRICS - Where the time of every download goes
+
+A JobMetrics follows one job through the same ProgressEvents that drive the
+progress bar and splits its wall time into phases:
+
+    extract      page/manifest extraction, until the first bytes arrive
+    download     transfer of every file of the job
+    postprocess  everything after, itemised per yt-dlp postprocessor
+                 (merge, sponsorblock, embed_subs, metadata, remux, ...)
+
+plus downloaded bytes, retries (failed fragments/requests) and why the job
+ended. MetricsRecorder collects the jobs of a batch (or of the daemon) and
+writes them to two files in the output folder:
+
+- download_events.jsonl  one JSON object per line: job start, phase changes,
+                         job end (the full record) and a batch summary
+- metrics.prom           Prometheus text format, rewritten after every job,
+                         for node_exporter's textfile collector or a quick look
+
+summary() has the batch-level numbers (job time percentiles, time share per
+phase) that the CLI and GUI print at the end of a batch.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+# yt-dlp postprocessor class names -> short step names
+STEP_NAMES = {
+    'Merger': 'merge',
+    'FFmpegMerger': 'merge',
+    'SponsorBlock': 'sponsorblock',
+    'ModifyChapters': 'sponsorblock',
+    'EmbedSubtitle': 'embed_subs',
+    'FFmpegEmbedSubtitle': 'embed_subs',
+    'Metadata': 'metadata',
+    'FFmpegMetadata': 'metadata',
+    'SinglePass': 'single_pass',
+    'FixupM3u8': 'fixup',
+    'FixupM4a': 'fixup',
+    'FixupTimestamp': 'fixup',
+    'FixupDuration': 'fixup',
+    'FFmpegFixupM3u8': 'fixup',
+    'MoveFiles': 'move_files',
+    'Remux': 'remux',
+}
+
+# Error text -> exit cause, first match wins
+EXIT_CAUSES = (
+    (re.compile(r'HTTP Error (429|503)|Too Many Requests|Service Unavailable', re.I), 'throttled'),
+    (re.compile(r'HTTP Error 40[13]|Forbidden|Sign in|log ?in|cookies|Private video', re.I), 'forbidden'),
+    (re.compile(r'HTTP Error 404|HTTP Error 410|Not Found|unavailable|removed', re.I), 'not_found'),
+    (re.compile(r'Unsupported URL|No video formats|Requested format', re.I), 'unsupported'),
+    (re.compile(r'ffmpeg|Postprocessing|Conversion failed|Muxer', re.I), 'postprocess'),
+    (re.compile(r'timed out|Connection|Network|resolve|SSL|Temporary failure', re.I), 'network'),
+)
+
+
+def step_name(postprocessor):
+    """Short name of a yt-dlp postprocessor for metrics labels"""
+    name = postprocessor or 'other'
+    return STEP_NAMES.get(name, re.sub(r'(PP|Postprocessor)$', '', name).lower() or 'other')
+
+
+def exit_cause(error):
+    """Rough reason a job failed, from its last error line"""
+    for pattern, cause in EXIT_CAUSES:
+        if error and pattern.search(error):
+            return cause
+    return 'error'
+
+
+def quantile(values, q):
+    """Nearest-rank quantile of a list (None if empty)"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values), max(1, math.ceil(q * len(values)))) - 1]
+
+
+class ErrorWatcher:
+    """Download monitor / line callback that keeps a job's last ERROR line in stats['error']"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def log_line(self, msg):
+        if msg.lstrip().startswith('ERROR'):
+            self.stats['error'] = msg.strip()
+
+
+class JobMetrics:
+    """Phase timeline, bytes and outcome of one job; feed it with event()"""
+
+    def __init__(self, index, url, recorder=None):
+        self.index = index
+        self.url = url
+        self.recorder = recorder
+        self.started_at = time.time()
+        self.duration = None
+        self.phases = {}  # phase -> seconds
+        self.steps = {}  # postprocess step -> seconds
+        self.files = {}  # filename -> bytes downloaded
+        self.retries = 0
+        self.throttled = 0
+        self.rewritten_bytes = 0  # Written by post-processing (merge included)
+        self.deduplicated_bytes = 0  # Not stored twice: the file was linked to an identical one
+        self.result = None  # 'ok', 'failed', 'cancelled' or 'skipped' once finished
+        self.cause = None
+        self.error = None
+        self.engine = None
+        self._lock = threading.Lock()
+        self._current = ('extract', None)
+        self._since = time.monotonic()
+        self._downloaded = False
+
+    def _switch(self, phase, step):
+        """Close the running phase and start another; returns whether it changed"""
+        now = time.monotonic()
+        with self._lock:
+            if (phase, step) == self._current:
+                return False
+            self._close(now)
+            self._current = (phase, step)
+        return True
+
+    def _close(self, now):
+        phase, step = self._current
+        elapsed = now - self._since
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        if step is not None:
+            self.steps[step] = self.steps.get(step, 0.0) + elapsed
+        self._since = now
+
+    def event(self, event):
+        """Account a ProgressEvent"""
+        if event.phase == 'download':
+            self._downloaded = True
+            if event.downloaded is not None:
+                self.files[event.filename] = max(event.downloaded, self.files.get(event.filename, 0))
+            changed = self._switch('download', None)
+        elif event.status == 'finished':
+            # Between postprocessors (or a pre-download one like SponsorBlock)
+            changed = self._switch('postprocess' if self._downloaded else 'extract', None)
+        else:
+            changed = self._switch('postprocess', step_name(event.postprocessor))
+        if changed and self.recorder is not None:
+            phase, step = self._current
+            self.recorder.write({'event': 'phase', 'job': self.index, 'phase': phase, 'step': step})
+
+    @property
+    def bytes(self):
+        return sum(self.files.values())
+
+    def finish(self, success, stats=None):
+        """Stop the clock; stats is the job's stats dict (engine, retries, error, ...)"""
+        stats = stats or {}
+        with self._lock:
+            self._close(time.monotonic())
+        self.duration = time.time() - self.started_at
+        concurrency = stats.get('concurrency') or {}
+        self.retries = stats.get('retries', 0)
+        self.rewritten_bytes = stats.get('rewritten_bytes', 0)
+        self.deduplicated_bytes = stats.get('deduplicated_bytes', 0)
+        self.throttled = concurrency.get('throttled', 0)
+        self.engine = stats.get('engine')
+        self.error = stats.get('error')
+        if stats.get('skipped'):
+            self.result, self.cause = 'skipped', 'archived'
+        elif stats.get('playlist'):
+            self.result, self.cause = 'skipped', 'playlist'  # Its entries ran as jobs of their own
+        elif success:
+            self.result, self.cause = 'ok', 'ok'
+        elif stats.get('cancelled'):
+            self.result, self.cause = 'cancelled', 'cancelled'
+        else:
+            self.result, self.cause = 'failed', exit_cause(self.error)
+
+    def as_dict(self):
+        return {
+            'job': self.index,
+            'url': self.url,
+            'engine': self.engine,
+            'result': self.result,
+            'cause': self.cause,
+            'error': self.error,
+            'started_at': round(self.started_at, 3),
+            'duration': round(self.duration or 0.0, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            'steps': {name: round(seconds, 3) for name, seconds in self.steps.items()},
+            'bytes': self.bytes,
+            'rewritten_bytes': self.rewritten_bytes,
+            'deduplicated_bytes': self.deduplicated_bytes,
+            'retries': self.retries,
+            'throttled': self.throttled,
+        }
+
+
+class MetricsRecorder:
+    """Collects JobMetrics and writes the JSONL event log and the Prometheus file"""
+
+    def __init__(self, events_path=None, prometheus_path=None):
+        self.events_path = str(events_path) if events_path else None
+        self.prometheus_path = str(prometheus_path) if prometheus_path else None
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._events = None
+        if self.events_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.events_path)), exist_ok=True)
+            self._events = open(self.events_path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        """Append one event to the JSONL log"""
+        if self._events is None:
+            return
+        line = json.dumps(dict({'ts': round(time.time(), 3)}, **record), default=str)
+        with self._lock:
+            if self._events is not None:
+                self._events.write(line + '\n')
+                self._events.flush()
+
+    def start(self, index, url):
+        metrics = JobMetrics(index, url, self)
+        self.write({'event': 'job_start', 'job': index, 'url': url})
+        return metrics
+
+    def finish(self, metrics, success, stats=None):
+        """Record a finished job; returns its metrics"""
+        metrics.finish(success, stats)
+        with self._lock:
+            self.jobs.append(metrics)
+        self.write(dict({'event': 'job_end'}, **metrics.as_dict()))
+        self.write_prometheus()
+        return metrics
+
+    def summary(self):
+        """Batch numbers: results, job time quantiles, time per phase/step, bytes, retries"""
+        with self._lock:
+            jobs = list(self.jobs)
+        ran = [job for job in jobs if job.result != 'skipped']
+        durations = [job.duration for job in ran]
+        results, causes, phases, steps = {}, {}, {}, {}
+        for job in jobs:
+            results[job.result] = results.get(job.result, 0) + 1
+            if job.result == 'failed':
+                causes[job.cause] = causes.get(job.cause, 0) + 1
+            for name, seconds in job.phases.items():
+                phases[name] = phases.get(name, 0.0) + seconds
+            for name, seconds in job.steps.items():
+                steps[name] = steps.get(name, 0.0) + seconds
+        return {
+            'jobs': len(jobs),
+            'results': results,
+            'failure_causes': causes,
+            'duration': {f'p{int(q * 100)}': quantile(durations, q) for q in QUANTILES},
+            'duration_max': max(durations) if durations else None,
+            'duration_sum': sum(durations),
+            'phases': phases,
+            'steps': steps,
+            'bytes': sum(job.bytes for job in jobs),
+            'rewritten_bytes': sum(job.rewritten_bytes for job in jobs),
+            'deduplicated_bytes': sum(job.deduplicated_bytes for job in jobs),
+            'retries': sum(job.retries for job in jobs),
+            'throttled': sum(job.throttled for job in jobs),
+        }
+
+    def prometheus_text(self):
+        """Everything recorded so far in the Prometheus text exposition format"""
+        summary = self.summary()
+        with self._lock:
+            jobs = list(self.jobs)
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP video_downloader_{name} {help_text}")
+            lines.append(f"# TYPE video_downloader_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                suffix = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"video_downloader_{name}{suffix} {_sample(value)}")
+
+        counts = {}
+        for job in jobs:
+            key = (job.result, job.cause, job.engine or 'none')
+            counts[key] = counts.get(key, 0) + 1
+        metric('jobs_total', 'counter', "Finished jobs by result, exit cause and engine",
+               [({'result': r, 'cause': c, 'engine': e}, n) for (r, c, e), n in sorted(counts.items())])
+        durations = [job.duration for job in jobs if job.result != 'skipped']
+        metric('job_duration_seconds', 'summary', "Wall time per job (skipped jobs excluded)",
+               [({'quantile': str(q)}, quantile(durations, q)) for q in QUANTILES if durations])
+        lines.append(f"video_downloader_job_duration_seconds_sum {_sample(summary['duration_sum'])}")
+        lines.append(f"video_downloader_job_duration_seconds_count {len(durations)}")
+        metric('phase_seconds_total', 'counter', "Time spent per job phase",
+               [({'phase': name}, seconds) for name, seconds in sorted(summary['phases'].items())])
+        metric('postprocess_step_seconds_total', 'counter', "Time spent per postprocessing step",
+               [({'step': name}, seconds) for name, seconds in sorted(summary['steps'].items())])
+        metric('downloaded_bytes_total', 'counter', "Bytes downloaded", [({}, summary['bytes'])])
+        metric('postprocess_rewritten_bytes_total', 'counter', "Bytes written by post-processing (merges included)",
+               [({}, summary['rewritten_bytes'])])
+        metric('deduplicated_bytes_total', 'counter', "Bytes not stored twice (files linked to identical ones)",
+               [({}, summary['deduplicated_bytes'])])
+        metric('retries_total', 'counter', "Failed requests/fragments (retried, or ending the job)",
+               [({}, summary['retries'])])
+        metric('throttled_total', 'counter', "Requests answered with 429/503", [({}, summary['throttled'])])
+        metric('last_update_timestamp_seconds', 'gauge', "When this file was written",
+               [({}, time.time())])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self):
+        if not self.prometheus_path:
+            return
+        tmp_path = self.prometheus_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            # Replace in one go so a scraper never reads half a file
+            os.replace(tmp_path, self.prometheus_path)
+        except OSError:
+            pass
+
+    def close(self, batch=True):
+        """Write the batch summary (unless batch=False) and close the event log"""
+        if batch and self.jobs:
+            self.write(dict({'event': 'batch'}, **self.summary()))
+        self.write_prometheus()
+        with self._lock:
+            if self._events is not None:
+                self._events.close()
+                self._events = None
+
+
+def _sample(value):
+    """A sample value without exponent notation or float noise"""
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(round(value, 6))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_summary(summary):
+    """Lines for the end-of-batch report"""
+    if not summary['jobs'] or summary['duration']['p50'] is None:
+        return []
+    d = summary['duration']
+    lines = [f"⏱️  Job time: median {d['p50']:.1f}s, p90 {d['p90']:.1f}s, p99 {d['p99']:.1f}s "
+             f"(longest {summary['duration_max']:.1f}s)"]
+    total = sum(summary['phases'].values())
+    if total > 0:
+        line = "   Time spent: " + " · ".join(
+            f"{name} {summary['phases'][name] / total:.0%}"
+            for name in ('extract', 'download', 'postprocess') if summary['phases'].get(name))
+        steps = sorted(summary['steps'].items(), key=lambda item: -item[1])
+        if steps:
+            line += " (" + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in steps[:4]) + ")"
+        lines.append(line)
+    extra = f"   {summary['bytes'] / 1024 / 1024:.1f} MB downloaded"
+    if summary['rewritten_bytes']:
+        extra += f", {summary['rewritten_bytes'] / 1024 / 1024:.1f} MB rewritten by post-processing"
+    if summary['deduplicated_bytes']:
+        extra += f", {summary['deduplicated_bytes'] / 1024 / 1024:.1f} MB saved by linking duplicates"
+    extra += f", {summary['retries']} retries"
+    if summary['throttled']:
+        extra += f" ({summary['throttled']} throttled)"
+    if summary['failure_causes']:
+        extra += ", failures: " + ", ".join(f"{n} {cause}" for cause, n in sorted(summary['failure_causes'].items()))
+    lines.append(extra)
+    return lines
@@ -0,0 +1,468 @@
+"""
+JOB QUEUE - Several machines downloading one batch
+
+One machine's network link and disks cap how fast a batch can go. A
+JobQueue is a batch that any number of nodes (`python video_downloader.py
+--queue ... --work`) drain together, each with its own parallel downloads:
+
+- a node leases a job before it starts it, and renews the leases of the
+  jobs it holds with a heartbeat every third of the lease time
+- a node that crashes or loses the network stops renewing; once its leases
+  run out (QUEUE_LEASE_SECONDS) another node takes those jobs over
+- a job whose lease ran out `max_leases` times is marked failed instead of
+  taking down one node after the other
+- only the node holding a job's lease can finish it, so a node that comes
+  back after its lease was taken over can't overwrite the result
+
+The queue is a SQLite file. Either every node opens it directly - on a
+network share with working file locking (NFSv4, SMB), and with the nodes'
+clocks in sync - or one machine serves it with --coordinator and the nodes
+talk to that over HTTP (QueueClient), which needs neither.
+
+Coordinator API (JSON in and out). Every request carries the coordinator's
+shared secret in an X-Queue-Token header; anything else gets a 401.
+
+    GET  /status      {state: number of jobs}
+    GET  /failed      the failed jobs with their errors
+    POST /jobs        {"urls": [...]} -> how many were added
+    POST /lease       {"worker", "ttl", "limit"} -> leased jobs
+    POST /heartbeat   {"worker", "ids", "ttl"} -> ids no longer held
+    POST /complete    {"worker", "id", "success", "error"}
+    POST /release     {"worker", "ids"}
+"""
+
+import hmac
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from download_archive import canonical_url
+from job_journal import DONE, FAILED, QUEUED
+
+LEASED = 'leased'
+POLL_SECONDS = 5.0  # How often an idle node asks for work while other nodes still hold jobs
+MAX_BODY = 16 * 1024 * 1024  # Largest request body the coordinator accepts (bytes)
+TOKEN_HEADER = 'X-Queue-Token'
+TOKEN_ENV = 'VIDEO_QUEUE_TOKEN'  # Where QueueClient finds the token when none is passed
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    leases INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+def worker_name():
+    """This process' name in the queue: host and process id"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class QueueError(Exception):
+    """The coordinator isn't reachable or rejected a request"""
+
+
+class JobQueue:
+    """A shared batch in a SQLite file; thread-safe, and safe to open from several processes"""
+
+    def __init__(self, path, max_leases=3):
+        self.path = str(path)
+        self.location = self.path
+        self.max_leases = max(1, int(max_leases))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._lock = threading.Lock()
+        # Rollback journal, not WAL: WAL's shared memory doesn't work across machines
+        self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=DELETE')
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _write(self, work):
+        """Run work(db) in one write transaction; the lock is taken up front so leases can't race"""
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(self._db)
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+            return result
+
+    def add(self, urls):
+        """Queue URLs; returns {'added', 'requeued', 'waiting'}
+
+        A URL that's queued or leased already stays as it is; one that
+        finished earlier is queued again (nodes skip what their archive has).
+        """
+        counts = {'added': 0, 'requeued': 0, 'waiting': 0}
+        now = time.time()
+
+        def work(db):
+            for url in urls:
+                key = canonical_url(url)
+                row = db.execute('SELECT state FROM jobs WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    db.execute('INSERT INTO jobs (url, key, state, updated_at) VALUES (?, ?, ?, ?)',
+                               (url, key, QUEUED, now))
+                    counts['added'] += 1
+                elif row[0] in (DONE, FAILED):
+                    db.execute('UPDATE jobs SET url = ?, state = ?, worker = NULL, lease_until = NULL, '
+                               'leases = 0, error = NULL, updated_at = ? WHERE key = ?',
+                               (url, QUEUED, now, key))
+                    counts['requeued'] += 1
+                else:
+                    counts['waiting'] += 1
+        self._write(work)
+        return counts
+
+    def lease(self, worker, ttl, limit=1):
+        """Take up to `limit` jobs for `ttl` seconds: [{'id', 'url', 'taken_from'}]
+
+        Jobs whose lease ran out count as waiting again; 'taken_from' names
+        the worker that held such a job last.
+        """
+        def work(db):
+            now = time.time()
+            db.execute("UPDATE jobs SET state = ?, error = ?, worker = NULL, updated_at = ? "
+                       "WHERE state = ? AND lease_until < ? AND leases >= ?",
+                       (FAILED, f"Lease ran out {self.max_leases} times (did it crash the worker?)",
+                        now, LEASED, now, self.max_leases))
+            rows = db.execute('SELECT id, url, worker FROM jobs WHERE state = ? OR (state = ? AND lease_until < ?) '
+                              'ORDER BY id LIMIT ?', (QUEUED, LEASED, now, max(1, int(limit)))).fetchall()
+            db.executemany('UPDATE jobs SET state = ?, worker = ?, lease_until = ?, leases = leases + 1, '
+                           'updated_at = ? WHERE id = ?',
+                           [(LEASED, worker, now + ttl, now, job_id) for job_id, _url, _previous in rows])
+            return [{'id': job_id, 'url': url, 'taken_from': previous} for job_id, url, previous in rows]
+        return self._write(work)
+
+    def heartbeat(self, worker, ids, ttl):
+        """Renew the worker's leases; returns the ids it doesn't hold any more"""
+        def work(db):
+            lost = []
+            now = time.time()
+            for job_id in ids:
+                updated = db.execute('UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = ?',
+                                     (now + ttl, job_id, worker, LEASED)).rowcount
+                if not updated:
+                    lost.append(job_id)
+            return lost
+        return self._write(work) if ids else []
+
+    def complete(self, worker, job_id, success, error=None):
+        """Record a job's result; False if the worker had lost its lease (nothing is changed then)"""
+        def work(db):
+            return db.execute('UPDATE jobs SET state = ?, error = ?, worker = NULL, lease_until = NULL, '
+                              'updated_at = ? WHERE id = ? AND worker = ? AND state = ?',
+                              (DONE if success else FAILED, None if success else error, time.time(),
+                               job_id, worker, LEASED)).rowcount > 0
+        return self._write(work)
+
+    def release(self, worker, ids):
+        """Hand unfinished jobs back without waiting for their leases to run out (a node stopping)"""
+        def work(db):
+            db.executemany('UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, updated_at = ?, '
+                           'leases = MAX(0, leases - 1) WHERE id = ? AND worker = ? AND state = ?',
+                           [(QUEUED, time.time(), job_id, worker, LEASED) for job_id in ids])
+        if ids:
+            self._write(work)
+
+    def counts(self):
+        """{state: number of jobs}"""
+        with self._lock:
+            return dict(self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+    def failed(self, limit=100):
+        """[{'url', 'error'}] of failed jobs, oldest first"""
+        with self._lock:
+            return [{'url': url, 'error': error} for url, error in self._db.execute(
+                'SELECT url, error FROM jobs WHERE state = ? ORDER BY id LIMIT ?', (FAILED, limit))]
+
+
+class QueueWorker:
+    """The leases one node holds on a queue (a JobQueue or QueueClient), kept alive by a heartbeat
+
+    jobs() hands out leased jobs until the queue is drained. Lost leases
+    (the node stalled and another took the job over) are in `lost`.
+    """
+
+    def __init__(self, queue, ttl=60.0, worker=None, log=None):
+        self.queue = queue
+        self.ttl = ttl
+        self.worker = worker or worker_name()
+        self.log = log
+        self._lock = threading.Lock()
+        self._held = set()
+        self.lost = set()
+        self.leased = 0
+        self.taken_over = 0  # Jobs of crashed (or stalled) nodes this one took on
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def _say(self, message):
+        if self.log is not None:
+            self.log(message)
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.ttl / 3):
+            with self._lock:
+                held = list(self._held)
+            try:
+                lost = self.queue.heartbeat(self.worker, held, self.ttl)
+            except (QueueError, sqlite3.Error) as e:
+                self._say(f"⚠️  Queue heartbeat failed ({e}) - trying again")
+                continue
+            if lost:
+                with self._lock:
+                    self._held.difference_update(lost)
+                    self.lost.update(lost)
+                self._say(f"⚠️  Lost the lease of {len(lost)} job(s) - another node has taken them over")
+
+    def jobs(self):
+        """Leased jobs as {'id', 'url', 'taken_from'}, one at a time, until no job is waiting or leased"""
+        while not self._stopped.is_set():
+            try:
+                leased = self.queue.lease(self.worker, self.ttl, 1)
+                counts = self.queue.counts() if not leased else None
+            except (QueueError, sqlite3.Error) as e:
+                self._say(f"⚠️  Can't reach the job queue ({e}) - trying again")
+                self._stopped.wait(POLL_SECONDS)
+                continue
+            for job in leased:
+                with self._lock:
+                    self._held.add(job['id'])
+                self.leased += 1
+                if job['taken_from'] and job['taken_from'] != self.worker:
+                    self.taken_over += 1
+                yield job
+            if counts is not None:
+                if not counts.get(QUEUED) and not counts.get(LEASED):
+                    return
+                # Other nodes still hold jobs: one of them may fail and need taking over
+                self._stopped.wait(POLL_SECONDS)
+
+    def finish(self, job_id, success, error=None):
+        """Report a job's result (ignored by the queue if the lease was lost meanwhile)"""
+        with self._lock:
+            self._held.discard(job_id)
+            if job_id in self.lost:
+                return False
+        try:
+            return self.queue.complete(self.worker, job_id, success, error)
+        except (QueueError, sqlite3.Error) as e:
+            self._say(f"⚠️  Couldn't report a finished job to the queue ({e}) - it will run again elsewhere")
+            return False
+
+    def close(self):
+        """Stop the heartbeat and hand back the jobs still held"""
+        self._stopped.set()
+        with self._lock:
+            held = list(self._held)
+            self._held.clear()
+        try:
+            self.queue.release(self.worker, held)
+        except (QueueError, sqlite3.Error):
+            pass  # Their leases run out on their own
+
+
+class QueueServer:
+    """Serves a JobQueue over HTTP for nodes that don't share a filesystem (--coordinator)
+
+    Only requests carrying `token` (TOKEN_HEADER) are answered.
+    """
+
+    def __init__(self, queue, token, host='127.0.0.1', port=8766):
+        if not token:
+            raise ValueError("The coordinator needs a token")
+        self.queue = queue
+        self.server = ThreadingHTTPServer((host, port), QueueHandler)
+        self.server.daemon_threads = True
+        self.server.queue = queue
+        self.server.token = token
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class QueueHandler(BaseHTTPRequestHandler):
+    """HTTP front end of a JobQueue (self.server.queue)"""
+
+    server_version = 'VideoDownloaderQueue/1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _authorized(self):
+        """Whether the request carries the token; replies 401 if not"""
+        token = self.headers.get(TOKEN_HEADER) or ''
+        if hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            return True
+        self._reply(401, {'error': f"Missing or wrong {TOKEN_HEADER}"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        path = urlsplit(self.path).path.rstrip('/')
+        if path == '/status':
+            return self._reply(200, self.server.queue.counts())
+        if path == '/failed':
+            return self._reply(200, {'jobs': self.server.queue.failed()})
+        self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        queue = self.server.queue
+        path = urlsplit(self.path).path.rstrip('/')
+        body = self._body()
+        if body is None:
+            return
+        try:
+            if path == '/jobs':
+                urls = body.get('urls')
+                if not isinstance(urls, list) or not all(isinstance(url, str) and url.strip() for url in urls):
+                    return self._reply(400, {'error': 'Expected {"urls": ["https://...", ...]}'})
+                return self._reply(201, queue.add([url.strip() for url in urls]))
+            worker = body.get('worker')
+            if not isinstance(worker, str) or not worker:
+                return self._reply(400, {'error': 'worker is required'})
+            if path == '/lease':
+                return self._reply(200, {'jobs': queue.lease(worker, float(body.get('ttl', 60)),
+                                                             int(body.get('limit', 1)))})
+            if path == '/heartbeat':
+                return self._reply(200, {'lost': queue.heartbeat(worker, list(body.get('ids') or []),
+                                                                 float(body.get('ttl', 60)))})
+            if path == '/complete':
+                return self._reply(200, {'recorded': queue.complete(worker, int(body['id']),
+                                                                    bool(body.get('success')), body.get('error'))})
+            if path == '/release':
+                queue.release(worker, list(body.get('ids') or []))
+                return self._reply(200, {})
+        except (KeyError, TypeError, ValueError) as e:
+            return self._reply(400, {'error': f"Bad request: {e}"})
+        self._reply(404, {'error': 'Not found'})
+
+    def _body(self):
+        """The JSON object sent with the request, or None after replying with an error"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._reply(400, {'error': 'Bad Content-Length'})
+            return None
+        if length > MAX_BODY:
+            self._reply(413, {'error': 'Request body too large'})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self._reply(400, {'error': 'Expected a JSON object'})
+            return None
+        return body
+
+    def _reply(self, code, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class QueueClient:
+    """A coordinator's queue, with the same methods as JobQueue
+
+    `token` is the coordinator's shared secret (default: $VIDEO_QUEUE_TOKEN).
+    """
+
+    def __init__(self, url, timeout=30, token=None):
+        self.url = url.rstrip('/')
+        self.location = self.url
+        self.timeout = timeout
+        self.token = token or os.environ.get(TOKEN_ENV) or ''
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json', TOKEN_HEADER: self.token})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                raise QueueError(f"{self.url} didn't accept the token - pass the coordinator's "
+                                 f"with --token or ${TOKEN_ENV}")
+            try:
+                message = json.loads(e.read()).get('error')
+            except ValueError:
+                message = None
+            raise QueueError(message or f"HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            raise QueueError(f"No coordinator at {self.url} ({getattr(e, 'reason', e)})")
+
+    def add(self, urls):
+        return self._request('POST', '/jobs', {'urls': list(urls)})
+
+    def lease(self, worker, ttl, limit=1):
+        return self._request('POST', '/lease', {'worker': worker, 'ttl': ttl, 'limit': limit})['jobs']
+
+    def heartbeat(self, worker, ids, ttl):
+        if not ids:
+            return []
+        return self._request('POST', '/heartbeat', {'worker': worker, 'ids': list(ids), 'ttl': ttl})['lost']
+
+    def complete(self, worker, job_id, success, error=None):
+        return self._request('POST', '/complete', {'worker': worker, 'id': job_id, 'success': success,
+                                                   'error': error})['recorded']
+
+    def release(self, worker, ids):
+        if ids:
+            self._request('POST', '/release', {'worker': worker, 'ids': list(ids)})
+
+    def counts(self):
+        return self._request('GET', '/status')
+
+    def failed(self, limit=100):
+        return self._request('GET', '/failed')['jobs'][:limit]
+
+    def close(self):
+        pass
+
+
+def open_queue(location, max_leases=3, token=None):
+    """A coordinator's http://host:port (token: its shared secret), or the path of a queue file"""
+    if location.lower().startswith(('http://', 'https://')):
+        return QueueClient(location, token=token)
+    return JobQueue(location, max_leases)
@@ -0,0 +1,165 @@
+"""
+PIPELINE - Overlap page extraction, transfers and post-processing
+
+Without it a job holds its download slot from the first request to the last
+ffmpeg call, so the network idles while videos are merged and the CPU idles
+while the next ones download. A Pipeline splits a job into three stages,
+each with its own number of slots:
+
+    extract      resolving the page with yt-dlp's extractors (network, some CPU)
+    transfer     fetching the media (network)
+    postprocess  merging, remuxing, embedding, SponsorBlock cuts (ffmpeg: CPU and disk)
+
+A job gives up the slot it holds when it moves to the next stage and waits
+on its own thread while that stage is full. The scheduler runs `threads`
+workers - one per slot - so when post-processing falls behind, downloaded
+jobs queue up for it, the workers run out and no new job starts. That
+backpressure keeps finished downloads from piling up faster than ffmpeg
+can handle them.
+
+The move into post-processing is driven by the job's progress events
+(StagedJob.watch), so it works for every engine that reports them. yt-dlp
+subprocesses keep post-processing while their job waits for a slot; there
+the limit only holds back the jobs that come after.
+"""
+
+import threading
+import time
+
+EXTRACT = 'extract'
+TRANSFER = 'transfer'
+POSTPROCESS = 'postprocess'
+STAGES = (EXTRACT, TRANSFER, POSTPROCESS)
+
+
+class Pipeline:
+    """Slots per stage, shared by the jobs of a batch (or a daemon); thread-safe"""
+
+    def __init__(self, extract=2, transfer=3, postprocess=2):
+        self.limits = {EXTRACT: max(1, int(extract)), TRANSFER: max(1, int(transfer)),
+                       POSTPROCESS: max(1, int(postprocess))}
+        self._cond = threading.Condition()
+        self._held = {}  # job -> (stage, since)
+        self._busy = {stage: 0 for stage in STAGES}
+        self._waiting = {stage: 0 for stage in STAGES}
+        self.busy_seconds = {stage: 0.0 for stage in STAGES}  # Slot time used
+        self.wait_seconds = {stage: 0.0 for stage in STAGES}  # Time jobs spent queued for a stage
+        self.started = time.monotonic()
+
+    @property
+    def threads(self):
+        """Workers needed to keep every stage busy"""
+        return sum(self.limits.values())
+
+    def job(self, job, on_postprocess=None):
+        """A StagedJob for `job`; on_postprocess(job) runs when it stops using the network"""
+        return StagedJob(self, job, on_postprocess)
+
+    def stage_of(self, job):
+        with self._cond:
+            held = self._held.get(job)
+            return held[0] if held else None
+
+    def enter(self, job, stage):
+        """Move a job into a stage, waiting for a free slot; returns the seconds waited"""
+        with self._cond:
+            held = self._held.get(job)
+            if held is not None and held[0] == stage:
+                return 0.0
+            self._release(job)
+            queued = time.monotonic()
+            self._waiting[stage] += 1
+            try:
+                while self._busy[stage] >= self.limits[stage]:
+                    self._cond.wait()
+            finally:
+                self._waiting[stage] -= 1
+            now = time.monotonic()
+            self._busy[stage] += 1
+            self._held[job] = (stage, now)
+            self.wait_seconds[stage] += now - queued
+            return now - queued
+
+    def leave(self, job):
+        """Give back whatever slot the job holds (it finished or failed)"""
+        with self._cond:
+            self._release(job)
+
+    def _release(self, job):
+        held = self._held.pop(job, None)
+        if held is None:
+            return
+        stage, since = held
+        self._busy[stage] -= 1
+        self.busy_seconds[stage] += time.monotonic() - since
+        self._cond.notify_all()
+
+    def snapshot(self):
+        """Per stage: slots, busy, waiting, utilisation so far and total wait"""
+        with self._cond:
+            now = time.monotonic()
+            elapsed = max(now - self.started, 1e-9)
+            busy = dict(self.busy_seconds)
+            for stage, since in self._held.values():
+                busy[stage] += now - since
+            return {stage: {
+                'slots': self.limits[stage],
+                'busy': self._busy[stage],
+                'waiting': self._waiting[stage],
+                'utilisation': busy[stage] / (elapsed * self.limits[stage]),
+                'wait_seconds': self.wait_seconds[stage],
+            } for stage in STAGES}
+
+
+class StagedJob:
+    """One job's way through a Pipeline"""
+
+    def __init__(self, pipeline, job, on_postprocess=None):
+        self.pipeline = pipeline
+        self.job = job
+        self.on_postprocess = on_postprocess
+        self.waited = {}  # stage -> seconds spent waiting for a slot
+        self._downloaded = False
+        self._offline = False
+
+    @property
+    def stage(self):
+        return self.pipeline.stage_of(self.job)
+
+    def enter(self, stage):
+        waited = self.pipeline.enter(self.job, stage)
+        if waited:
+            self.waited[stage] = self.waited.get(stage, 0.0) + waited
+        if stage == POSTPROCESS and not self._offline:
+            self._offline = True
+            if self.on_postprocess is not None:
+                self.on_postprocess(self.job)
+
+    def watch(self, callback=None):
+        """Wrap a progress callback so the job changes stage as its events arrive"""
+        def progress(event):
+            if callback is not None:
+                callback(event)
+            if event.phase == 'download':
+                self._downloaded = True
+                if self.stage != TRANSFER:
+                    self.enter(TRANSFER)  # Next item of a playlist
+            elif self._downloaded and event.status == 'started':
+                # Post-processors that run before the download (SponsorBlock) stay in transfer
+                self.enter(POSTPROCESS)
+        return progress
+
+    def close(self):
+        self.pipeline.leave(self.job)
+
+
+def format_pipeline(snapshot):
+    """One summary line: how busy each stage was and how long jobs queued for it"""
+    parts = []
+    for stage in STAGES:
+        info = snapshot[stage]
+        text = f"{stage} {info['utilisation'] * 100:.0f}% of {info['slots']}"
+        if info['wait_seconds'] >= 0.05:
+            text += f" (queued {info['wait_seconds']:.1f}s)"
+        parts.append(text)
+    return "🏭 Pipeline use: " + " · ".join(parts)
@@ -0,0 +1,94 @@
+"""
+PLAYLIST FEED - Turn a playlist into jobs while it's being enumerated
+
+With DOWNLOAD_PLAYLIST the whole playlist used to go to a single yt-dlp run,
+which lists every entry before the first video starts - minutes for a
+channel with thousands of videos - and lists them all again on every rerun.
+A PlaylistFeed walks the entries lazily instead (sites with paged listings
+are fetched one page at a time) and the scheduler queues each as a job of
+its own as soon as it's found, so the first videos download while the rest
+of the list is still being read.
+
+Incremental sync: the download archive remembers which entries of a
+playlist were downloaded. Once a playlist was gone through to the end, a
+rerun skips the entries it knows and stops enumerating after `stop_after`
+of them in a row - channels list the newest uploads first, so that's where
+the new content ends.
+"""
+
+from download_archive import canonical_url
+
+
+def entry_url(entry):
+    """The URL to download a playlist entry from (None if it has none)"""
+    if entry.get('_type') in ('url', 'url_transparent'):
+        return entry.get('url') or entry.get('webpage_url')
+    # A fully extracted entry: its 'url' is the media itself, not a page
+    return entry.get('webpage_url') or entry.get('original_url') or entry.get('url')
+
+
+def is_extracted(entry):
+    """Whether an entry already carries its formats (no need to extract it again)"""
+    return entry.get('_type', 'video') == 'video' and bool(entry.get('formats'))
+
+
+class PlaylistFeed:
+    """The entries of one playlist, for going through once
+
+    `entries` is the lazy iterator from SessionPool.expand(). Iterating the
+    feed yields (entry id, URL, entry) for every entry still to download;
+    extraction errors end it early (see `error`).
+    """
+
+    def __init__(self, url, info, entries, archive=None, sync=True, stop_after=5):
+        self.url = url
+        self.title = (info or {}).get('title') or (info or {}).get('id') or url
+        self._entries = entries
+        self.archive = archive
+        # Only a playlist that was complete once can stop at known entries
+        self.synced = archive.playlist_synced(url) if archive is not None and sync else None
+        self.stop_after = max(1, stop_after)
+        self.found = 0  # Entries enumerated
+        self.known = 0  # ...of which were downloaded in an earlier sync
+        self.complete = False  # Enumerated to the end, or up to the known entries
+        self.stopped_early = False
+        self.error = None
+
+    def __iter__(self):
+        seen = {canonical_url(self.url)}
+        streak = 0
+        try:
+            for entry in self._entries:
+                url = entry_url(entry)
+                if not url or canonical_url(url) in seen:
+                    continue
+                seen.add(canonical_url(url))
+                entry_id = str(entry.get('id') or url)
+                self.found += 1
+                if self.synced is not None and self.archive.knows_entry(self.url, entry_id):
+                    self.known += 1
+                    streak += 1
+                    if streak >= self.stop_after:
+                        self.stopped_early = True
+                        break
+                    continue
+                streak = 0
+                yield entry_id, url, entry
+            self.complete = True
+        except Exception as e:  # yt-dlp's DownloadError while fetching a page, mostly
+            self.error = str(e)
+        finally:
+            close = getattr(self._entries, 'close', None)
+            if close is not None:
+                close()  # Gives the yt-dlp session back
+
+    def describe(self):
+        """One line on how the enumeration went"""
+        text = f"📃 {self.title}: {self.found} entr{'y' if self.found == 1 else 'ies'} found"
+        if self.stopped_early:
+            text += f", stopped after {self.stop_after} already downloaded in a row (synced)"
+        elif self.known:
+            text += f", {self.known} already downloaded"
+        if self.error:
+            text += f" - listing failed: {self.error}"
+        return text
@@ -0,0 +1,353 @@
+"""
+POSTPROCESS PLAN - One ffmpeg pass instead of one per post-processing step
+
+yt-dlp post-processes a finished download step by step, and every step is
+a full stream copy of the file: cutting SponsorBlock segments, embedding
+subtitles, writing metadata and chapters. For a multi-GB video that's
+several GB of extra disk traffic. With yt-dlp told to only mark sponsor
+segments and write (not embed) subtitles and metadata, PostprocessPlan
+does all of it in one stream-copy ffmpeg run:
+
+- sponsor segments are cut with the concat demuxer (inpoint/outpoint for
+  every kept range); WebVTT/SRT subtitles get their cue times moved the same
+  way beforehand (the concat demuxer doesn't cut text subtitles reliably)
+- subtitles are mapped in as extra inputs (mov_text in MP4)
+- title, date, description, uploader... and the chapters (moved onto the
+  cut timeline) come from one FFMETADATA input
+- +faststart for MP4 if asked for; ffmpeg does it in the same run but moves
+  the data once more at the end, so it counts as a second write
+
+yt-dlp still merges separate video and audio downloads itself (it can't hand
+over the parts unmerged), so a merged video costs two writes at most. run()
+returns the bytes written; stepwise_bytes is what yt-dlp's own chain would
+have written, so the saving can be measured.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+
+import ytdlp_engine
+from disk_space import finish_file
+
+PLANNABLE_EXTS = ('mp4', 'm4a', 'mov', 'mkv', 'mka', 'webm')
+MP4_EXTS = ('mp4', 'm4a', 'mov')
+CUE_TIME_RE = re.compile(r'^((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[.,]\d{3})(.*)$')
+TINY_CHAPTER = 1.0  # Chapters left shorter than this by the cuts are dropped (seconds)
+
+# FFMETADATA tag -> info fields to take it from (the first one set wins), as yt-dlp's --embed-metadata
+METADATA_FIELDS = (
+    ('title', ('track', 'title')),
+    ('date', ('upload_date',)),
+    ('description', ('description',)),
+    ('synopsis', ('description',)),
+    ('purl', ('webpage_url',)),
+    ('comment', ('webpage_url',)),
+    ('track', ('track_number',)),
+    ('artist', ('artist', 'artists', 'creator', 'creators', 'uploader', 'uploader_id')),
+    ('composer', ('composer', 'composers')),
+    ('genre', ('genre', 'genres', 'categories', 'tags')),
+    ('album', ('album', 'series')),
+    ('album_artist', ('album_artist', 'album_artists')),
+    ('disc', ('disc_number',)),
+    ('show', ('series',)),
+    ('season_number', ('season_number',)),
+    ('episode_id', ('episode', 'episode_id')),
+    ('episode_sort', ('episode_number',)),
+)
+
+
+class PostprocessError(Exception):
+    """ffmpeg couldn't carry out a plan (the downloaded file is left as it was)"""
+
+
+def metadata_tags(info):
+    """{tag: value} to embed for a yt-dlp info dict (meta_<tag> fields override)"""
+    tags = {}
+    for tag, fields in METADATA_FIELDS:
+        value = info.get(f'meta_{tag}')
+        if value is None:
+            value = next((info[field] for field in fields if info.get(field) is not None), None)
+        if isinstance(value, (list, tuple)):
+            value = ', '.join(map(str, value))
+        if value not in ('', None):
+            tags[tag] = str(value).replace('\0', '')
+    return tags
+
+
+def merge_ranges(ranges):
+    """Sort and join overlapping (start, end) ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def shift_time(t, cuts):
+    """Where time t of the original ends up once `cuts` are removed"""
+    removed = 0.0
+    for start, end in cuts:
+        if t <= start:
+            break
+        removed += min(t, end) - start
+    return t - removed
+
+
+def cut_chapters(chapters, cuts):
+    """Chapters moved onto the cut timeline; ones that (nearly) vanish are dropped"""
+    result = []
+    for chapter in chapters:
+        start, end = shift_time(chapter['start_time'], cuts), shift_time(chapter['end_time'], cuts)
+        if end - start >= TINY_CHAPTER:
+            result.append(dict(chapter, start_time=start, end_time=end))
+    return result
+
+
+def _parse_cue_time(text):
+    seconds = 0.0
+    for part in text.replace(',', '.').split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def _format_cue_time(seconds, srt):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{',' if srt else '.'}{millis:03d}"
+
+
+def cut_subtitles(text, cuts, srt=False):
+    """WebVTT/SRT text with the cue times moved onto the cut timeline; cues that were cut out go"""
+    blocks = re.split(r'\n\s*\n', text.replace('\r\n', '\n').strip('\n'))
+    kept = []
+    for block in blocks:
+        lines = block.split('\n')
+        timing = next((i for i, line in enumerate(lines) if CUE_TIME_RE.match(line.strip())), None)
+        if timing is None:
+            kept.append(block)  # WEBVTT header, NOTE, STYLE...
+            continue
+        start, end, settings = CUE_TIME_RE.match(lines[timing].strip()).groups()
+        start, end = shift_time(_parse_cue_time(start), cuts), shift_time(_parse_cue_time(end), cuts)
+        if end - start < 0.001:
+            continue
+        lines[timing] = f"{_format_cue_time(start, srt)} --> {_format_cue_time(end, srt)}{settings}"
+        kept.append('\n'.join(lines))
+    if srt:
+        # Renumber, the removed cues left gaps
+        numbered = []
+        for n, block in enumerate(kept, 1):
+            lines = block.split('\n')
+            if lines[0].strip().isdigit():
+                lines[0] = str(n)
+            numbered.append('\n'.join(lines))
+        kept = numbered
+    return '\n\n'.join(kept) + '\n'
+
+
+def _escape_meta(text):
+    return ''.join('\\' + c if c in '=;#\\\n' else c for c in str(text))
+
+
+def _concat_spec(path, kept):
+    """ffconcat list that plays `path` through the kept (start, end or None) ranges only"""
+    quoted = os.path.abspath(path).replace("'", "'\\''")
+    lines = ['ffconcat version 1.0']
+    for start, end in kept:
+        lines.append(f"file '{quoted}'")
+        if start:
+            lines.append(f'inpoint {start:.6f}')
+        if end is not None:
+            lines.append(f'outpoint {end:.6f}')
+    return '\n'.join(lines) + '\n'
+
+
+def _language(code):
+    """Three-letter language code for a subtitle stream (as yt-dlp writes it)"""
+    if ytdlp_engine.is_available():
+        return ytdlp_engine.load_yt_dlp().utils.ISO639Utils.short2long(code) or code
+    return code
+
+
+class PostprocessPlan:
+    """Everything one finished download still needs, done in a single ffmpeg run
+
+    `info` is the yt-dlp info dict of the download (after it was moved into
+    place, so 'filepath' and the subtitle 'filepath's are final).
+    """
+
+    def __init__(self, info, remove_categories=(), embed_subs=True, add_metadata=True, faststart=False,
+                 fsync='resume'):
+        self.path = info.get('filepath')
+        self.fsync = fsync  # One of disk_space.FSYNC_POLICIES, for the rewritten file
+        self.ext = (info.get('ext') or os.path.splitext(self.path or '')[1][1:]).lower()
+        self.merged = bool(info.get('requested_formats'))
+        self.faststart = faststart and self.ext in MP4_EXTS
+
+        duration = info.get('duration')
+        cuts = [(max(0.0, s['start_time']), s['end_time']) for s in info.get('sponsorblock_chapters') or []
+                if s.get('category') in remove_categories and s.get('type', 'skip') == 'skip']
+        if duration:
+            cuts = [(start, min(end, duration)) for start, end in cuts if start < duration]
+        self.cuts = merge_ranges((start, end) for start, end in cuts if end > start)
+        if duration and sum(end - start for start, end in self.cuts) >= duration - TINY_CHAPTER:
+            self.cuts = []  # Nothing would be left; keep the video whole
+
+        # With --sponsorblock-mark the segments are in the chapters too; they vanish with the cuts
+        chapters = info.get('chapters') or []
+        self.chapters = cut_chapters(chapters, self.cuts) if self.cuts else list(chapters)
+        self.tags = metadata_tags(info) if add_metadata else {}
+
+        self.subtitles = []  # (language, path, name)
+        if embed_subs:
+            for lang, sub in (info.get('requested_subtitles') or {}).items():
+                path = sub.get('filepath')
+                if not path or not os.path.exists(path) or sub.get('ext') == 'json':
+                    continue
+                if self.ext == 'webm' and sub.get('ext') != 'vtt':
+                    continue  # WebM only takes WebVTT
+                self.subtitles.append((lang, path, sub.get('name')))
+
+    @property
+    def steps(self):
+        """What this plan does, in words"""
+        steps = []
+        if self.cuts:
+            steps.append(f"cut {len(self.cuts)} segment(s)")
+        if self.subtitles:
+            steps.append("subtitles")
+        if self.tags:
+            steps.append("metadata")
+        if self.chapters:
+            steps.append("chapters")
+        if self.faststart:
+            steps.append("faststart")
+        return steps
+
+    @property
+    def needed(self):
+        return (bool(self.path) and os.path.exists(self.path) and self.ext in PLANNABLE_EXTS
+                and bool(self.cuts or self.subtitles or self.tags or self.chapters or self.faststart))
+
+    @property
+    def stepwise_passes(self):
+        """Full-file writes yt-dlp's step-by-step chain needs for the same result"""
+        return (int(self.merged) + int(bool(self.cuts)) + int(bool(self.subtitles))
+                + int(bool(self.tags or self.chapters)) + int(self.faststart))
+
+    @property
+    def passes(self):
+        """Full-file writes with this plan (the merge, if yt-dlp did one, included)"""
+        return int(self.merged) + (1 + int(self.faststart) if self.needed else 0)
+
+    def stepwise_bytes(self, size):
+        return size * self.stepwise_passes
+
+    def command(self, ffmpeg, output, meta_path, inputs):
+        """The ffmpeg command; inputs[i] is a file path or ('concat', list path) for cut inputs"""
+        cmd = [ffmpeg, '-y', '-loglevel', 'error', '-nostdin']
+        sources = [self.path] + [path for _lang, path, _name in self.subtitles]
+        for source in inputs:
+            if isinstance(source, tuple):
+                cmd.extend(['-f', 'concat', '-safe', '0', '-i', source[1]])
+            else:
+                cmd.extend(['-i', source])
+        meta_index = len(sources)
+        if meta_path is not None:
+            cmd.extend(['-f', 'ffmetadata', '-i', meta_path])
+
+        cmd.extend(['-map', '0', '-dn', '-ignore_unknown'])
+        if self.subtitles:
+            cmd.extend(['-map', '-0:s'])  # Replaced by the downloaded ones
+        for i, (lang, _path, name) in enumerate(self.subtitles):
+            cmd.extend(['-map', f'{i + 1}:0', f'-metadata:s:s:{i}', f'language={_language(lang)}'])
+            if name:
+                cmd.extend([f'-metadata:s:s:{i}', f'title={name}'])
+        cmd.extend(['-c', 'copy'])
+        if self.ext in MP4_EXTS:
+            cmd.extend(['-c:s', 'mov_text'])
+        if meta_path is not None:
+            cmd.extend(['-map_metadata', str(meta_index), '-map_chapters', str(meta_index)])
+        if self.faststart:
+            cmd.extend(['-movflags', '+faststart'])
+        cmd.append(output)
+        return cmd
+
+    def _metadata_file(self):
+        lines = [';FFMETADATA1']
+        lines.extend(f'{tag}={_escape_meta(value)}' for tag, value in self.tags.items())
+        for chapter in self.chapters:
+            lines.extend(['[CHAPTER]', 'TIMEBASE=1/1000',
+                          f"START={int(chapter['start_time'] * 1000)}",
+                          f"END={int(chapter['end_time'] * 1000)}"])
+            if chapter.get('title'):
+                lines.append(f"title={_escape_meta(chapter['title'])}")
+        return '\n'.join(lines) + '\n'
+
+    def run(self, ffmpeg=None):
+        """Carry out the plan in place; returns the bytes written (0 if there was nothing to do)"""
+        if not self.needed:
+            return 0
+        ffmpeg = ffmpeg or shutil.which('ffmpeg')
+        if not ffmpeg:
+            raise PostprocessError("ffmpeg not found")
+        stem, ext = os.path.splitext(self.path)
+        output = f"{stem}.temp{ext}"
+        sources = [self.path] + [path for _lang, path, _name in self.subtitles]
+        temp_files = []
+        inputs = []
+        kept = []
+        if self.cuts:
+            start = 0.0
+            for cut_start, cut_end in self.cuts:
+                if cut_start > start:
+                    kept.append((start, cut_start))
+                start = cut_end
+            kept.append((start, None))
+        for i, source in enumerate(sources):
+            sub_ext = os.path.splitext(source)[1].lower()
+            if not self.cuts:
+                inputs.append(source)
+            elif i and sub_ext in ('.vtt', '.srt'):
+                cut_path = f"{stem}.{i}.cut{sub_ext}"
+                with open(source, encoding='utf-8', errors='replace') as f:
+                    text = cut_subtitles(f.read(), self.cuts, srt=sub_ext == '.srt')
+                with open(cut_path, 'w', encoding='utf-8') as f:
+                    f.write(text)
+                temp_files.append(cut_path)
+                inputs.append(cut_path)
+            else:
+                concat_path = f"{stem}.{i}.concat"
+                with open(concat_path, 'w', encoding='utf-8') as f:
+                    f.write(_concat_spec(source, kept))
+                temp_files.append(concat_path)
+                inputs.append(('concat', concat_path))
+        meta_path = None
+        if self.tags or self.chapters or self.cuts:
+            # Cutting drops the original chapters; always map ours (possibly none)
+            meta_path = f"{stem}.meta"
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                f.write(self._metadata_file())
+            temp_files.append(meta_path)
+        try:
+            result = subprocess.run(self.command(ffmpeg, output, meta_path, inputs), capture_output=True)
+            if result.returncode != 0:
+                if os.path.exists(output):
+                    os.remove(output)
+                raise PostprocessError(result.stderr.decode(errors='replace').strip()[-300:] or "ffmpeg failed")
+            written = os.path.getsize(output) * (2 if self.faststart else 1)
+            mtime = os.path.getmtime(self.path)
+            finish_file(output, self.path, self.fsync)
+            os.utime(self.path, (mtime, mtime))
+        finally:
+            for path in temp_files:
+                if os.path.exists(path):
+                    os.remove(path)
+        for _lang, path, _name in self.subtitles:
+            os.remove(path)  # Embedded now, like yt-dlp's --embed-subs does
+        return written
@@ -0,0 +1,244 @@
+"""
+PROBE CACHE - Reuse page metadata and format lists between downloads
+
+Resolving a page (title, format list, stream URLs) costs several network
+round trips. This cache keeps the raw extraction result of every URL on disk
+so retries, reruns after a cancel and duplicate URLs don't pay for it again.
+The format selection (MAX_QUALITY etc.) is applied afterwards by yt-dlp, so a
+cached entry works with any quality setting.
+
+- Entries expire after a TTL, or earlier when the stream URLs inside are
+  signed and the signature runs out (expire=, Expires=, X-Amz-Expires, ...).
+- The cache is capped in size; the least recently used entries go first.
+- probe_all() resolves a whole URL list up front, several sites in parallel.
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlsplit
+
+from download_archive import canonical_url
+from download_scheduler import DownloadJob, DownloadScheduler
+
+# Don't hand out a stream URL that has less than this left before it expires
+SIGNED_URL_MARGIN = 120  # seconds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    key TEXT PRIMARY KEY,
+    info BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    expires REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used);
+"""
+
+
+def default_cache_dir():
+    """Per-user cache folder for the downloader"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'universal-video-downloader')
+
+
+def _first(query, *names):
+    for name in names:
+        values = query.get(name)
+        if values and values[0]:
+            return values[0]
+    return None
+
+
+def signed_url_expiry(url):
+    """Return the unix time a signed URL stops working, or None if unsigned"""
+    if not url or '?' not in url:
+        return None
+    query = parse_qs(urlsplit(url).query)
+    try:
+        # Google / YouTube, Fastly, generic tokens
+        value = _first(query, 'expire', 'expires', 'Expires', 'exp', 'e')
+        if value and value.isdigit() and len(value) >= 9:
+            expiry = float(value)
+            return expiry / 1000 if expiry > 1e11 else expiry  # Some CDNs use milliseconds
+        # AWS S3 presigned URLs: signing time + lifetime
+        amz_date = _first(query, 'X-Amz-Date')
+        amz_expires = _first(query, 'X-Amz-Expires')
+        if amz_date and amz_expires:
+            signed = datetime.strptime(amz_date, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed.timestamp() + float(amz_expires)
+        # Akamai: hdnts=st=...~exp=...~hmac=...
+        token = _first(query, 'hdnts', '__token__', 'hdnea')
+        if token:
+            for field in token.split('~'):
+                if field.startswith('exp='):
+                    return float(field[4:])
+        # CloudFront custom policy (base64 JSON with DateLessThan)
+        policy = _first(query, 'Policy')
+        if policy:
+            policy = policy.replace('-', '+').replace('_', '=').replace('~', '/')
+            statement = json.loads(base64.b64decode(policy))['Statement'][0]
+            return float(statement['Condition']['DateLessThan']['AWS:EpochTime'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    return None
+
+
+def info_expiry(info):
+    """Earliest expiry of any signed stream URL in an info dict (None if none)"""
+    urls = [info.get('url'), info.get('manifest_url')]
+    for fmt in info.get('formats') or []:
+        urls.extend((fmt.get('url'), fmt.get('manifest_url'), fmt.get('fragment_base_url')))
+    expiries = [e for e in map(signed_url_expiry, urls) if e is not None]
+    return min(expiries) if expiries else None
+
+
+class ProbeCache:
+    """Disk-backed TTL + LRU cache of raw yt-dlp extraction results"""
+
+    def __init__(self, path=None, ttl=6 * 3600, max_bytes=256 * 1024 * 1024):
+        self.path = str(path or os.path.join(default_cache_dir(), 'probe_cache.db'))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM probes').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get(self, url):
+        """Return the cached info dict for a URL, or None if missing/expired"""
+        key = canonical_url(url)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                'SELECT info, size, expires FROM probes WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            blob, size, expires = row
+            if expires <= now:
+                self._db.execute('DELETE FROM probes WHERE key = ?', (key,))
+                self._db.commit()
+                self._total -= size
+                self.misses += 1
+                return None
+            self._db.execute('UPDATE probes SET last_used = ? WHERE key = ?', (now, key))
+            self._db.commit()
+            self.hits += 1
+        return json.loads(zlib.decompress(blob))
+
+    def put(self, url, info):
+        """Store an extraction result; returns False if it isn't cacheable"""
+        if not info or info.get('_type', 'video') != 'video':
+            return False  # Playlists and redirects are resolved lazily, don't cache them
+        now = time.time()
+        expires = now + self.ttl
+        signed = info_expiry(info)
+        if signed is not None:
+            expires = min(expires, signed - SIGNED_URL_MARGIN)
+        if expires <= now:
+            return False
+        blob = zlib.compress(json.dumps(info).encode('utf-8'))
+        keys = {canonical_url(u) for u in (url, info.get('original_url'), info.get('webpage_url')) if u}
+        with self._lock, self._db:
+            for key in keys:
+                old = self._db.execute('SELECT size FROM probes WHERE key = ?', (key,)).fetchone()
+                if old:
+                    self._total -= old[0]
+                self._db.execute(
+                    'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)',
+                    (key, blob, len(blob), now, expires, now))
+                self._total += len(blob)
+            self._evict()
+        return True
+
+    def invalidate(self, url):
+        """Forget a URL (e.g. after its stream URLs were rejected)"""
+        key = canonical_url(url)
+        with self._lock, self._db:
+            row = self._db.execute('SELECT size FROM probes WHERE key = ?', (key,)).fetchone()
+            if row:
+                self._db.execute('DELETE FROM probes WHERE key = ?', (key,))
+                self._total -= row[0]
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        if self._total <= self.max_bytes:
+            return
+        self._db.execute('DELETE FROM probes WHERE expires <= ?', (time.time(),))
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM probes').fetchone()[0]
+        while self._total > self.max_bytes:
+            rows = self._db.execute(
+                'SELECT key, size FROM probes ORDER BY last_used LIMIT 64').fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute('DELETE FROM probes WHERE key = ?', (key,))
+                self._total -= size
+                if self._total <= self.max_bytes:
+                    break
+
+
+def probe_all(urls, session_pool, cache, max_workers=4, max_per_host=2, on_result=None):
+    """Resolve every URL up front, filling the cache; returns {url: info or None}
+
+    URLs that are already cached are not fetched again. on_result(url, info)
+    is called as each URL finishes.
+    """
+    results = {}
+    todo = []
+    for url in urls:
+        info = cache.get(url)
+        if info is not None:
+            results[url] = info
+            if on_result:
+                on_result(url, info)
+        else:
+            todo.append(url)
+
+    def probe(job):
+        info = session_pool.probe(job.url)
+        if info is not None:
+            cache.put(job.url, info)
+        results[job.url] = info
+        if on_result:
+            on_result(job.url, info)
+        return info is not None
+
+    jobs = [DownloadJob(idx, url) for idx, url in enumerate(todo, 1)]
+    DownloadScheduler(max_workers, max_per_host).run(jobs, probe)
+    return results
+
+
+def info_file_command(cmd, url, info):
+    """Rewrite a yt-dlp command to load cached info instead of fetching the URL
+
+    Returns (new_cmd, temp_path); delete temp_path once the command has run.
+    """
+    fd, path = tempfile.mkstemp(prefix='yt-dlp-info-', suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    cmd = list(cmd)
+    i = cmd.index(url)
+    cmd[i:i + 1] = ['--load-info-json', path]
+    return cmd, path
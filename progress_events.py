@@ -0,0 +1,254 @@
+"""
+PROGRESS EVENTS - One machine-readable progress stream for every engine
+
+Every engine reports progress as ProgressEvent objects, whatever it runs on:
+
+- yt-dlp subprocesses print one tab-separated line per update
+  (PROGRESS_TEMPLATE + --newline); parse_line() turns it into an event
+- in-process yt-dlp calls progress/postprocessor hooks; from_hook() converts
+- the native HLS/DASH/range engines call on_progress with the same dict
+  shape as yt-dlp hooks, so from_hook() covers them too
+
+ProgressTracker folds the events of a whole batch into one determinate
+number (0..1) that the CLI status line and the GUI progress bar both show.
+Parsing is a prefix check and one split, cheap enough for thousands of
+events per second.
+"""
+
+import threading
+import time
+
+PREFIX = '@@progress\t'
+
+# `--progress-template` values; yt-dlp prints NA for unknown fields
+PROGRESS_TEMPLATE = 'download:' + PREFIX + '\t'.join([
+    'download', '%(progress.status)s', '%(progress.downloaded_bytes)s',
+    '%(progress.total_bytes)s', '%(progress.total_bytes_estimate)s',
+    '%(progress.speed)s', '%(progress.eta)s',
+    '%(progress.fragment_index)s', '%(progress.fragment_count)s',
+    '%(progress.filename)s',
+])
+POSTPROCESS_TEMPLATE = 'postprocess:' + PREFIX + '\t'.join([
+    'postprocess', '%(progress.status)s', '%(progress.postprocessor)s',
+])
+
+
+def progress_args():
+    """yt-dlp options that make it print PROGRESS_TEMPLATE lines"""
+    return ['--newline', '--progress-template', PROGRESS_TEMPLATE,
+            '--progress-template', POSTPROCESS_TEMPLATE]
+
+
+def _number(value, kind=int):
+    if value is None or value in ('NA', 'None', ''):
+        return None
+    try:
+        return kind(value)
+    except ValueError:
+        try:
+            return kind(float(value))
+        except ValueError:
+            return None
+
+
+class ProgressEvent:
+    """One progress update: phase ('download'/'postprocess'), bytes, speed, ETA, fragments"""
+
+    __slots__ = ('phase', 'status', 'downloaded', 'total', 'speed', 'eta',
+                 'fragment_index', 'fragment_count', 'filename', 'postprocessor')
+
+    def __init__(self, phase, status, downloaded=None, total=None, speed=None, eta=None,
+                 fragment_index=None, fragment_count=None, filename=None, postprocessor=None):
+        self.phase = phase
+        self.status = status
+        self.downloaded = downloaded
+        self.total = total
+        self.speed = speed
+        self.eta = eta
+        self.fragment_index = fragment_index
+        self.fragment_count = fragment_count
+        self.filename = filename
+        self.postprocessor = postprocessor
+
+    @property
+    def fraction(self):
+        """How much of this file is done (0..1), or None if unknown"""
+        if self.status == 'finished':
+            return 1.0
+        if self.total and self.downloaded is not None:
+            return min(1.0, self.downloaded / self.total)
+        if self.fragment_count and self.fragment_index is not None:
+            return min(1.0, self.fragment_index / self.fragment_count)
+        return None
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"ProgressEvent({self.as_dict()!r})"
+
+    @classmethod
+    def from_hook(cls, status):
+        """Convert a yt-dlp progress/postprocessor hook dict (or a native engine one)"""
+        if 'postprocessor' in status:
+            return cls('postprocess', status.get('status'), postprocessor=status.get('postprocessor'))
+        return cls(
+            'download', status.get('status'),
+            downloaded=status.get('downloaded_bytes'),
+            total=status.get('total_bytes') or status.get('total_bytes_estimate'),
+            speed=status.get('speed'),
+            eta=status.get('eta'),
+            fragment_index=status.get('fragment_index'),
+            fragment_count=status.get('fragment_count'),
+            filename=status.get('filename'),
+        )
+
+
+class EventHooks:
+    """yt-dlp session monitor that forwards every hook call as a ProgressEvent"""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def progress_hook(self, status):
+        self.callback(ProgressEvent.from_hook(status))
+
+    postprocessor_hook = progress_hook
+
+
+def parse_line(line):
+    """Return the ProgressEvent a yt-dlp output line carries, or None for other lines"""
+    if not line.startswith(PREFIX):
+        return None
+    fields = line.rstrip('\r\n').split('\t', 10)
+    if fields[1] == 'postprocess':
+        if len(fields) < 4:
+            return None
+        return ProgressEvent('postprocess', fields[2], postprocessor=fields[3])
+    if len(fields) < 11:
+        return None
+    return ProgressEvent(
+        'download', fields[2],
+        downloaded=_number(fields[3]),
+        total=_number(fields[4]) or _number(fields[5]),
+        speed=_number(fields[6], float),
+        eta=_number(fields[7]),
+        fragment_index=_number(fields[8]),
+        fragment_count=_number(fields[9]),
+        filename=fields[10] if fields[10] != 'NA' else None,
+    )
+
+
+class ProgressTracker:
+    """Aggregate progress of a batch of jobs; safe to feed from many threads
+
+    Each job counts equally. Within a job the files it downloads (e.g.
+    separate video and audio) are weighted by size when their sizes are
+    known, and the job is 100% once it has finished.
+    `listener(tracker)` is called at most every `interval` seconds.
+    """
+
+    def __init__(self, total_jobs, listener=None, interval=0.25):
+        self.total_jobs = total_jobs
+        self.listener = listener
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._files = {}  # job -> {filename: (done fraction, bytes, total bytes, speed)}
+        self._first = {}  # (job, filename) -> (time, bytes) of the first sample, for speed estimates
+        self._phase = {}  # job -> current phase
+        self._finished = 0
+        self._last_notify = 0.0
+
+    def add_jobs(self, count=1):
+        """More jobs joined the batch (found in a playlist, or read from a streamed list)"""
+        with self._lock:
+            self.total_jobs += count
+
+    def start(self, job):
+        with self._lock:
+            self._files[job] = {}
+            self._phase[job] = 'extract'
+        self._notify()
+
+    def update(self, job, event):
+        with self._lock:
+            files = self._files.get(job)
+            if files is None:
+                return
+            self._phase[job] = event.phase
+            if event.phase == 'download':
+                fraction = event.fraction
+                downloaded = event.downloaded or 0
+                speed = event.speed
+                if speed is None:
+                    # The native engines don't report speed, average it here
+                    now = time.time()
+                    first = self._first.setdefault((job, event.filename), (now, downloaded))
+                    speed = (downloaded - first[1]) / (now - first[0]) if now > first[0] else 0
+                files[event.filename] = (
+                    fraction if fraction is not None else 0.0,
+                    downloaded,
+                    event.total,
+                    speed if event.status == 'downloading' else 0,
+                )
+        self._notify()
+
+    def finish(self, job):
+        with self._lock:
+            files = self._files.pop(job, None)
+            if files is not None:
+                self._phase.pop(job, None)
+                for filename in files:
+                    self._first.pop((job, filename), None)
+                self._finished += 1
+        self._notify(force=True)
+
+    def retry(self, job):
+        """A finished job is going to run again"""
+        with self._lock:
+            self._finished -= 1
+        self._notify(force=True)
+
+    def _notify(self, force=False):
+        if self.listener is None:
+            return
+        now = time.time()
+        if not force and now - self._last_notify < self.interval:
+            return
+        self._last_notify = now
+        self.listener(self)
+
+    def snapshot(self):
+        """{'fraction', 'finished', 'active', 'bytes', 'speed', 'phases'} for the whole batch"""
+        with self._lock:
+            done = float(self._finished)
+            active_bytes = 0
+            speed = 0.0
+            for files in self._files.values():
+                if not files:
+                    continue
+                values = files.values()
+                if all(f[2] for f in values):
+                    done += min(1.0, sum(f[1] for f in values) / sum(f[2] for f in values))
+                else:
+                    done += sum(f[0] for f in values) / len(files)
+                active_bytes += sum(f[1] for f in values)
+                speed += sum(f[3] or 0 for f in values)
+            return {
+                'fraction': min(1.0, done / max(1, self.total_jobs)),
+                'finished': self._finished,
+                'active': len(self._files),
+                'bytes': active_bytes,
+                'speed': speed,
+                'phases': dict(self._phase),
+            }
+
+
+def format_status(snapshot, total_jobs):
+    """One-line summary of a tracker snapshot"""
+    line = f"{snapshot['fraction'] * 100:5.1f}% | {snapshot['finished']}/{total_jobs} done"
+    if snapshot['active']:
+        line += f" | {snapshot['active']} active"
+    if snapshot['speed']:
+        line += f" | {snapshot['speed'] / 1024 / 1024:.1f} MB/s"
+    return line
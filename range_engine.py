@@ -0,0 +1,332 @@
+"""
+RANGE ENGINE - Multi-connection downloader for direct video files
+
+Many CDNs throttle every connection on its own, so a plain .mp4/.webm/.mkv
+link downloaded over one stream leaves most of the line idle. This engine:
+
+1. Checks with a one-byte Range request whether the server supports ranges
+2. Preallocates the whole file and splits it into fixed-size chunks
+3. Fetches several chunks at once over pooled keep-alive connections and
+   writes every piece straight to its offset (pwrite), so nothing is
+   buffered in memory and no reassembly step is needed at the end
+4. Keeps a small resume map next to the .part file listing the finished
+   chunks, so an interrupted download continues where it stopped
+
+With hash_content the file's content hash is worked out on the way
+(stats['digest']), for the content store. Given a `precheck` ContentStore,
+a file of a size the store already holds is first compared by its first and
+last MiB; on a match the store links the existing file into place and
+nothing else is downloaded (stats['duplicate_of']).
+
+admit(size) is called once the size is known and before the space is
+allocated - it may wait for disk space, or raise to stop the download.
+`fsync` is one of disk_space.FSYNC_POLICIES.
+
+Servers without Accept-Ranges (or without a known size) are downloaded over
+a single connection instead. Web pages raise RangeError so the caller can
+hand the URL to yt-dlp.
+"""
+
+import asyncio
+import json
+import os
+import re
+import time
+from urllib.parse import unquote, urlsplit
+
+from adaptive_concurrency import THROTTLE_STATUSES
+from content_store import ContentHasher, fingerprint_of, fingerprint_ranges
+from disk_space import preallocate, sync_directory
+from http_pool import ConnectionPool, HttpError
+
+CHUNK_RETRIES = 3
+RESUME_SAVE_INTERVAL = 1.0  # seconds between resume map updates
+MIN_CHUNK_SIZE = 256 * 1024
+
+
+class RangeError(Exception):
+    """The URL can't be handled by the range engine"""
+
+
+def _pwrite(fd, data, offset):
+    """Write data at an absolute offset without moving a shared file position"""
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            # Windows has no pwrite; every write happens on the event loop
+            # thread, so seek + write can't interleave with another writer
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
+def extension_for_url(url, default='.mp4'):
+    """File extension of the last URL path component (.mp4 when there is none)"""
+    name = unquote(urlsplit(url).path.rsplit('/', 1)[-1])
+    extension = os.path.splitext(name)[1].lower()
+    return extension if re.fullmatch(r'\.[a-z0-9]{2,5}', extension) else default
+
+
+class RangeDownloader:
+    """Downloads one file over several connections with HTTP Range requests"""
+
+    def __init__(self, url, output_path, connections=4, chunk_size=8 * 1024 * 1024,
+                 headers=None, verify=True, on_progress=None, controller=None, bandwidth=None,
+                 hash_content=False, precheck=None, admit=None, fsync='resume'):
+        self.url = url
+        self.output_path = os.path.splitext(str(output_path))[0] + extension_for_url(url)
+        self.part_path = self.output_path + '.part'
+        self.map_path = self.part_path + '.json'
+        self.connections = max(1, connections)
+        # With a ConcurrencyController, up to controller.maximum workers exist
+        # but only controller.value of them fetch chunks at any moment
+        self.controller = controller
+        self.workers = controller.maximum if controller is not None else self.connections
+        self.chunk_size = max(MIN_CHUNK_SIZE, chunk_size)
+        self.headers = headers or {}
+        self.verify = verify
+        self.on_progress = on_progress
+        self.bandwidth = bandwidth  # BandwidthShare, optional
+        self.hasher = ContentHasher() if hash_content else None
+        self.precheck = precheck  # ContentStore, optional
+        self.admit = admit
+        self.fsync = fsync
+        self.stats = {
+            'size': None, 'ranged': False, 'chunks': 0, 'chunks_done': 0, 'bytes': 0,
+            'resumed_bytes': 0, 'retries': 0, 'connections': 0, 'requests': 0, 'elapsed': 0.0,
+            'digest': None, 'duplicate_of': None,
+        }
+
+    def download(self):
+        """Blocking entry point; returns the path of the finished file"""
+        return asyncio.run(self.run())
+
+    async def run(self):
+        started = time.time()
+        pool = ConnectionPool(max_per_host=self.workers, headers=self.headers, verify=self.verify,
+                              bandwidth=self.bandwidth)
+        try:
+            response = await pool.open('GET', self.url, {'Range': 'bytes=0-0'})
+            content_type = response.headers.get('content-type', '').lower()
+            if content_type.startswith(('text/html', 'application/xhtml')):
+                response.release()
+                raise RangeError("The URL points to a web page, not a video file")
+            size, validator = self._range_support(response)
+            if size is None:
+                if response.status != 200:
+                    # 206 without a total size: the probe carries one byte, not the file
+                    response.release()
+                    response = await pool.open('GET', self.url)
+                    if response.status != 200:
+                        response.release()
+                        raise RangeError(f"Unexpected HTTP {response.status} for a plain GET")
+                # No ranges: this response carries the whole file
+                await self._download_single(response)
+            else:
+                await response.read()
+                existing = await self._find_duplicate(pool, size, response.url)
+                if existing is not None:
+                    self.precheck.link(existing, self.output_path)
+                    self.stats['size'] = size
+                    self.stats['duplicate_of'] = existing
+                    for path in (self.part_path, self.map_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    self.stats['elapsed'] = time.time() - started
+                    return self.output_path
+                await self._download_ranges(pool, size, validator, response.url)
+        finally:
+            self.stats['connections'] = pool.connections_opened
+            self.stats['requests'] = pool.requests_sent
+            await pool.close()
+            if self.hasher is not None:
+                self.hasher.close()
+        if self.hasher is not None and self.stats['size'] in (None, self.hasher.position):
+            self.stats['digest'] = self.hasher.hexdigest()
+        os.replace(self.part_path, self.output_path)
+        if self.fsync == 'full':
+            sync_directory(os.path.dirname(os.path.abspath(self.output_path)))
+        self.stats['elapsed'] = time.time() - started
+        return self.output_path
+
+    @staticmethod
+    def _range_support(response):
+        """Return (size, validator) if the server honoured the Range request, else (None, None)"""
+        if response.status != 206:
+            return None, None
+        match = re.match(r'bytes\s+0-0/(\d+)', response.headers.get('content-range', ''))
+        if not match:
+            return None, None  # Total size unknown ("*")
+        validator = response.headers.get('etag') or response.headers.get('last-modified')
+        return int(match.group(1)), validator
+
+    async def _find_duplicate(self, pool, size, url):
+        """A file the precheck store holds with the same size, start and end as this one, or None"""
+        if self.precheck is None or not self.precheck.has_size(size):
+            return None
+        parts = []
+        for start, end in fingerprint_ranges(size):
+            response = await pool.open('GET', url, {'Range': f'bytes={start}-{end}'})
+            if response.status != 206 or not response.headers.get(
+                    'content-range', '').startswith(f'bytes {start}-'):
+                response.release()
+                return None
+            parts.append(await response.read())
+        return self.precheck.match_fingerprint(size, fingerprint_of(size, parts))
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress({
+                'status': 'downloading',
+                'downloaded_bytes': self.stats['resumed_bytes'] + self.stats['bytes'],
+                'total_bytes': self.stats['size'],
+            })
+
+    async def _download_single(self, response):
+        """Stream the body over one connection (server without Range support)"""
+        self.stats['size'] = response.content_length
+        if self.admit is not None:
+            self.admit(response.content_length)
+        with open(self.part_path, 'wb') as f:
+            if response.content_length:
+                preallocate(f.fileno(), response.content_length)
+            async for data in response.iter_chunks():
+                f.write(data)
+                if self.hasher is not None:
+                    self.hasher.update(data)
+                self.stats['bytes'] += len(data)
+                self._report()
+            if self.fsync != 'none':
+                f.flush()
+                os.fsync(f.fileno())
+        if self.stats['size'] is not None and self.stats['bytes'] != self.stats['size']:
+            raise ConnectionError("Download ended early")
+
+    def _load_resume_map(self, size, validator, chunk_size):
+        """Finished chunk indexes from an earlier attempt at the same file"""
+        try:
+            with open(self.map_path, encoding='utf-8') as f:
+                saved = json.load(f)
+            if (saved['size'] != size or saved['chunk_size'] != chunk_size
+                    or saved['validator'] != validator
+                    or os.path.getsize(self.part_path) != size):
+                return set()
+            return set(saved['done'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return set()
+
+    def _save_resume_map(self, fd, size, validator, chunk_size, done):
+        # The chunk data has to be on disk before the map says it is
+        if self.fsync != 'none':
+            os.fsync(fd)
+        tmp_path = self.map_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'url': self.url, 'size': size, 'validator': validator,
+                       'chunk_size': chunk_size, 'done': sorted(done)}, f)
+        os.replace(tmp_path, self.map_path)
+
+    async def _download_ranges(self, pool, size, validator, url):
+        """Fetch the missing chunks in parallel straight into the preallocated file"""
+        self.stats['size'] = size
+        self.stats['ranged'] = True
+        # Small files still get one chunk per connection
+        chunk_size = max(MIN_CHUNK_SIZE, min(self.chunk_size, -(-size // self.connections)))
+        chunk_count = max(1, -(-size // chunk_size))
+        self.stats['chunks'] = chunk_count
+        done = self._load_resume_map(size, validator, chunk_size)
+        if done:
+            self.stats['resumed_bytes'] = sum(
+                min(chunk_size, size - index * chunk_size) for index in done)
+            self.stats['chunks_done'] = len(done)
+
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if not done:
+            flags |= os.O_TRUNC  # Leftovers from a different file must not survive
+        if self.admit is not None:
+            self.admit(size - self.stats['resumed_bytes'])
+        fd = os.open(self.part_path, flags, 0o644)
+        try:
+            if not done:
+                preallocate(fd, size)
+            todo = asyncio.Queue()
+            for index in range(chunk_count):
+                if index not in done:
+                    todo.put_nowait(index)
+            last_save = time.time()
+            hashed = 0  # Chunks from the start of the file that are all done
+
+            def follow_hash():
+                nonlocal hashed
+                while hashed in done:
+                    hashed += 1
+                self.hasher.follow(self.part_path, min(size, hashed * chunk_size))
+
+            async def worker(number):
+                nonlocal last_save
+                while not todo.empty():
+                    if self.controller is not None and number >= self.controller.value:
+                        await asyncio.sleep(0.1)
+                        continue
+                    index = todo.get_nowait()
+                    start = index * chunk_size
+                    end = min(start + chunk_size, size) - 1
+                    await self._fetch_chunk(pool, url, fd, start, end)
+                    done.add(index)
+                    self.stats['chunks_done'] += 1
+                    if self.hasher is not None and index == hashed:
+                        follow_hash()
+                    if time.time() - last_save >= RESUME_SAVE_INTERVAL:
+                        self._save_resume_map(fd, size, validator, chunk_size, done)
+                        last_save = time.time()
+
+            if self.hasher is not None:
+                follow_hash()  # Chunks finished by an earlier attempt
+            workers = [asyncio.ensure_future(worker(number)) for number in range(self.workers)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                if len(done) < chunk_count:
+                    self._save_resume_map(fd, size, validator, chunk_size, done)
+            if self.fsync != 'none':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if os.path.exists(self.map_path):
+            os.remove(self.map_path)
+
+    async def _fetch_chunk(self, pool, url, fd, start, end):
+        """Download bytes start..end into the file, resuming mid-chunk on retries"""
+        offset = start
+        for attempt in range(CHUNK_RETRIES + 1):
+            started, received = time.time(), offset
+            try:
+                response = await pool.open('GET', url, {'Range': f'bytes={offset}-{end}'})
+                if response.status != 206 or not response.headers.get(
+                        'content-range', '').startswith(f'bytes {offset}-'):
+                    response.release()
+                    raise RangeError("Server stopped honouring Range requests")
+                async for data in response.iter_chunks():
+                    data = data[:end + 1 - offset]
+                    _pwrite(fd, data, offset)
+                    offset += len(data)
+                    self.stats['bytes'] += len(data)
+                    self._report()
+                if offset <= end:
+                    raise ConnectionError("Connection closed mid-chunk")
+                if self.controller is not None:
+                    self.controller.record(offset - received, time.time() - started)
+                return
+            except (HttpError, ConnectionError, OSError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError) as e:
+                if self.controller is not None:
+                    self.controller.record_error(isinstance(e, HttpError) and e.status in THROTTLE_STATUSES)
+                if attempt == CHUNK_RETRIES or (isinstance(e, HttpError) and e.status in (401, 403, 404, 416)):
+                    raise
+                self.stats['retries'] += 1
+                await asyncio.sleep(0.5 * 2 ** attempt)
@@ -0,0 +1,216 @@
+"""
+RETRY POLICY - Try failed downloads again, and leave struggling sites alone
+
+yt-dlp retries a failed request a few times on its own, but a job that
+fails anyway used to stay failed, and when a site starts answering with
+429/5xx every queued job for it kept hitting it. A RetryPolicy decides for
+the scheduler what happens after a failure:
+
+- failures that can pass (throttling, server errors, network trouble,
+  unknown errors) are queued again behind the rest of the batch, after an
+  exponential backoff with jitter - or after the server's Retry-After, if
+  it sent one. Missing videos, login walls and unsupported URLs aren't.
+- every site has a circuit breaker: after `failure_threshold` throttling/
+  server/network failures in a row its jobs are paused for a cooldown
+  while other sites keep going. Then a single job tries the site again;
+  if it fails too, the next pause is twice as long. A site that trips its
+  breaker `give_up_after` times is given up on: its jobs still waiting
+  fail without running.
+"""
+
+import email.utils
+import random
+import re
+import threading
+import time
+
+from job_metrics import exit_cause
+
+PERMANENT_CAUSES = ('forbidden', 'not_found', 'unsupported')  # Trying again won't help
+HOST_CAUSES = ('throttled', 'server', 'network')  # The site's fault: counts towards its breaker
+
+_STATUS_RE = re.compile(r'HTTP (?:Error )?(\d{3})')
+
+
+def parse_retry_after(value, now=None):
+    """Seconds a Retry-After header value asks to wait (None if it can't be read)"""
+    value = str(value or '').strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if moment is None:
+        return None
+    return max(0.0, moment.timestamp() - (time.time() if now is None else now))
+
+
+def _header(headers, name):
+    if headers is None:
+        return None
+    get = getattr(headers, 'get', None)
+    if get is None:
+        return None
+    return get(name) or get(name.lower())
+
+
+def retry_after_of(error):
+    """The Retry-After an exception carries, in seconds (None if none)
+
+    Follows yt-dlp's wrapping (DownloadError.exc_info, ExtractorError.cause)
+    and causes down to the HTTP error; works with http_pool.HttpError too.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, 'response', None)
+        value = _header(getattr(error, 'headers', None), 'Retry-After') or _header(
+            getattr(response, 'headers', None), 'Retry-After')
+        if value is not None:
+            return parse_retry_after(value)
+        exc_info = getattr(error, 'exc_info', None)
+        if exc_info and exc_info[1] is not error:
+            error = exc_info[1]
+        else:
+            cause = getattr(error, 'cause', None)
+            error = cause if isinstance(cause, BaseException) else error.__cause__ or error.__context__
+    return None
+
+
+def failure_cause(error):
+    """Why a job failed, from its last error line (job_metrics.exit_cause, plus 'server' for 5xx)"""
+    cause = exit_cause(error)
+    if cause == 'error' and error:
+        match = _STATUS_RE.search(error)
+        if match and match.group(1).startswith('5'):
+            return 'server'
+    return cause
+
+
+class HostBreaker:
+    """Circuit breaker of one site"""
+
+    def __init__(self):
+        self.failures = 0  # Site failures in a row
+        self.open_until = 0.0  # No jobs for the site before this time
+        self.cooldown = 0.0  # Length of the last pause
+        self.probing = False  # Paused before: one job tries the site first
+        self.trips = 0
+
+
+class RetryPolicy:
+    """Retry and circuit breaker decisions for one batch; thread-safe
+
+    Jobs get `attempts` more tries. Backoff starts at `base_delay`
+    seconds and doubles per attempt up to `max_delay`; a breaker pauses
+    its site for `cooldown` seconds, doubling up to `max_cooldown`.
+    log(*lines) hears about pauses.
+    """
+
+    def __init__(self, attempts=2, base_delay=5.0, max_delay=300.0, failure_threshold=3,
+                 cooldown=30.0, max_cooldown=600.0, give_up_after=3, log=None):
+        self.attempts = max(0, int(attempts))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.give_up_after = max(1, int(give_up_after))
+        self.log = log
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> HostBreaker
+        self.retried = 0  # Retries scheduled
+        self.recovered = 0  # ...that succeeded
+
+    def backoff(self, attempt):
+        """Seconds before the attempt-th retry: exponential, half of it random"""
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def host_wait(self, host):
+        """Seconds until the site's jobs may run again (0 = now)"""
+        breaker = self._hosts.get(host)
+        if breaker is None:
+            return 0.0
+        return max(0.0, breaker.open_until - time.time())
+
+    def gave_up(self, host):
+        """Whether the site failed too often to try it any more in this batch"""
+        breaker = self._hosts.get(host)
+        return breaker is not None and breaker.trips >= self.give_up_after
+
+    def host_limit(self, host, limit):
+        """How many of the site's jobs may run at once: one while it's being tried again"""
+        breaker = self._hosts.get(host)
+        return 1 if breaker is not None and breaker.probing else limit
+
+    def succeeded(self, job):
+        with self._lock:
+            if job.attempts:
+                self.recovered += 1
+            breaker = self._hosts.get(job.host)
+            if breaker is None:
+                return
+            if breaker.probing and self.log is not None:
+                self.log(f"✅ {job.host} is answering again - resuming its downloads")
+            breaker.failures = 0
+            breaker.probing = False
+            breaker.cooldown = 0.0
+
+    def failed(self, job):
+        """A job failed: seconds to wait before it runs again, or None if it shouldn't"""
+        if job.stats.get('cancelled'):
+            return None
+        error = job.error or job.stats.get('error')
+        cause = failure_cause(error)
+        retry_after = job.stats.get('retry_after')
+        with self._lock:
+            wait = 0.0
+            if cause in HOST_CAUSES:
+                wait = self._host_failed(job.host, cause, retry_after)
+            if cause in PERMANENT_CAUSES or job.attempts >= self.attempts or self.gave_up(job.host):
+                return None
+            job.attempts += 1
+            self.retried += 1
+            return max(wait, self.backoff(job.attempts), retry_after or 0.0)
+
+    def _host_failed(self, host, cause, retry_after):
+        """Count a site failure; returns how long the site is paused now"""
+        breaker = self._hosts.setdefault(host, HostBreaker())
+        now = time.time()
+        if breaker.probing and breaker.open_until > now:
+            # Paused already: jobs that were still running when it tripped don't trip it again
+            breaker.open_until = max(breaker.open_until, now + (retry_after or 0.0))
+            return breaker.open_until - now
+        breaker.failures += 1
+        if retry_after:
+            # The server said when to come back: hold every job for the site until then
+            breaker.open_until = max(breaker.open_until, now + retry_after)
+        if breaker.probing or breaker.failures >= self.failure_threshold:
+            cooldown = min(self.max_cooldown, breaker.cooldown * 2 if breaker.cooldown else self.cooldown)
+            cooldown = max(cooldown, retry_after or 0.0)
+            breaker.cooldown = cooldown
+            breaker.open_until = max(breaker.open_until, now + cooldown)
+            breaker.failures = 0
+            breaker.probing = True
+            breaker.trips += 1
+            if self.gave_up(host):
+                message = f"⛔ {host}: still failing ({cause}) - giving up on its downloads for this batch"
+            else:
+                message = (f"⛔ {host}: repeated failures ({cause}) - pausing its downloads for "
+                           f"{cooldown:.0f}s, other sites keep going")
+            if self.log is not None:
+                self.log(message)
+        return max(0.0, breaker.open_until - now)
+
+    def describe(self):
+        """Summary lines (empty if nothing was retried or paused)"""
+        lines = []
+        if self.retried:
+            lines.append(f"🔁 Retried: {self.retried} time(s), {self.recovered} of them succeeded")
+        trips = {host: breaker.trips for host, breaker in self._hosts.items() if breaker.trips}
+        if trips:
+            lines.append("⛔ Sites paused after repeated failures: " +
+                         ", ".join(f"{host} ({count}x)" for host, count in sorted(trips.items())))
+        return lines
@@ -0,0 +1,159 @@
+"""
+HLS engine against a local http.server fixture: variant selection, AES-128,
+EXT-X-BYTERANGE and EXT-X-MAP
+"""
+
+import os
+import re
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_engine  # noqa: E402
+
+try:
+    from Cryptodome.Cipher import AES
+except ImportError:
+    try:
+        from Crypto.Cipher import AES
+    except ImportError:
+        AES = None
+
+
+def _encrypt(data, key, iv):
+    """AES-128-CBC with PKCS#7 padding (None if no AES implementation is installed)"""
+    pad = 16 - len(data) % 16
+    data += bytes([pad]) * pad
+    if AES is not None:
+        return AES.new(key, AES.MODE_CBC, iv).encrypt(data)
+    try:
+        from yt_dlp.aes import aes_cbc_encrypt
+    except ImportError:
+        return None
+    return bytes(aes_cbc_encrypt(list(data), list(key), list(iv), padding_mode='whitespace'))
+
+
+KEY = bytes(range(16))
+IV = bytes(range(16, 32))
+INIT = b'INIT' * 64
+PLAIN = [bytes([n]) * (1000 + 37 * n) for n in range(1, 5)]
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """Serves self.server.files (path -> bytes), with Range support and scripted failures"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            failures = server.failures.get(self.path, 0)
+            if failures:
+                server.failures[self.path] = failures - 1
+        if failures:
+            return self._send(503, b'')
+        body = server.files.get(self.path)
+        if body is None:
+            return self._send(404, b'')
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range') or '')
+        if match:
+            start, end = int(match.group(1)), int(match.group(2))
+            return self._send(206, body[start:end + 1],
+                              {'Content-Range': f"bytes {start}-{end}/{len(body)}"})
+        self._send(200, body)
+
+    def _send(self, code, body, headers=None):
+        self.send_response(code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HlsEngineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.server.daemon_threads = True
+        cls.server.lock = threading.Lock()
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.files = {}
+        self.server.failures = {}
+        self.server.requests = []
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Keep the raw stream: remuxing isn't what's tested here
+        patcher = mock.patch.object(hls_engine.shutil, 'which', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def download(self, path, max_height=1080):
+        output = os.path.join(self.tmp.name, 'out.mp4')
+        downloader = hls_engine.HlsDownloader(self.base + path, output, max_height=max_height,
+                                              concurrency=3, buffer_segments=3)
+        result = downloader.download()
+        with open(result, 'rb') as f:
+            return result, f.read(), downloader
+
+    def test_master_playlist_picks_best_variant_under_max_height(self):
+        self.server.files.update({
+            '/master.m3u8': (
+                b'#EXTM3U\n'
+                b'#EXT-X-STREAM-INF:BANDWIDTH=6000000,RESOLUTION=1920x1080\nhi/index.m3u8\n'
+                b'#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720\nmid/index.m3u8\n'
+                b'#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlo/index.m3u8\n'),
+            '/mid/index.m3u8': (
+                b'#EXTM3U\n#EXT-X-TARGETDURATION:4\n'
+                b'#EXTINF:4,\ns0.ts\n#EXTINF:4,\ns1.ts\n#EXTINF:4,\ns2.ts\n#EXT-X-ENDLIST\n'),
+            '/mid/s0.ts': PLAIN[0], '/mid/s1.ts': PLAIN[1], '/mid/s2.ts': PLAIN[2],
+        })
+        result, data, downloader = self.download('/master.m3u8', max_height=720)
+        self.assertTrue(result.endswith('.ts'))
+        self.assertEqual(data, PLAIN[0] + PLAIN[1] + PLAIN[2])
+        self.assertEqual(downloader.stats['variant']['height'], 720)
+        self.assertFalse(any(path.startswith(('/hi/', '/lo/')) for path in self.server.requests))
+
+    @unittest.skipIf(_encrypt(b'', KEY, IV) is None, "no AES implementation installed")
+    def test_aes128_byterange_and_map(self):
+        blob = b''.join(_encrypt(plain, KEY, IV) for plain in PLAIN)
+        playlist = ['#EXTM3U', '#EXT-X-TARGETDURATION:4', '#EXT-X-MAP:URI="init.mp4"',
+                    f'#EXT-X-KEY:METHOD=AES-128,URI="/key.bin",IV=0x{IV.hex()}']
+        offset = 0
+        for plain in PLAIN:
+            length = len(_encrypt(plain, KEY, IV))
+            playlist += ['#EXTINF:4,', f'#EXT-X-BYTERANGE:{length}@{offset}', 'media.m4s']
+            offset += length
+        playlist.append('#EXT-X-ENDLIST')
+        self.server.files.update({
+            '/v/index.m3u8': '\n'.join(playlist).encode(),
+            '/v/init.mp4': INIT,
+            '/v/media.m4s': blob,
+            '/key.bin': KEY,
+        })
+        self.server.failures['/key.bin'] = 1  # One failed key fetch mustn't fail the stream
+        result, data, _downloader = self.download('/v/index.m3u8')
+        self.assertTrue(result.endswith('.mp4'))
+        self.assertEqual(data, INIT + b''.join(PLAIN))
+        self.assertEqual(self.server.requests.count('/key.bin'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+"""
+URL SOURCE - Read long URL lists without loading them
+
+Lists of tens of thousands of URLs are read line by line - from files, from
+a folder of list files or from stdin - and handed on one URL at a time, so
+the first downloads start while the rest of the list is still unread and
+the list never has to fit in memory as a whole.
+
+On the way every URL is cleaned up and repeats are dropped:
+
+- click trackers (utm_*, mc_*, fbclid, gclid) are removed; other parameters
+  stay, since on an arbitrary site (a signed CDN link) they may matter
+- YouTube's spellings of a video (youtu.be/ID, shorts/ID, embed/ID,
+  m.youtube.com, ...) become https://www.youtube.com/watch?v=ID
+- a URL seen before in the same list is skipped; only an 8-byte hash of
+  each URL is kept for that, not the URL itself. Repeats are found with
+  the archive's canonical_url, which ignores more (ref, si, feature, ...)
+
+Blank lines and lines starting with # are ignored; anything else that
+isn't an http(s) URL is counted as invalid.
+"""
+
+import hashlib
+import os
+import re
+import sys
+from urllib.parse import parse_qsl, unquote_plus, urlencode, urlsplit, urlunsplit
+
+from download_archive import canonical_url
+
+STDIN = '-'
+CLICK_IDS = {'fbclid', 'gclid'}  # Removed from every URL, with utm_* and mc_*
+YOUTUBE_HOSTS = {'youtube.com', 'www.youtube.com', 'm.youtube.com', 'youtube-nocookie.com',
+                 'www.youtube-nocookie.com'}
+_YOUTUBE_PATH_RE = re.compile(r'^/(?:shorts|embed|live|v|e)/([\w-]{11})(?:[/?#]|$)')
+_YOUTUBE_ID_RE = re.compile(r'^[\w-]{11}$')
+
+
+def _youtube_id(host, parts):
+    """The video id if the URL is one of YouTube's spellings of a single video"""
+    if host == 'youtu.be':
+        video_id = parts.path.strip('/').split('/')[0]
+        return video_id if _YOUTUBE_ID_RE.match(video_id) else None
+    if host not in YOUTUBE_HOSTS:
+        return None
+    match = _YOUTUBE_PATH_RE.match(parts.path)
+    if match:
+        return match.group(1)
+    if parts.path in ('/watch', '/watch/'):
+        video_id = dict(parse_qsl(parts.query)).get('v', '')
+        return video_id if _YOUTUBE_ID_RE.match(video_id) else None
+    return None
+
+
+def _is_tracking(key):
+    """Whether a query parameter is an unambiguous click tracker, safe to drop on any site"""
+    return key in CLICK_IDS or key.startswith(('utm_', 'mc_'))
+
+
+def clean_url(url):
+    """The URL to download: without tracking parameters, YouTube videos in watch?v= form"""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    video_id = _youtube_id(host, parts)
+    if video_id is not None:
+        # Start time and playlist context still mean something, the spelling doesn't
+        query = [('v', video_id)] + [(key, value) for key, value in parse_qsl(parts.query)
+                                     if key in ('t', 'list', 'index')]
+        return urlunsplit(('https', 'www.youtube.com', '/watch', urlencode(query), ''))
+    # Other parameters stay exactly as they were written: signed URLs break if they're re-encoded
+    query = '&'.join(piece for piece in parts.query.split('&')
+                     if piece and not _is_tracking(unquote_plus(piece.split('=', 1)[0])))
+    netloc = parts.netloc if '@' in parts.netloc else parts.netloc.lower()
+    return urlunsplit((parts.scheme.lower(), netloc, parts.path or '/', query, parts.fragment))
+
+
+def read_lines(sources):
+    """Lines of list files, folders of them (every file, sorted by name) and stdin ('-'), lazily"""
+    for source in sources:
+        if source == STDIN:
+            yield from sys.stdin
+        elif os.path.isdir(source):
+            for root, dirs, names in os.walk(source):
+                dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+                for name in sorted(names):
+                    if not name.startswith('.'):
+                        yield from read_lines([os.path.join(root, name)])
+        else:
+            with open(source, encoding='utf-8', errors='replace') as f:
+                yield from f
+
+
+class UrlStream:
+    """Cleaned, de-duplicated URLs from lines of text, for going through once
+
+    `lines` is any iterable of strings (a list, read_lines(...)); a line may
+    hold several URLs separated by whitespace. The counters are up to date
+    as far as the stream has been consumed.
+    """
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._seen = set()  # 64-bit hashes of the canonical URLs so far
+        self.urls = 0  # Unique URLs handed out
+        self.duplicates = 0
+        self.invalid = 0
+
+    def __iter__(self):
+        for line in self._lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            for token in line.split():
+                if not token.lower().startswith(('http://', 'https://')):
+                    self.invalid += 1
+                    continue
+                try:
+                    url = clean_url(token)
+                except ValueError:  # e.g. a broken IPv6 host or port
+                    self.invalid += 1
+                    continue
+                key = int.from_bytes(
+                    hashlib.blake2b(canonical_url(url).encode('utf-8'), digest_size=8).digest(), 'big')
+                if key in self._seen:
+                    self.duplicates += 1
+                    continue
+                self._seen.add(key)
+                self.urls += 1
+                yield url
+
+    def describe(self):
+        """One line on what was read"""
+        text = f"📥 {self.urls} URL(s) read"
+        if self.duplicates:
+            text += f", {self.duplicates} duplicate(s) dropped"
+        if self.invalid:
+            text += f", {self.invalid} non-URL entr{'y' if self.invalid == 1 else 'ies'} skipped"
+        return text
+
+
+def unique_urls(urls):
+    """A short URL list cleaned up and without repeats
+
+    Entries that aren't http(s) URLs (ytsearch:..., bare video ids) are
+    kept as they are - yt-dlp knows what to do with them.
+    """
+    seen = set()
+    result = []
+    for url in urls:
+        url = url.strip()
+        key = url
+        if url.lower().startswith(('http://', 'https://')):
+            try:
+                url = clean_url(url)
+                key = canonical_url(url)
+            except ValueError:
+                pass
+        if url and key not in seen:
+            seen.add(key)
+            result.append(url)
+    return result
@@ -14,6 +14,10 @@ HOW TO USE:
 2. Adjust settings if needed (quality, output folder, etc.)
 3. Run the script or double-click RUN_VIDEO_DOWNLOADER.bat
 
+Or give the URLs on the command line: python video_downloader.py URL [URL ...]
+Run with --daemon to keep it running as a background service that takes jobs
+over a local HTTP API (see download_daemon.py and --help).
+
 TIPS FOR PROTECTED SITES:
 - If a site requires login, make sure you're logged in on your browser first
 - The script will automatically use your browser cookies
@@ -22,11 +26,42 @@ TIPS FOR PROTECTED SITES:
 - Some sites use HLS (.m3u8) - just paste the URL and it will work!
 """
 
+import argparse
+import itertools
+import json
 import os
 import sys
 from pathlib import Path
 import subprocess
 import re
+import secrets
+import tempfile
+import threading
+import time
+
+import ytdlp_engine
+from download_archive import DownloadArchive, canonical_url
+from content_store import ContentStore
+from cookie_cache import BrowserCookieCache
+from hls_engine import HlsDownloader, output_name_for_url
+from dash_engine import DashDownloader
+from range_engine import RangeDownloader
+from probe_cache import ProbeCache, info_file_command, probe_all
+from download_scheduler import DownloadCancelled, DownloadJob, DownloadScheduler, get_host
+from download_daemon import DaemonClient, DaemonError, DownloadDaemon
+from job_journal import DONE, EXTRACTING, FAILED, JobJournal
+from job_queue import LEASED, QUEUED, TOKEN_ENV, QueueError, QueueServer, QueueWorker, open_queue
+from dependency_probe import DependencyProbe, describe
+from disk_space import DiskBudget, DiskSpaceError, expected_size, sync_directory, sync_file
+from bandwidth import MB, BandwidthManager, YtDlpThrottle
+from adaptive_concurrency import ConcurrencyTuner
+from job_metrics import MetricsRecorder, format_summary
+from pipeline import EXTRACT, TRANSFER, Pipeline, format_pipeline
+from playlist_feed import PlaylistFeed, is_extracted
+from postprocess_plan import PostprocessError, PostprocessPlan
+from retry_policy import RetryPolicy, retry_after_of
+from progress_events import EventHooks, ProgressEvent, ProgressTracker, format_status, parse_line, progress_args
+from url_source import UrlStream, read_lines, unique_urls
 
 # Configuration
 VIDEO_URLS = [
@@ -45,18 +80,131 @@ MAX_QUALITY = "1080"  # Maximum video quality (e.g., "480", "720", "1080", "1440
 SKIP_ADS = True  # Skip advertisements
 EMBED_SUBS = True  # Embed subtitles if available
 DOWNLOAD_PLAYLIST = False  # Download entire playlist if URL is a playlist
+PLAYLIST_SYNC = True  # Reruns stop listing a playlist once they reach videos downloaded from it before
+PLAYLIST_SYNC_STOP_AFTER = 5  # ...after this many of those in a row
+SPONSORBLOCK_CATEGORIES = "sponsor,intro,outro,selfpromo,interaction"  # Segments SKIP_ADS cuts out
+SINGLE_PASS_POSTPROCESS = True  # Cut segments, embed subtitles and metadata in one ffmpeg run instead of one each
+MP4_FASTSTART = False  # In that run, also move the MP4 index to the front (plays sooner when streamed; one more write)
 
 # Options for protected/difficult websites
 USE_BROWSER_COOKIES = False  # Extract cookies from your browser (for logged-in content)
 BROWSER_FOR_COOKIES = "chrome"  # Options: "chrome", "firefox", "edge", "brave", "opera"
 EXTRACT_M3U8_HLS = True  # Download HLS streams (m3u8 files) - common on protected sites
+HLS_ENGINE = "native"  # "native" (built-in parallel segment downloader for .m3u8 links) or "yt-dlp"
+HLS_CONCURRENT_SEGMENTS = 8  # Segments the native HLS engine fetches at the same time
+DASH_ENGINE = "native"  # "native" (built-in engine for .mpd links, fetches audio + video in parallel) or "yt-dlp"
+DASH_CONCURRENT_SEGMENTS = 8  # Segments per track the native DASH engine fetches at the same time
+DIRECT_ENGINE = "native"  # "native" (split direct .mp4/.webm/.mkv links over several connections) or "yt-dlp"
+DIRECT_CONNECTIONS = 4  # Connections per direct video file (servers without range support get one)
 BYPASS_RESTRICTIONS = True  # Try to bypass geo-restrictions and other blocks
 
+# Parallel downloads
+MAX_CONCURRENT_DOWNLOADS = 3  # How many videos to download at the same time (1 = one by one)
+MAX_DOWNLOADS_PER_HOST = 2  # Max simultaneous downloads from the same website
+QUEUE_AHEAD = 200  # URLs read ahead of the downloads from a --input list (or a playlist)
+
+# Retries (on top of yt-dlp's own retries of single requests)
+RETRY_FAILED = True  # Queue failed videos again at the end of the batch (not missing/private/unsupported ones)
+RETRY_ATTEMPTS = 2  # Extra tries per video
+RETRY_DELAY = 5  # Seconds before the first retry; doubles with every further one (a server's Retry-After wins, except with DOWNLOAD_ENGINE = "subprocess")
+BREAKER_FAILURES = 3  # Failures in a row (429/5xx/network) that pause a site's downloads...
+BREAKER_COOLDOWN = 30  # ...for this many seconds (doubling while the site keeps failing, up to 10 minutes)
+BREAKER_GIVE_UP = 3  # Pauses after which the site's remaining videos of the batch fail without trying
+
+# Pipeline (overlap page extraction, downloads and ffmpeg work of different videos)
+PIPELINE = True  # A video hands its download slot to the next one as soon as it starts post-processing
+EXTRACT_WORKERS = 2  # Pages resolved ahead of the running downloads
+POSTPROCESS_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # Videos merged/remuxed/tagged at the same time
+
+# Fragment concurrency (parallel segments inside one download)
+ADAPTIVE_CONCURRENCY = True  # Raise/lower it per site from measured speed, latency and 429 errors
+FRAGMENT_CONCURRENCY = 4  # yt-dlp starting value (the fixed value when ADAPTIVE_CONCURRENCY is off)
+FRAGMENT_CONCURRENCY_MIN = 1
+FRAGMENT_CONCURRENCY_MAX = 16
+
+# Bandwidth (one limit shared by every download of the batch)
+BANDWIDTH_LIMIT_MBPS = 0  # Total download speed cap in MB/s (0 = unlimited)
+BANDWIDTH_SCHEDULE = [  # Other caps by time of day: ("start", "end", MB/s); the first match wins
+    # ("09:00", "18:00", 2),  # e.g. leave room for others during office hours
+]
+HOST_WEIGHTS = {  # Relative share of the cap per site (default 1)
+    # "youtube.com": 2,
+}
+DOWNLOAD_ENGINE = "auto"  # "inprocess" (fast, reuses connections), "subprocess" (one yt-dlp per video), "auto"
+
+# Download archive
+USE_DOWNLOAD_ARCHIVE = True  # Skip videos that were already downloaded (checked before anything is fetched)
+ARCHIVE_FILE = "download_archive.db"  # Stored inside OUTPUT_DIR
+
+# Duplicate files (the same video reached through different URLs)
+DEDUPLICATE = True  # A download whose content is already in OUTPUT_DIR becomes a link to that file
+DEDUP_LINK = "hardlink"  # "hardlink", or "reflink" (a copy-on-write clone; Linux on btrfs/XFS)
+DEDUP_PRECHECK = True  # Direct links: compare size + first/last MiB with the server and skip duplicate transfers
+CONTENT_INDEX_FILE = "content_index.db"  # Stored inside OUTPUT_DIR
+
+# Disk space
+DISK_ADMISSION = True  # Check a video fits on the output drive before downloading it (waits for running ones if not)
+DISK_MIN_FREE_MB = 1024  # Always leave this much free
+DISK_HEADROOM = 2.0  # Space held per video, times its size (merging/post-processing writes a second copy)
+FSYNC_POLICY = "resume"  # "none" (fastest), "resume" (resume data + finished files), "full" (+ folder entries)
+
+# Job journal
+USE_JOB_JOURNAL = True  # Record every job's state so an interrupted batch resumes with only the unfinished jobs
+JOURNAL_FILE = "download_queue.db"  # Stored inside OUTPUT_DIR
+
+# Metrics
+USE_METRICS = True  # Time every job's phases (extract/download/postprocess) and write them out
+EVENT_LOG_FILE = "download_events.jsonl"  # One JSON event per line, stored inside OUTPUT_DIR
+METRICS_FILE = "metrics.prom"  # Prometheus text format, stored inside OUTPUT_DIR
+
+# Daemon mode (python video_downloader.py --daemon)
+DAEMON_HOST = "127.0.0.1"  # Address the job API listens on (keep it local unless you firewall it)
+DAEMON_PORT = 8765
+
+# Shared job queue (several machines downloading one batch, see job_queue.py)
+QUEUE_FILE = "shared_queue.db"  # What --coordinator serves when no --queue file is given (inside OUTPUT_DIR)
+QUEUE_LEASE_SECONDS = 60  # A job a node stops renewing (crashed, offline) goes to another node after this long
+QUEUE_MAX_LEASES = 3  # A job whose lease ran out this often is marked failed instead of handed out again
+COORDINATOR_PORT = 8766
+QUEUE_TOKEN = ""  # Shared secret between --coordinator and its nodes (--token / $VIDEO_QUEUE_TOKEN win; empty: made up at start)
+
+# Metadata cache (needs yt_dlp importable)
+USE_PROBE_CACHE = True  # Cache page metadata/format lists so retries and reruns skip re-extraction
+PROBE_BEFORE_DOWNLOAD = True  # Resolve every URL up front (in parallel), then download from cached data
+PROBE_CACHE_TTL_HOURS = 6  # How long cached metadata stays valid (signed stream URLs may expire sooner)
+PROBE_CACHE_MAX_MB = 256  # Size limit, least recently used entries are dropped first
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
 class VideoDownloader:
     def __init__(self):
+        self.started = time.perf_counter()
         self.output_dir = Path(OUTPUT_DIR)
         self.downloaded_count = 0
         self.failed_urls = []
+        self._lock = threading.Lock()  # Guards the counters when downloading in parallel
+        self._print_lock = threading.Lock()  # Keeps each job's output in one piece
+        self.session_pool = None  # Shared yt-dlp sessions when using the in-process engine
+        self.cookies = self.create_cookie_cache()  # Browser cookies, read once for all jobs
+        self.archive = None  # DownloadArchive of finished videos
+        self.content_store = None  # ContentStore of the files in the output folder
+        self.disk = None  # DiskBudget of the output drive
+        self.journal = None  # JobJournal of the current batch
+        self.metrics = None  # MetricsRecorder of the current batch (or daemon)
+        self.pipeline = None  # Pipeline of the current batch (or daemon)
+        self.daemon = None  # DownloadDaemon while serving
+        self._probe_pool = None  # yt-dlp sessions for extraction when downloads use subprocesses
+        self.probe_cache = None  # ProbeCache of extraction results
+        self.skipped_urls = []
+        self.batch_total = 0  # Videos in the current batch (playlists add theirs as they're listed)
+        # Learns per site how many fragments to fetch at once
+        self.tuner = ConcurrencyTuner(FRAGMENT_CONCURRENCY_MIN, FRAGMENT_CONCURRENCY_MAX, ADAPTIVE_CONCURRENCY)
+        self._status_width = 0  # Length of the progress line currently on screen
+        self.dependencies = DependencyProbe()  # yt-dlp/ffmpeg lookup, cached between runs
+        self.bandwidth = BandwidthManager(
+            BANDWIDTH_LIMIT_MBPS * MB,
+            [(start, end, rate * MB) for start, end, rate in BANDWIDTH_SCHEDULE],
+            HOST_WEIGHTS)
     
     @staticmethod
     def print_help_for_protected_sites():
@@ -80,26 +228,44 @@ class VideoDownloader:
         print("="*60 + "\n")
         
     def check_dependencies(self):
-        """Check if yt-dlp is installed, if not, install it"""
+        """Check if yt-dlp is installed, if not, install it
+        
+        Uses the DependencyProbe started with the batch, so this usually
+        just picks up its (cached) answer without running anything.
+        """
         print("🔍 Checking dependencies...")
+        results = self.dependencies.wait()
+        command, module = results['yt-dlp'], results['yt_dlp_module']
+        # The in-process engine only needs the package, the subprocess engine the command
+        if command['found'] or (module['found'] and DOWNLOAD_ENGINE != "subprocess"):
+            print(f"✅ yt-dlp {command['version'] or module['version']} is already installed")
+            if not results['ffmpeg']['found']:
+                print("⚠️  ffmpeg not found - needed to merge high-quality video and audio")
+            print()
+            return True
+        print("📦 yt-dlp not found. Installing...")
         try:
-            subprocess.run(['yt-dlp', '--version'], 
-                         capture_output=True, check=True)
-            print("✅ yt-dlp is already installed\n")
+            subprocess.run([sys.executable, '-m', 'pip', 'install', 
+                          '--upgrade', 'yt-dlp'], check=True)
+            self.dependencies.invalidate()
+            print("✅ yt-dlp installed successfully\n")
             return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            print("📦 yt-dlp not found. Installing...")
-            try:
-                subprocess.run([sys.executable, '-m', 'pip', 'install', 
-                              '--upgrade', 'yt-dlp'], check=True)
-                print("✅ yt-dlp installed successfully\n")
-                return True
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Failed to install yt-dlp: {e}")
-                print("💡 Try installing manually: pip install yt-dlp")
-                return False
+        except subprocess.CalledProcessError as e:
+            print(f"❌ Failed to install yt-dlp: {e}")
+            print("💡 Try installing manually: pip install yt-dlp")
+            return False
+    
+    @staticmethod
+    def format_selector():
+        """yt-dlp format selection for VIDEO_FORMAT and MAX_QUALITY"""
+        if VIDEO_FORMAT == "best":
+            return f'bestvideo[height<={MAX_QUALITY}]+bestaudio/best[height<={MAX_QUALITY}]/best'
+        elif VIDEO_FORMAT == "mp4":
+            return f'bestvideo[height<={MAX_QUALITY}][ext=mp4]+bestaudio[ext=m4a]/best[height<={MAX_QUALITY}][ext=mp4]/best'
+        else:
+            return VIDEO_FORMAT
     
-    def build_yt_dlp_command(self, url):
+    def build_yt_dlp_command(self, url, fragments=FRAGMENT_CONCURRENCY):
         """Build the yt-dlp command with all options"""
         # Create output directory if it doesn't exist
         self.output_dir.mkdir(parents=True, exist_ok=True)
@@ -115,12 +281,7 @@ class VideoDownloader:
         ]
         
         # Format selection (quality)
-        if VIDEO_FORMAT == "best":
-            cmd.extend(['-f', f'bestvideo[height<={MAX_QUALITY}]+bestaudio/best[height<={MAX_QUALITY}]/best'])
-        elif VIDEO_FORMAT == "mp4":
-            cmd.extend(['-f', f'bestvideo[height<={MAX_QUALITY}][ext=mp4]+bestaudio[ext=m4a]/best[height<={MAX_QUALITY}][ext=mp4]/best'])
-        else:
-            cmd.extend(['-f', VIDEO_FORMAT])
+        cmd.extend(['-f', self.format_selector()])
         
         # Merge to mp4 container
         cmd.extend(['--merge-output-format', 'mp4'])
@@ -128,7 +289,9 @@ class VideoDownloader:
         # Skip ads and sponsors (SponsorBlock integration)
         if SKIP_ADS:
             cmd.extend([
-                '--sponsorblock-remove', 'sponsor,intro,outro,selfpromo,interaction',
+                # Single pass: only look the segments up here, the post-processing plan cuts them
+                '--sponsorblock-mark' if SINGLE_PASS_POSTPROCESS else '--sponsorblock-remove',
+                SPONSORBLOCK_CATEGORIES,
                 '--no-playlist',  # Don't download playlists by default
             ])
         
@@ -141,14 +304,16 @@ class VideoDownloader:
         if EMBED_SUBS:
             cmd.extend([
                 '--write-auto-subs',  # Download auto-generated subtitles
-                '--embed-subs',  # Embed subtitles in video
+                # Single pass: write them next to the video, the post-processing plan embeds them
+                '--write-subs' if SINGLE_PASS_POSTPROCESS else '--embed-subs',
                 '--sub-lang', 'en',  # Prefer English subtitles
             ])
         
         # === ADVANCED OPTIONS FOR PROTECTED SITES ===
         
         # Use browser cookies (for sites requiring login)
-        if USE_BROWSER_COOKIES:
+        # With the cookie cache each job gets a cookie file of its own instead (see _run_yt_dlp)
+        if USE_BROWSER_COOKIES and self.cookies is None:
             cmd.extend(['--cookies-from-browser', BROWSER_FOR_COOKIES])
         
         # HLS stream support (m3u8 files)
@@ -173,17 +338,389 @@ class VideoDownloader:
             '--ignore-errors',  # Continue on download errors
             '--no-check-certificate',  # Skip SSL verification (for some sites)
             '--prefer-free-formats',  # Prefer free video formats
-            '--add-metadata',  # Add metadata to file
-            '--concurrent-fragments', '4',  # Download multiple fragments in parallel (faster)
+            '--concurrent-fragments', str(fragments),  # Download multiple fragments in parallel (faster)
             '--retries', '10',  # Retry failed downloads
             '--fragment-retries', '10',  # Retry failed fragments
-            '--user-agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            '--continue',  # Resume .part files left by an interrupted run
+            '--user-agent', USER_AGENT,
         ])
+        if SINGLE_PASS_POSTPROCESS:
+            cmd.append('--no-embed-chapters')  # --sponsorblock-mark would embed them in a pass of its own
+        else:
+            cmd.append('--add-metadata')  # Add metadata to file (else the post-processing plan does it)
         
         return cmd
     
-    def download_video(self, url):
-        """Download a single video"""
+    def create_session_pool(self):
+        """Set up the in-process engine if it's enabled and yt_dlp can be imported"""
+        if DOWNLOAD_ENGINE == "subprocess":
+            return None
+        if not ytdlp_engine.is_available():
+            if DOWNLOAD_ENGINE == "inprocess":
+                print("⚠️  yt_dlp can't be imported here - falling back to one process per video\n")
+            return None
+        parallel = MAX_CONCURRENT_DOWNLOADS > 1
+        # The options don't depend on the URL, so build them once for the session.
+        # Output goes through log() (or is collected when running in parallel)
+        # so it never runs into the progress line
+        pool = ytdlp_engine.SessionPool.from_command(
+            self.build_yt_dlp_command('URL'),
+            max_idle=max(4, MAX_CONCURRENT_DOWNLOADS * 2),
+            cookies=self.cookies,
+            logger_factory=ytdlp_engine.JobLogger if parallel else (
+                lambda: ytdlp_engine.JobLogger(lambda msg, level: self.log(msg))),
+        )
+        # Progress is shown from the progress hooks instead
+        pool.params['noprogress'] = True
+        return pool
+    
+    def create_cookie_cache(self):
+        """Read browser cookies once per session if they're enabled and yt_dlp can be imported"""
+        if not USE_BROWSER_COOKIES or not ytdlp_engine.is_available():
+            return None  # Without yt_dlp to import, every yt-dlp process reads them itself
+        return BrowserCookieCache(BROWSER_FOR_COOKIES, log=lambda msg, level: self.log(msg))
+    
+    def log(self, *lines):
+        """Print lines as one block so parallel downloads don't interleave"""
+        with self._print_lock:
+            self._clear_status()
+            print("\n".join(lines))
+    
+    def _clear_status(self):
+        if self._status_width:
+            sys.stdout.write('\r' + ' ' * self._status_width + '\r')
+            self._status_width = 0
+    
+    def show_progress(self, tracker):
+        """Redraw the one-line batch progress (interactive terminals only)"""
+        if not sys.stdout.isatty():
+            return
+        line = "📊 " + format_status(tracker.snapshot(), tracker.total_jobs)
+        with self._print_lock:
+            sys.stdout.write('\r' + line.ljust(self._status_width))
+            sys.stdout.flush()
+            self._status_width = len(line)
+    
+    def run_yt_dlp(self, url, info=None, capture=False, stats=None, progress=None, bandwidth=None):
+        """Run one download on the configured engine; returns (success, error lines)
+        
+        If `info` (cached metadata) is given, the page isn't fetched again.
+        The fragment concurrency used ends up in stats['concurrency'] and
+        progress(event) receives a ProgressEvent for every update.
+        `bandwidth` is the job's BandwidthShare, if any.
+        """
+        host = get_host(url)
+        controller = self.tuner.controller(host, FRAGMENT_CONCURRENCY)
+        if stats is not None:
+            stats['engine'] = 'yt-dlp-inprocess' if self.session_pool is not None else 'yt-dlp-subprocess'
+        try:
+            success, errors, downloads = self._run_yt_dlp(url, info, capture, controller, progress, bandwidth)
+            controller.review(errors)
+        finally:
+            self.tuner.remember(host, controller)
+            if stats is not None:
+                stats['concurrency'] = controller.snapshot()
+                stats['retries'] = stats.get('retries', 0) + controller.errors
+                if controller.retry_after:
+                    stats['retry_after'] = controller.retry_after
+        if success:
+            # A file the output folder already has is linked, not post-processed a second time
+            downloads = [download for download in downloads
+                         if not self.deduplicate(download.get('filepath'), stats)]
+        if success and SINGLE_PASS_POSTPROCESS:
+            self.postprocess(downloads, stats, progress)
+        if success and FSYNC_POLICY != 'none':
+            # yt-dlp never syncs what it writes; a plan that rewrote a file synced it already
+            for download in downloads:
+                path = download.get('filepath')
+                if path and os.path.exists(path):
+                    sync_file(path)
+            if FSYNC_POLICY == 'full' and downloads:
+                sync_directory(self.output_dir)
+        return success, errors
+    
+    def postprocess(self, downloads, stats=None, progress=None):
+        """Cut, embed subtitles and tag every downloaded file in one ffmpeg run each
+        
+        Failures only cost the extras: the video stays as downloaded. The
+        bytes written (and what yt-dlp's step-by-step chain would have
+        written) go into stats.
+        """
+        remove = SPONSORBLOCK_CATEGORIES.split(',') if SKIP_ADS else ()
+        for download in downloads:
+            plan = PostprocessPlan(download, remove, embed_subs=EMBED_SUBS, add_metadata=True,
+                                   faststart=MP4_FASTSTART, fsync=FSYNC_POLICY)
+            if not plan.needed:
+                continue
+            size = os.path.getsize(plan.path)
+            if progress:
+                progress(ProgressEvent('postprocess', 'started', postprocessor='SinglePass'))
+            try:
+                # Remember the file as downloaded, later copies of it are compared with that
+                source = (size, self.content_store.digest(plan.path)) if self.content_store is not None else None
+                written = plan.run()
+                if source is not None:
+                    self.content_store.add(plan.path, source=source)
+            except (PostprocessError, OSError) as e:
+                if stats is not None:
+                    stats.setdefault('warnings', []).append(f"Post-processing skipped: {e}")
+                continue
+            finally:
+                if progress:
+                    progress(ProgressEvent('postprocess', 'finished', postprocessor='SinglePass'))
+            if stats is not None:
+                # A merge yt-dlp did before counts as one more full write
+                merged = size if plan.merged else 0
+                stats['rewritten_bytes'] = stats.get('rewritten_bytes', 0) + merged + written
+                stats['stepwise_bytes'] = stats.get('stepwise_bytes', 0) + plan.stepwise_bytes(size)
+                stats['postprocess_passes'] = stats.get('postprocess_passes', 0) + plan.passes
+                stats['postprocess_steps'] = plan.steps
+    
+    def deduplicate(self, path, stats=None, digest=None):
+        """Turn a finished file into a link if the output folder already has the same content
+        
+        Returns whether it did; the file is indexed as new content otherwise.
+        """
+        if self.content_store is None or not path or not os.path.exists(path):
+            return False
+        size = os.path.getsize(path)
+        try:
+            existing = self.content_store.deduplicate(path, digest)
+        except OSError as e:
+            if stats is not None:
+                stats.setdefault('warnings', []).append(f"Duplicate not linked: {e}")
+            return False
+        if existing is None:
+            return False
+        if stats is not None:
+            stats['duplicate_of'] = existing
+            stats['deduplicated_bytes'] = stats.get('deduplicated_bytes', 0) + size
+        return True
+    
+    def _run_yt_dlp(self, url, info, capture, controller, progress, bandwidth):
+        fmt = self.format_selector()
+        throttle = YtDlpThrottle(bandwidth) if bandwidth is not None else None
+        if self.session_pool is not None:
+            monitors = [controller] + ([EventHooks(progress)] if progress else [])
+            params = {'concurrent_fragment_downloads': controller.value}
+            if throttle is not None:
+                monitors.append(throttle)
+                params['ratelimit'] = bandwidth.rate or None
+            result, output = self.session_pool.download(url, info, params, monitors)
+            if result is not None and self.archive is not None:
+                self.archive.record_info(fmt, result, url)
+            errors = [line for line in output if 'ERROR' in line]
+            return result is not None, errors, ytdlp_engine.finished_downloads(result)
+        
+        cmd = self.build_yt_dlp_command(url, controller.value) + progress_args()
+        if bandwidth is not None and bandwidth.rate:
+            # Fixed for the life of the process; the bytes still count towards the share
+            cmd.extend(['--limit-rate', str(int(bandwidth.rate))])
+        temp_files = []
+        if info is not None:
+            cmd, info_path = info_file_command(cmd, url, info)
+            temp_files.append(info_path)
+        cookie_file = self.cookies.write_file(url) if self.cookies is not None else None
+        if cookie_file is not None:
+            temp_files.append(cookie_file)
+            cmd.extend(['--cookies', cookie_file])
+        printed = None
+        if self.archive is not None:
+            # Have yt-dlp report the video id etc. so it can be archived
+            fd, printed = tempfile.mkstemp(prefix='yt-dlp-', suffix='.txt')
+            os.close(fd)
+            temp_files.append(printed)
+            cmd.extend(['--print-to-file', DownloadArchive.PRINT_TEMPLATE, printed])
+        finished = None
+        if SINGLE_PASS_POSTPROCESS or self.content_store is not None:
+            # The info of every finished file, one JSON object per line (post-processing plan, content store)
+            fd, finished = tempfile.mkstemp(prefix='yt-dlp-', suffix='.jsonl')
+            os.close(fd)
+            temp_files.append(finished)
+            cmd.extend(['--print-to-file', 'after_move:%()j', finished])
+        errors = []
+        downloads = []
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                       text=True, errors='replace', bufsize=1)
+            try:
+                with process.stdout:
+                    for line in process.stdout:
+                        event = parse_line(line)
+                        if event is not None:
+                            if throttle is not None and event.phase == 'download':
+                                throttle.count(event.filename, event.downloaded)
+                            if progress:
+                                progress(event)
+                            continue
+                        line = line.rstrip()
+                        controller.log_line(line)
+                        if 'ERROR' in line:
+                            errors.append(line)  # Also decides whether the job is worth retrying
+                        if line and not capture:
+                            self.log(line)
+            except BaseException:
+                # Cancelled (or Ctrl+C): don't leave yt-dlp running on its own
+                process.kill()
+                process.wait()
+                raise
+            success = process.wait() == 0
+            if success and printed:
+                self.archive.record_printed(fmt, printed, url)
+            if success and finished:
+                with open(finished, encoding='utf-8') as f:
+                    downloads = [json.loads(line) for line in f if line.strip()]
+        finally:
+            for path in temp_files:
+                os.remove(path)
+        return success, errors, downloads
+    
+    def run_native_stream(self, url, kind, label="", stats=None, progress=None, bandwidth=None):
+        """Download a bare .m3u8/.mpd/video file link with the built-in engines
+        
+        kind is 'hls', 'dash' or 'direct'. Returns False (after saying why)
+        if the URL needs yt-dlp instead.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        output = self.output_dir / output_name_for_url(url)
+        initial = {'hls': HLS_CONCURRENT_SEGMENTS, 'dash': DASH_CONCURRENT_SEGMENTS,
+                   'direct': DIRECT_CONNECTIONS}[kind]
+        host = get_host(url)
+        controller = self.tuner.controller(host, initial) if ADAPTIVE_CONCURRENCY else None
+        options = {
+            'headers': {'User-Agent': USER_AGENT},
+            'verify': False,  # Same as --no-check-certificate
+            'controller': controller,
+            'bandwidth': bandwidth,
+            'on_progress': (lambda status: progress(ProgressEvent.from_hook(status))) if progress else None,
+            'fsync': FSYNC_POLICY,
+        }
+        if kind == 'direct':
+            store = self.content_store
+            # The file is preallocated right after this check, so the space needn't stay reserved
+            admit = None
+            if self.disk is not None:
+                admit = lambda size: self.reserve_disk(size, label, headroom=1.0).release()
+            downloader = RangeDownloader(url, output, connections=initial, hash_content=store is not None,
+                                         precheck=store if DEDUP_PRECHECK else None, admit=admit, **options)
+        else:
+            engine = HlsDownloader if kind == 'hls' else DashDownloader
+            downloader = engine(url, output, max_height=MAX_QUALITY, concurrency=initial, **options)
+        if stats is not None:
+            stats['engine'] = f'native-{kind}'
+        if self.disk is not None and kind != 'direct':
+            self.reserve_disk(None, label).release()  # Size unknown: just don't start on a full drive
+        try:
+            path = downloader.download()
+        except (DownloadCancelled, DiskSpaceError):
+            raise
+        except Exception as e:
+            if stats is not None and retry_after_of(e):
+                stats['retry_after'] = retry_after_of(e)
+            self.log(f"{label}   ⚠️ Native {kind} engine can't handle this URL ({e}) - using yt-dlp")
+            return False
+        finally:
+            if stats is not None:
+                stats['retries'] = stats.get('retries', 0) + downloader.stats.get('retries', 0)
+            if controller is not None:
+                self.tuner.remember(host, controller)
+                if stats is not None:
+                    stats['concurrency'] = controller.snapshot()
+        job_stats = stats if stats is not None else {}
+        stats = downloader.stats
+        if stats.get('duplicate_of'):
+            job_stats['duplicate_of'] = stats['duplicate_of']
+            job_stats['deduplicated_bytes'] = stats['size']
+            self.log(f"{label}✅ Already have this video: {url}",
+                     f"   🔗 Same size, start and end as {os.path.basename(stats['duplicate_of'])} - "
+                     f"linked it instead of downloading {stats['size'] / MB:.1f} MB\n")
+        else:
+            self.deduplicate(path, job_stats, stats.get('digest'))
+            if kind == 'direct':
+                parts = f"{stats['chunks']} chunks" if stats['ranged'] else "no range support, 1 stream"
+            else:
+                parts = f"{stats['segments']} segments"
+            if stats.get('resumed_bytes'):
+                parts += f", resumed after {stats['resumed_bytes'] / 1024 / 1024:.1f} MB"
+            lines = [f"{label}✅ Successfully downloaded: {url}",
+                     f"   📊 {parts}, {stats['bytes'] / 1024 / 1024:.1f} MB in "
+                     f"{stats['elapsed']:.1f}s over {stats['connections']} connection(s)"]
+            lines.extend(self.job_notes(job_stats))
+            lines[-1] += "\n"
+            self.log(*lines)
+        if self.archive is not None:
+            self.archive.record(self.format_selector(), kind, canonical_url(url),
+                                urls=(url,), title=os.path.basename(path), filepath=path)
+        return True
+    
+    @staticmethod
+    def job_notes(stats):
+        """Extra log lines for a finished job: its file was linked to an earlier copy, warnings"""
+        lines = []
+        if stats.get('deduplicated_bytes'):
+            lines.append(f"   🔗 Same content as {os.path.basename(stats['duplicate_of'])} - "
+                         f"linked to it, {stats['deduplicated_bytes'] / MB:.1f} MB saved")
+        lines.extend(f"   ⚠️ {warning}" for warning in stats.get('warnings', []))
+        return lines
+    
+    def create_probe_cache(self):
+        """Open the metadata cache if it's enabled and yt_dlp can be imported"""
+        if not USE_PROBE_CACHE or not ytdlp_engine.is_available():
+            return None
+        return ProbeCache(ttl=PROBE_CACHE_TTL_HOURS * 3600, max_bytes=PROBE_CACHE_MAX_MB * 1024 * 1024)
+    
+    def probe_urls(self, urls):
+        """Resolve metadata for every URL up front so downloads start from cached data"""
+        print(f"🔎 Resolving {len(urls)} URL(s) before downloading...")
+        hits = self.probe_cache.hits
+        results = probe_all(urls, self.extraction_pool(), self.probe_cache,
+                            MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_HOST)
+        resolved = sum(1 for info in results.values() if info is not None)
+        print(f"✅ Resolved {resolved}/{len(urls)} ({self.probe_cache.hits - hits} from cache)\n")
+    
+    def extraction_pool(self):
+        """yt-dlp sessions for resolving pages (the download sessions, if downloads run in-process)"""
+        if self.session_pool is not None:
+            return self.session_pool
+        if self._probe_pool is None:
+            # Subprocess engine: probe in-process anyway, downloads still use yt-dlp processes
+            self._probe_pool = ytdlp_engine.SessionPool.from_command(
+                self.build_yt_dlp_command('URL'), logger_factory=ytdlp_engine.JobLogger,
+                cookies=self.cookies)
+        return self._probe_pool
+    
+    def resolve(self, url):
+        """Cached metadata for a URL, extracted now if it isn't cached yet (None if that fails)"""
+        if self.probe_cache is None:
+            return None
+        info = self.probe_cache.get(url)
+        if info is None:
+            info = self.extraction_pool().probe(url)
+            if info is not None:
+                self.probe_cache.put(url, info)
+        return info
+    
+    def expand_playlist(self, url):
+        """A PlaylistFeed if the URL is a playlist, else None (a video's metadata is cached for its download)"""
+        if not ytdlp_engine.is_available():
+            return None  # Without yt_dlp to import, yt-dlp downloads the whole playlist in one go
+        info, entries = self.extraction_pool().expand(url)
+        if entries is None:
+            if info is not None and self.probe_cache is not None:
+                self.probe_cache.put(url, info)
+            return None
+        return PlaylistFeed(url, info, entries, self.archive, PLAYLIST_SYNC, PLAYLIST_SYNC_STOP_AFTER)
+    
+    def download_video(self, url, label="", stats=None, progress=None, bandwidth=None, stages=None,
+                       on_playlist=None):
+        """Download a single video
+        
+        Job details such as concurrency go into `stats`; progress(event) is
+        called with ProgressEvents while it runs. `bandwidth` is the job's
+        BandwidthShare and `stages` its StagedJob when a Pipeline is used.
+        With DOWNLOAD_PLAYLIST, on_playlist(feed) takes over a URL that turns
+        out to be a playlist: its entries become jobs of their own.
+        """
         # Detect video type
         video_type = "webpage"
         if '.m3u8' in url.lower():
@@ -193,36 +730,235 @@ class VideoDownloader:
         elif any(ext in url.lower() for ext in ['.mp4', '.webm', '.mkv', '.avi', '.mov']):
             video_type = "direct video"
         
-        print(f"📥 Downloading: {url}")
-        print(f"   Type: {video_type}")
+        self.log(f"{label}📥 Downloading: {url}",
+                 f"   Type: {video_type}")
+        
+        # With several downloads running, capture yt-dlp's output instead of
+        # letting the progress bars of different videos write over each other
+        parallel = MAX_CONCURRENT_DOWNLOADS > 1 or stages is not None
+        if stages is not None:
+            progress = stages.watch(progress)
+        reservation = None
         
         try:
-            cmd = self.build_yt_dlp_command(url)
-            result = subprocess.run(cmd, capture_output=False, text=True)
+            native = None
+            if video_type.startswith("HLS") and EXTRACT_M3U8_HLS and HLS_ENGINE == "native":
+                native = 'hls'
+            elif video_type.startswith("DASH") and DASH_ENGINE == "native":
+                native = 'dash'
+            elif video_type == "direct video" and DIRECT_ENGINE == "native":
+                native = 'direct'
+            if native:
+                if stages is not None:
+                    stages.enter(TRANSFER)
+                if self.run_native_stream(url, native, label, stats, progress, bandwidth):
+                    with self._lock:
+                        self.downloaded_count += 1
+                    return True
             
-            if result.returncode == 0:
-                print(f"✅ Successfully downloaded!\n")
-                self.downloaded_count += 1
+            if stages is not None:
+                # Resolve the page in its own slot, then wait for a free download slot
+                stages.enter(EXTRACT)
+            if on_playlist is not None and DOWNLOAD_PLAYLIST:
+                feed = self.expand_playlist(url)
+                if feed is not None:
+                    self.log(f"{label}📃 Playlist: {feed.title} - queueing its videos as they're found\n")
+                    if stats is not None:
+                        stats['playlist'] = True
+                    on_playlist(feed)
+                    return True
+            if stages is not None:
+                info = self.resolve(url)
+            else:
+                info = self.probe_cache.get(url) if self.probe_cache is not None else None
+            if self.disk is not None:
+                # Before taking a download slot: a job that has to wait for space doesn't block one
+                reservation = self.reserve_disk(expected_size(info, MAX_QUALITY), label)
+                progress = reservation.watch(progress)
+            if stages is not None:
+                stages.enter(TRANSFER)
+            success, errors = self.run_yt_dlp(url, info, capture=parallel, stats=stats,
+                                              progress=progress, bandwidth=bandwidth)
+            if not success and info is not None:
+                # Cached stream URLs can be revoked early - resolve the page again
+                self.probe_cache.invalidate(url)
+                success, errors = self.run_yt_dlp(url, capture=parallel, stats=stats,
+                                                  progress=progress, bandwidth=bandwidth)
+            
+            if success:
+                lines = [f"{label}✅ Successfully downloaded: {url}"]
+                if stats and stats.get('rewritten_bytes'):
+                    lines.append(
+                        f"   🧩 Post-processed ({', '.join(stats['postprocess_steps'])}): "
+                        f"{stats['rewritten_bytes'] / MB:.1f} MB written in {stats['postprocess_passes']} pass(es), "
+                        f"{stats['stepwise_bytes'] / MB:.1f} MB step by step")
+                lines.extend(self.job_notes(stats or {}))
+                lines[-1] += "\n"
+                self.log(*lines)
+                with self._lock:
+                    self.downloaded_count += 1
                 return True
             else:
-                print(f"❌ Download failed for: {url}")
-                print(f"💡 Tip: If this is a protected site, try:")
-                print(f"   1. Make sure you're logged in on your browser")
-                print(f"   2. Check if browser cookies are enabled (USE_BROWSER_COOKIES=True)")
-                print(f"   3. Try finding the direct video URL (see help below)\n")
-                self.failed_urls.append(url)
+                lines = [f"{label}❌ Download failed for: {url}"]
+                if parallel:
+                    lines.extend(f"   {line}" for line in errors[-3:])  # (Printed as they came otherwise)
+                lines.extend([
+                    f"💡 Tip: If this is a protected site, try:",
+                    f"   1. Make sure you're logged in on your browser",
+                    f"   2. Check if browser cookies are enabled (USE_BROWSER_COOKIES=True)",
+                    f"   3. Try finding the direct video URL (see help below)\n",
+                ])
+                self.log(*lines)
+                if stats is not None and errors:
+                    stats['error'] = errors[-1]
+                with self._lock:
+                    self.failed_urls.append(url)
                 return False
-                
+        
+        except DownloadCancelled:
+            self.log(f"{label}🛑 Cancelled: {url}\n")
+            if stats is not None:
+                stats['cancelled'] = True
+            return False
         except Exception as e:
-            print(f"❌ Error downloading {url}: {e}\n")
-            self.failed_urls.append(url)
+            self.log(f"{label}❌ Error downloading {url}: {e}\n")
+            if stats is not None:
+                stats['error'] = str(e)
+            with self._lock:
+                self.failed_urls.append(url)
             return False
+        finally:
+            if reservation is not None:
+                reservation.release()
+    
+    def reserve_disk(self, size, label="", headroom=None):
+        """Hold space on the output drive for a download of `size` bytes (see DiskBudget.reserve)"""
+        return self.disk.reserve(size, headroom, on_wait=lambda message: self.log(f"{label}💾 {message}"))
+    
+    def create_retry_policy(self):
+        """When and how often failed jobs of a batch are tried again"""
+        if not RETRY_FAILED:
+            return None
+        return RetryPolicy(RETRY_ATTEMPTS, RETRY_DELAY, failure_threshold=BREAKER_FAILURES,
+                           cooldown=BREAKER_COOLDOWN, give_up_after=BREAKER_GIVE_UP, log=self.log)
+    
+    def create_disk_budget(self):
+        """Admission control for the output drive, if it's enabled"""
+        if not DISK_ADMISSION:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        return DiskBudget(self.output_dir, DISK_MIN_FREE_MB * MB, DISK_HEADROOM)
+    
+    def queue_jobs(self, urls, journal=True):
+        """Create jobs for the URLs that aren't in the download archive yet
+        
+        If the job journal holds an interrupted run of the same batch, jobs
+        that already finished there are skipped as well. A list that is
+        streamed in isn't journaled (journal=False): the batch is only known
+        once it's been read, a rerun relies on the archive instead.
+        """
+        self.skipped_urls = []
+        if USE_DOWNLOAD_ARCHIVE:
+            self.archive = DownloadArchive(self.output_dir / ARCHIVE_FILE)
+        self.content_store = self.create_content_store()
+        fmt = self.format_selector()
+        states = {}
+        if USE_JOB_JOURNAL and journal:
+            self.journal = JobJournal(self.output_dir / JOURNAL_FILE)
+            states = self.journal.open_batch(urls, fmt)
+            left = sum(1 for state in states.values() if state != DONE)
+            if left < len(urls):
+                print(f"♻️  Resuming interrupted batch: {left} of {len(urls)} job(s) left\n")
+        jobs = []
+        for idx, url in enumerate(urls, 1):
+            if states.get(idx) == DONE:
+                print(f"[{idx}/{len(urls)}] ⏭️  Finished before the interruption: {url}")
+                self.skipped_urls.append(url)
+                continue
+            entry = self.archive.lookup(url, fmt) if self.archive is not None else None
+            if entry is not None:
+                print(f"[{idx}/{len(urls)}] ⏭️  Already downloaded: {entry['title'] or url}")
+                self.skipped_urls.append(url)
+                if self.journal is not None:
+                    self.journal.set_state(idx, DONE)
+            else:
+                jobs.append(DownloadJob(idx, url))
+        if self.skipped_urls:
+            print()
+        return jobs
+    
+    def close_engines(self):
+        """Close the yt-dlp sessions, archive, content index and metadata cache after a batch (or the daemon)"""
+        if self.session_pool is not None:
+            self.session_pool.close()
+            self.session_pool = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if self.content_store is not None:
+            self.content_store.close()
+            self.content_store = None
+        if self.probe_cache is not None:
+            self.probe_cache.close()
+            self.probe_cache = None
+        if self._probe_pool is not None:
+            self._probe_pool.close()
+            self._probe_pool = None
     
-    def download_all(self):
-        """Download all videos in the list"""
-        if not VIDEO_URLS:
+    def finish_playlists(self, feeds):
+        """After a batch: a playlist is done once it was listed to the end and all its entries downloaded
+        
+        Only then may later syncs stop at known entries; in the job journal
+        the playlist's job counts as failed otherwise, so a resumed batch
+        lists it again.
+        """
+        for job, feed, entry_jobs in feeds:
+            done = feed.complete and all(entry_job.success for entry_job in entry_jobs)
+            if self.journal is not None:
+                self.journal.set_state(job.index, DONE if done else FAILED)
+            if done and self.archive is not None and PLAYLIST_SYNC:
+                self.archive.mark_synced(feed.url)
+    
+    def create_content_store(self):
+        """Open the output folder's content index and bring it up to date, if deduplication is on"""
+        if not DEDUPLICATE:
+            return None
+        store = ContentStore(self.output_dir / CONTENT_INDEX_FILE, DEDUP_LINK)
+        store.scan(self.output_dir)
+        return store
+    
+    def create_pipeline(self):
+        """Stage slots for a batch (or the daemon), if pipelining is on"""
+        if not PIPELINE:
+            return None
+        return Pipeline(EXTRACT_WORKERS, MAX_CONCURRENT_DOWNLOADS, POSTPROCESS_WORKERS)
+    
+    def create_metrics(self):
+        """Open the event log and Prometheus file in the output folder, if metrics are on"""
+        if not USE_METRICS:
+            return None
+        return MetricsRecorder(self.output_dir / EVENT_LOG_FILE, self.output_dir / METRICS_FILE)
+    
+    def download_all(self, urls=None, sources=None, queue=None):
+        """Download all videos in the list (VIDEO_URLS unless other URLs are given)
+        
+        `sources` are list files, folders of them or '-' for stdin; their
+        URLs are read while the batch runs (see url_source), after `urls`.
+        With a shared `queue` (JobQueue/QueueClient) this machine is one node
+        of a batch instead: it leases jobs from the queue until it's drained.
+        """
+        urls = VIDEO_URLS if urls is None and not sources and queue is None else urls or []
+        stream = None
+        if sources:
+            stream = UrlStream(itertools.chain(urls, read_lines(sources)))
+            urls = []
+        else:
+            listed = len(urls)
+            urls = unique_urls(urls)
+        if not urls and stream is None and queue is None:
             print("⚠️  No video URLs found!")
             print("💡 Edit the script and add URLs to the VIDEO_URLS list at the top.")
+            print("   (or pass them on the command line: python video_downloader.py URL [URL ...])")
             print("\n📚 Supported sites:")
             print("   • YouTube, Vimeo, Dailymotion")
             print("   • Twitter/X, Facebook, Instagram, TikTok")
@@ -232,16 +968,33 @@ class VideoDownloader:
             print("   • 1000+ other sites!")
             return
         
+        # Look for yt-dlp/ffmpeg while the settings are printed
+        self.dependencies.start()
+        
         print("="*60)
         print("🎬 VIDEO DOWNLOADER - ADVANCED MODE")
         print("="*60)
         print(f"📁 Output directory: {self.output_dir.absolute()}")
-        print(f"🎥 Videos to download: {len(VIDEO_URLS)}")
+        if queue is not None:
+            print(f"🎥 Videos to download: leased from the shared queue {queue.location}")
+        elif stream is not None:
+            print(f"🎥 Videos to download: read from {', '.join(sources)} while downloading")
+        else:
+            print(f"🎥 Videos to download: {len(urls)}"
+                  f"{f' ({listed - len(urls)} duplicate(s) left out)' if listed > len(urls) else ''}")
         print(f"🎯 Max quality: {MAX_QUALITY}p")
         print(f"🚫 Skip ads: {'Yes' if SKIP_ADS else 'No'}")
         print(f"🍪 Browser cookies: {'Yes (' + BROWSER_FOR_COOKIES + ')' if USE_BROWSER_COOKIES else 'No'}")
         print(f"🔓 HLS/m3u8 support: {'Yes' if EXTRACT_M3U8_HLS else 'No'}")
         print(f"🌍 Bypass restrictions: {'Yes' if BYPASS_RESTRICTIONS else 'No'}")
+        print(f"⚡ Parallel downloads: {MAX_CONCURRENT_DOWNLOADS} (max {MAX_DOWNLOADS_PER_HOST} per site)")
+        if PIPELINE:
+            print(f"🏭 Pipeline: {EXTRACT_WORKERS} extracting, {POSTPROCESS_WORKERS} post-processing "
+                  f"alongside the downloads")
+        if BANDWIDTH_LIMIT_MBPS or BANDWIDTH_SCHEDULE:
+            limit = self.bandwidth.limit
+            print(f"🚦 Bandwidth limit: {f'{limit / MB:g} MB/s' if limit else 'none'} right now"
+                  f"{' (changes by time of day)' if BANDWIDTH_SCHEDULE else ''}")
         print("="*60)
         print()
         
@@ -249,16 +1002,199 @@ class VideoDownloader:
         if not self.check_dependencies():
             return
         
-        # Download each video
-        for idx, url in enumerate(VIDEO_URLS, 1):
-            print(f"[{idx}/{len(VIDEO_URLS)}] ", end="")
-            self.download_video(url)
+        self.session_pool = self.create_session_pool()
+        if self.session_pool is not None:
+            print("🚀 Engine: in-process (shared yt-dlp sessions)")
+        print(f"⏱️  Ready in {(time.perf_counter() - self.started) * 1000:.0f} ms "
+              f"(dependency check: {describe(self.dependencies.results)})\n")
+        
+        # Skip anything already downloaded before queueing any work
+        self.batch_total = len(urls)  # Grows as playlists are enumerated (and a streamed list is read)
+        jobs = self.queue_jobs(urls, journal=stream is None and queue is None)
+        
+        self.probe_cache = self.create_probe_cache()
+        self.disk = self.create_disk_budget()
+        self.pipeline = pipeline = self.create_pipeline()
+        if (self.probe_cache is not None and PROBE_BEFORE_DOWNLOAD and jobs and pipeline is None
+                and not DOWNLOAD_PLAYLIST):
+            # (The pipeline resolves pages while earlier videos download instead; playlists are listed lazily)
+            self.probe_urls(list(dict.fromkeys(job.url for job in jobs)))
+        
+        # Download the videos, several at a time
+        tracker = ProgressTracker(len(jobs), self.show_progress)
+        retry = self.create_retry_policy()
+        
+        def on_retry(job, delay):
+            self.log(f"[{job.index}/{self.batch_total}] 🔁 Queued again (try {job.attempts + 1} of "
+                     f"{RETRY_ATTEMPTS + 1}), not before {delay:.0f}s from now: {job.url}")
+            tracker.retry(job.index)
+            job.stats = {}
+        
+        leases = None
+        if queue is not None:
+            leases = QueueWorker(queue, QUEUE_LEASE_SECONDS, log=self.log)
+            print(f"📡 Node {leases.worker}: taking jobs from {queue.location}\n")
+        
+        def on_done(job):
+            if job.lease is None:
+                return
+            if job.stats.get('cancelled') and job.lease not in leases.lost:
+                leases.queue.release(leases.worker, [job.lease])  # Stopped here, not failed: another node can have it
+            else:
+                leases.finish(job.lease, bool(job.success), job.error or job.stats.get('error'))
+        
+        # A node leases only as far ahead as its free download slots need
+        scheduler = DownloadScheduler(pipeline.threads if pipeline is not None else MAX_CONCURRENT_DOWNLOADS,
+                                      MAX_DOWNLOADS_PER_HOST, 1 if leases is not None else QUEUE_AHEAD,
+                                      retry, on_retry, on_done)
+        
+        journal = self.journal
+        self.metrics = recorder = self.create_metrics()
+        
+        def progress(job, metrics, event):
+            if leases is not None and job.lease in leases.lost:
+                raise DownloadCancelled("Another node has taken this job over")
+            tracker.update(job.index, event)
+            if journal is not None:
+                journal.track(job.index, event)
+            if metrics is not None:
+                metrics.event(event)
+        
+        feeds = []  # (playlist job, PlaylistFeed, jobs of its entries)
+        
+        def feed_jobs(job, feed):
+            """Jobs for the entries of a playlist, made as the entries are found"""
+            entry_jobs = []
+            feeds.append((job, feed, entry_jobs))
+            fmt = self.format_selector()
+            for entry_id, url, entry in feed:
+                with self._lock:
+                    self.batch_total += 1
+                    index = self.batch_total
+                archived = self.archive.lookup(url, fmt) if self.archive is not None else None
+                if archived is not None:
+                    self.log(f"[{index}/{self.batch_total}] ⏭️  Already downloaded: {archived['title'] or url}")
+                    self.skipped_urls.append(url)
+                    self.archive.record_entry(feed.url, entry_id)
+                    continue
+                if self.probe_cache is not None and is_extracted(entry):
+                    self.probe_cache.put(url, ytdlp_engine.load_yt_dlp().YoutubeDL.sanitize_info(entry))
+                entry_job = DownloadJob(index, url)
+                entry_job.source = (feed.url, entry_id)
+                entry_jobs.append(entry_job)
+                tracker.add_jobs()
+                yield entry_job
+            self.log(feed.describe() + "\n")
+        
+        def stream_jobs(stream):
+            """Jobs for the URLs of a list that's read while the batch runs"""
+            fmt = self.format_selector()
+            for url in stream:
+                with self._lock:
+                    self.batch_total += 1
+                    index = self.batch_total
+                archived = self.archive.lookup(url, fmt) if self.archive is not None else None
+                if archived is not None:
+                    self.log(f"[{index}/{self.batch_total}] ⏭️  Already downloaded: {archived['title'] or url}")
+                    self.skipped_urls.append(url)
+                    continue
+                tracker.add_jobs()
+                yield DownloadJob(index, url)
+            self.log(stream.describe() + "\n")
+        
+        def lease_jobs():
+            """Jobs leased from the shared queue, until no node has anything left to do"""
+            fmt = self.format_selector()
+            for leased in leases.jobs():
+                with self._lock:
+                    self.batch_total += 1
+                    index = self.batch_total
+                if leased['taken_from'] and leased['taken_from'] != leases.worker:
+                    self.log(f"[{index}/{self.batch_total}] ♻️  Taking over from {leased['taken_from']} "
+                             f"(its lease ran out): {leased['url']}")
+                archived = self.archive.lookup(leased['url'], fmt) if self.archive is not None else None
+                if archived is not None:
+                    self.log(f"[{index}/{self.batch_total}] ⏭️  Already downloaded: {archived['title'] or leased['url']}")
+                    self.skipped_urls.append(leased['url'])
+                    leases.finish(leased['id'], True)
+                    continue
+                job = DownloadJob(index, leased['url'])
+                job.lease = leased['id']
+                tracker.add_jobs()
+                yield job
+        
+        def run_job(job):
+            tracker.start(job.index)
+            # Entries of a playlist aren't journaled: a resumed batch lists the playlist again
+            journaled = journal is not None and job.source is None
+            if journaled:
+                journal.set_state(job.index, EXTRACTING)
+            metrics = recorder.start(job.index, job.url) if recorder is not None else None
+            stages = pipeline.job(job, scheduler.release_host) if pipeline is not None else None
+            success = False
+            share = self.bandwidth.open(job.host)
+            try:
+                success = self.download_video(job.url, f"[{job.index}/{self.batch_total}] ", job.stats,
+                                              lambda event: progress(job, metrics, event), share, stages,
+                                              on_playlist=lambda feed: scheduler.feed(feed_jobs(job, feed)))
+                return success
+            finally:
+                share.close()
+                if stages is not None:
+                    stages.close()
+                tracker.finish(job.index)
+                if journaled and not job.stats.get('playlist'):
+                    journal.set_state(job.index, DONE if success else FAILED)
+                if success and job.source is not None and self.archive is not None:
+                    self.archive.record_entry(*job.source)
+                if metrics is not None:
+                    recorder.finish(metrics, success, job.stats)
+        
+        sources = [stream_jobs(stream)] if stream is not None else []
+        if leases is not None:
+            sources.append(lease_jobs())
+        try:
+            jobs = scheduler.run(jobs, run_job, sources)
+            self.finish_playlists(feeds)
+        finally:
+            if leases is not None:
+                leases.close()  # Jobs still held (Ctrl+C) go back to the queue right away
+            with self._print_lock:
+                self._clear_status()
+            self.close_engines()
+            if self.journal is not None:
+                # Stays open for the next run unless every job got to the end
+                self.journal.finish_batch()
+                self.journal.close()
+                self.journal = None
+            if self.metrics is not None:
+                self.metrics.close()
+                self.metrics = None
+            self.pipeline = None
+        
+        # Report failures in the order the URLs were listed, not finish order
+        self.failed_urls = [job.url for job in jobs if not job.success]
         
         # Summary
         print("="*60)
         print("✨ DOWNLOAD COMPLETE!")
         print("="*60)
-        print(f"✅ Successfully downloaded: {self.downloaded_count}/{len(VIDEO_URLS)}")
+        print(f"✅ Successfully downloaded: {self.downloaded_count}/{self.batch_total - len(feeds)}")
+        if self.skipped_urls:
+            print(f"⏭️  Already downloaded before (skipped): {len(self.skipped_urls)}")
+        if leases is not None:
+            print(f"📡 This node: {leases.leased} job(s) leased, {leases.taken_over} taken over from other nodes")
+            print(f"   Queue now: {format_queue_counts(queue.counts())}")
+        if retry is not None:
+            for line in retry.describe():
+                print(line)
+        if self.disk is not None and self.disk.waited:
+            print(f"💾 Waited for disk space: {self.disk.waited} download(s)")
+        if recorder is not None:
+            for line in format_summary(recorder.summary()):
+                print(line)
+        if pipeline is not None and jobs:
+            print(format_pipeline(pipeline.snapshot()))
         
         if self.failed_urls:
             print(f"\n⚠️  Failed downloads ({len(self.failed_urls)}):")
@@ -270,11 +1206,267 @@ class VideoDownloader:
         
         print(f"\n📁 Files saved to: {self.output_dir.absolute()}")
         print("="*60)
+    
+    def run_daemon_job(self, job):
+        """DownloadDaemon worker: download one submitted URL"""
+        metrics = self.metrics.start(job.index, job.url) if self.metrics is not None else None
+        stages = None
+        success = False
+        try:
+            entry = self.archive.lookup(job.url, self.format_selector()) if self.archive is not None else None
+            if entry is not None:
+                self.log(f"[#{job.index}] ⏭️  Already downloaded: {entry['title'] or job.url}")
+                job.stats['skipped'] = success = True
+                return True
+            
+            def progress(event):
+                job.report(event)  # Raises once the job is cancelled
+                if metrics is not None:
+                    metrics.event(event)
+            
+            if self.pipeline is not None:
+                stages = self.pipeline.job(job, self.daemon.scheduler.release_host)
+            with self.bandwidth.open(job.host) as share:
+                success = self.download_video(job.url, f"[#{job.index}] ", job.stats, progress, share, stages)
+            return success
+        finally:
+            if stages is not None:
+                stages.close()
+            if metrics is not None:
+                self.metrics.finish(metrics, success, job.stats)
+    
+    def serve(self, host=DAEMON_HOST, port=DAEMON_PORT):
+        """Run as a daemon: take jobs over the local HTTP API until Ctrl+C"""
+        self.dependencies.start()
+        
+        print("="*60)
+        print("🛰️  VIDEO DOWNLOADER - DAEMON MODE")
+        print("="*60)
+        print(f"📁 Output directory: {self.output_dir.absolute()}")
+        print(f"🎯 Max quality: {MAX_QUALITY}p")
+        print(f"⚡ Parallel downloads: {MAX_CONCURRENT_DOWNLOADS} (max {MAX_DOWNLOADS_PER_HOST} per site)")
+        print("="*60)
+        print()
+        
+        if not self.check_dependencies():
+            return
+        self.session_pool = self.create_session_pool()
+        if USE_DOWNLOAD_ARCHIVE:
+            self.archive = DownloadArchive(self.output_dir / ARCHIVE_FILE)
+        self.content_store = self.create_content_store()
+        self.probe_cache = self.create_probe_cache()
+        self.disk = self.create_disk_budget()
+        self.metrics = self.create_metrics()
+        self.pipeline = self.create_pipeline()
+        workers = self.pipeline.threads if self.pipeline is not None else MAX_CONCURRENT_DOWNLOADS
+        self.daemon = daemon = DownloadDaemon(self.run_daemon_job, workers, MAX_DOWNLOADS_PER_HOST,
+                                              status=self.daemon_status)
+        try:
+            try:
+                daemon.start(host, port)
+            except OSError as e:
+                print(f"❌ Can't listen on {host}:{port}: {e}")
+                return
+            print(f"🛰️  Listening on {daemon.url} - submit jobs with:")
+            print("   python video_downloader.py --submit URL [URL ...]")
+            print(f"   (or POST {{\"urls\": [...]}} to {daemon.url}/jobs). Ctrl+C to stop.\n")
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopping - waiting for running downloads to finish (Ctrl+C again to quit now)")
+            daemon.close()
+        finally:
+            self.close_engines()
+            if self.metrics is not None:
+                self.metrics.close(batch=False)
+                self.metrics = None
+            self.pipeline = self.daemon = None
+    
+    def daemon_status(self):
+        """Extra fields for the daemon's GET /status"""
+        status = {'bandwidth': self.bandwidth.snapshot()}
+        if self.pipeline is not None:
+            status['pipeline'] = self.pipeline.snapshot()
+        return status
 
-def main():
+
+def format_job(job):
+    """One line per daemon job for --jobs"""
+    progress = job.get('progress') or {}
+    fraction = progress.get('fraction')
+    done = f" {fraction * 100:.0f}%" if fraction is not None and job['state'] not in ('done', 'failed', 'cancelled') else ""
+    priority = f" (priority {job['priority']})" if job['priority'] else ""
+    error = f" - {job['error']}" if job.get('error') and job['state'] == 'failed' else ""
+    return f"#{job['id']:<5} {job['state']:<14}{done}{priority}  {job['url']}{error}"
+
+
+def format_queue_counts(counts):
+    """'3 queued, 2 leased, 40 done, 1 failed' from JobQueue.counts()"""
+    return ", ".join(f"{counts.get(state, 0)} {state}" for state in (QUEUED, LEASED, DONE, FAILED))
+
+
+def queue_token(args):
+    """The coordinator token from --token, $VIDEO_QUEUE_TOKEN or QUEUE_TOKEN (None if there's none)"""
+    return args.token or os.environ.get(TOKEN_ENV) or QUEUE_TOKEN or None
+
+
+def run_queue_client(args):
+    """--queue without --work: add the URLs to a shared queue, or show how it's doing"""
+    queue = open_queue(args.queue, QUEUE_MAX_LEASES, queue_token(args))
+    try:
+        if args.urls or args.input:
+            urls = iter(unique_urls(args.urls))
+            if args.input:
+                urls = itertools.chain(urls, UrlStream(read_lines(args.input)))
+            totals = {'added': 0, 'requeued': 0, 'waiting': 0}
+            while True:
+                part = list(itertools.islice(urls, 500))
+                if not part:
+                    break
+                for key, count in queue.add(part).items():
+                    totals[key] += count
+            print(f"📨 {totals['added']} job(s) added to {queue.location}, {totals['requeued']} queued again, "
+                  f"{totals['waiting']} already waiting")
+            if not args.work:
+                print(f"💡 Start a node on each machine with: python video_downloader.py --queue {args.queue} --work")
+        else:
+            print(f"📡 {queue.location}: {format_queue_counts(queue.counts())}")
+            for job in queue.failed():
+                print(f"   ❌ {job['url']} - {job['error'] or 'failed'}")
+    except QueueError as e:
+        print(f"❌ {e}")
+        token = queue_token(args)
+        if token:
+            print(f"💡 Start one with: python video_downloader.py --coordinator --host 0.0.0.0 --token {token}")
+        return 1
+    finally:
+        queue.close()
+    return 0
+
+
+def run_coordinator(args):
+    """--coordinator: serve a queue file to nodes on other machines until Ctrl+C"""
+    path = args.queue or str(Path(OUTPUT_DIR) / QUEUE_FILE)
+    queue = open_queue(path, QUEUE_MAX_LEASES)
+    token = queue_token(args) or secrets.token_urlsafe(16)  # Nodes can't do anything without it
+    try:
+        server = QueueServer(queue, token, args.host, args.port or COORDINATOR_PORT)
+    except OSError as e:
+        print(f"❌ Can't listen on {args.host}:{args.port or COORDINATOR_PORT}: {e}")
+        queue.close()
+        return 1
+    print(f"📡 Serving the job queue {path} at {server.url} ({format_queue_counts(queue.counts())})")
+    print(f"   Add jobs:    python video_downloader.py --queue {server.url} --token {token} URL [URL ...]")
+    print(f"   Start nodes: python video_downloader.py --queue {server.url} --token {token} --work")
+    print(f"   (or set {TOKEN_ENV}={token} on the nodes)")
+    print("   Ctrl+C to stop.\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Coordinator stopped")
+    finally:
+        server.close()
+        queue.close()
+    return 0
+
+
+def run_client(args):
+    """--submit/--jobs/--cancel/--priority: talk to a running daemon"""
+    client = DaemonClient(f"http://{args.host}:{args.port or DAEMON_PORT}")
+    try:
+        if args.submit:
+            if not args.urls and not args.input:
+                print("⚠️  Nothing to submit - give the URLs (or --input FILE) after --submit")
+                return 1
+            urls = iter(unique_urls(args.urls))
+            if args.input:
+                urls = itertools.chain(urls, UrlStream(read_lines(args.input)))
+            while True:
+                # A long list goes over in parts, so the daemon starts on it right away
+                part = list(itertools.islice(urls, 500))
+                if not part:
+                    break
+                for job in client.submit(part, args.priority or 0):
+                    print(f"📨 Queued #{job['id']}: {job['url']}")
+        elif args.cancel is not None:
+            print(format_job(client.cancel(args.cancel)))
+        elif args.set_priority is not None:
+            job_id, priority = args.set_priority
+            print(format_job(client.reprioritise(job_id, priority)))
+        else:
+            status = client.status()
+            counts = ", ".join(f"{count} {state}" for state, count in sorted(status['jobs'].items()))
+            print(f"🛰️  Daemon up {status['uptime'] / 60:.0f} min, {status['workers']} worker(s): "
+                  f"{counts or 'no jobs yet'}")
+            for job in client.jobs(args.state):
+                print(format_job(job))
+    except DaemonError as e:
+        print(f"❌ {e}")
+        print("💡 Start one with: python video_downloader.py --daemon")
+        return 1
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Download videos from YouTube and 1000+ other sites. "
+                    "Without URLs, the VIDEO_URLS list at the top of this script is used.")
+    parser.add_argument('urls', nargs='*', metavar='URL', help="videos to download (or to --submit)")
+    parser.add_argument('-i', '--input', action='append', metavar='FILE',
+                        help="also read URLs from a list file, a folder of them or - for stdin, "
+                             "one per line (can be given more than once)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and take jobs over a local HTTP API")
+    parser.add_argument('--host', default=DAEMON_HOST,
+                        help=f"daemon/coordinator address (default {DAEMON_HOST})")
+    parser.add_argument('--port', type=int,
+                        help=f"daemon port (default {DAEMON_PORT}; {COORDINATOR_PORT} for --coordinator)")
+    client = parser.add_argument_group("talk to a running daemon")
+    client.add_argument('--submit', action='store_true', help="queue the URLs on the daemon")
+    client.add_argument('--jobs', action='store_true', help="list the daemon's jobs")
+    client.add_argument('--state', help="with --jobs: only jobs in this state (e.g. downloading, failed)")
+    client.add_argument('--cancel', type=int, metavar='ID', help="cancel a job")
+    client.add_argument('--priority', type=int, help="with --submit: priority of the new jobs (higher runs first)")
+    client.add_argument('--set-priority', type=int, nargs=2, metavar=('ID', 'PRIORITY'),
+                        help="move a waiting job up or down the queue")
+    shared = parser.add_argument_group("share a batch between machines")
+    shared.add_argument('--queue', metavar='FILE_OR_URL',
+                        help="shared job queue: a queue file every machine can open (e.g. on a network "
+                             "share) or a coordinator's http://host:port. With URLs: add them. Alone: show it")
+    shared.add_argument('--work', action='store_true',
+                        help="with --queue: download jobs from it until it's drained (URLs given are added first)")
+    shared.add_argument('--coordinator', action='store_true',
+                        help=f"serve a queue file (--queue, default OUTPUT_DIR/{QUEUE_FILE}) over HTTP")
+    shared.add_argument('--token',
+                        help=f"the coordinator's shared secret (default ${TOKEN_ENV} or QUEUE_TOKEN; "
+                             f"--coordinator makes one up without it)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Main entry point"""
+    args = parse_args(argv)
+    if args.submit or args.jobs or args.cancel is not None or args.set_priority is not None:
+        sys.exit(run_client(args))
+    if args.coordinator:
+        sys.exit(run_coordinator(args))
+    if args.queue and not args.work:
+        sys.exit(run_queue_client(args))
     downloader = VideoDownloader()
-    downloader.download_all()
+    if args.daemon:
+        downloader.serve(args.host, args.port or DAEMON_PORT)
+    elif args.work:
+        if not args.queue:
+            sys.exit("--work needs --queue FILE_OR_URL")
+        if (args.urls or args.input) and run_queue_client(args):
+            sys.exit(1)
+        queue = open_queue(args.queue, QUEUE_MAX_LEASES, queue_token(args))
+        try:
+            downloader.download_all(queue=queue)
+        finally:
+            queue.close()
+    else:
+        downloader.download_all(args.urls or None, args.input)
 
 if __name__ == "__main__":
     main()
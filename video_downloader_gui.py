@@ -11,9 +11,48 @@ import threading
 from pathlib import Path
 import os
 import multiprocessing
+import tempfile
+import time
+from collections import deque
+
+import ytdlp_engine
+from download_archive import DownloadArchive
+from probe_cache import ProbeCache, info_file_command, probe_all
+from download_scheduler import DownloadCancelled, get_host
+from job_journal import DONE, EXTRACTING, FAILED, JobJournal
+from dependency_probe import DependencyProbe, describe
+from bandwidth import MB, BandwidthManager, YtDlpThrottle
+from adaptive_concurrency import ConcurrencyTuner
+from cookie_cache import BrowserCookieCache
+from disk_space import DiskBudget, expected_size
+from url_source import unique_urls
+from progress_events import EventHooks, ProgressTracker, format_status, parse_line, progress_args
+from job_metrics import ErrorWatcher, MetricsRecorder, format_summary
+
+LOG_MAX_LINES = 2000  # Lines kept in the log window; older ones scroll away
+LOG_FLUSH_MS = 100  # How often queued log lines are drawn
+LOG_FILE_NAME = "download_log.txt"  # Full log, written to the output folder when enabled
+JOURNAL_FILE = "download_queue.db"  # Job states of the last batch, so an interrupted one can resume
+EVENT_LOG_FILE = "download_events.jsonl"  # Per-job phase timings, one JSON event per line
+METRICS_FILE = "metrics.prom"  # The same totals in Prometheus text format
+DISK_MIN_FREE_MB = 1024  # A video that would leave less free than this on the output drive isn't started
+DISK_HEADROOM = 2.0  # Space needed per video, times its size (merging writes a second copy)
+
+# Where to look for ffmpeg when it isn't on PATH (common install locations)
+FFMPEG_PATHS = [
+    r'C:\ffmpeg\bin\ffmpeg.exe',
+    r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
+]
+
+LOG_STYLES = {
+    "ERROR": ("error", "❌"),
+    "SUCCESS": ("success", "✅"),
+    "WARNING": ("warning", "⚠️"),
+}
 
 class VideoDownloaderGUI:
     def __init__(self, root):
+        self.started = time.perf_counter()
         self.root = root
         self.root.title("Video Downloader - Universal")
         self.root.geometry("800x650")
@@ -25,11 +64,28 @@ class VideoDownloaderGUI:
         self.skip_ads = tk.BooleanVar(value=True)
         self.use_cookies = tk.BooleanVar(value=False)  # Default to False to avoid cookie errors
         self.browser = tk.StringVar(value="chrome")
+        self.fast_engine = tk.BooleanVar(value=True)  # Reuse one yt-dlp session instead of a process per video
+        self.skip_downloaded = tk.BooleanVar(value=True)  # Consult the download archive before downloading
+        self.save_log = tk.BooleanVar(value=False)  # Also write every log line to OUTPUT/download_log.txt
+        self.speed_limit = tk.StringVar(value="0")  # MB/s for the whole batch, 0 = unlimited
         self.is_downloading = False
         self.current_process = None  # Track current download process for cancellation
+        self.cookie_cache = None  # Browser cookies, read once and kept for every batch of this window
+        self.tuner = ConcurrencyTuner()  # Learns per site how many fragments to fetch at once
+        # Log lines wait here until the Tk thread draws them; if the window
+        # falls behind, only the newest LOG_MAX_LINES are kept
+        self.log_queue = deque(maxlen=LOG_MAX_LINES)
+        self.log_file = None
+        self.log_file_lock = threading.Lock()
+        self.dependencies = DependencyProbe(ffmpeg_paths=FFMPEG_PATHS)
         
         self.setup_ui()
+        self.root.after(LOG_FLUSH_MS, self.flush_log)
         self.check_dependencies()
+        self.restore_unfinished_batch()
+        # Runs once the window has been drawn and is responding
+        self.root.after_idle(lambda: self.log(
+            f"⏱️ Window ready in {(time.perf_counter() - self.started) * 1000:.0f} ms", "INFO"))
     
     def setup_ui(self):
         """Setup the user interface"""
@@ -119,6 +175,13 @@ class VideoDownloaderGUI:
         )
         browser_combo.grid(row=2, column=1, sticky=tk.W, pady=(10, 0))
         
+        # Row 4: Speed limit
+        ttk.Label(settings_grid, text="Speed limit:").grid(row=3, column=0, sticky=tk.W, padx=(0, 10), pady=(10, 0))
+        limit_frame = ttk.Frame(settings_grid)
+        limit_frame.grid(row=3, column=1, sticky=tk.W, pady=(10, 0))
+        ttk.Entry(limit_frame, textvariable=self.speed_limit, width=6).pack(side=tk.LEFT)
+        ttk.Label(limit_frame, text="MB/s (0 = no limit)").pack(side=tk.LEFT, padx=(5, 0))
+        
         # Checkboxes
         checkbox_frame = ttk.Frame(settings_frame)
         checkbox_frame.pack(fill=tk.X, pady=(10, 0))
@@ -136,6 +199,24 @@ class VideoDownloaderGUI:
         )
         cookies_check.pack(side=tk.LEFT)
         
+        ttk.Checkbutton(
+            settings_frame,
+            text="Fast mode (reuse connections between videos)",
+            variable=self.fast_engine
+        ).pack(anchor=tk.W, pady=(5, 0))
+        
+        ttk.Checkbutton(
+            settings_frame,
+            text="Skip videos already downloaded",
+            variable=self.skip_downloaded
+        ).pack(anchor=tk.W, pady=(5, 0))
+        
+        ttk.Checkbutton(
+            settings_frame,
+            text=f"Save full log to file ({LOG_FILE_NAME} in the output folder)",
+            variable=self.save_log
+        ).pack(anchor=tk.W, pady=(5, 0))
+        
         # === Action Buttons ===
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=(0, 10))
@@ -197,13 +278,20 @@ class VideoDownloaderGUI:
             state=tk.DISABLED
         )
         self.log_text.pack(fill=tk.BOTH, expand=True)
+        self.log_text.tag_config("error", foreground="#FF5555")
+        self.log_text.tag_config("success", foreground="#50FA7B")
+        self.log_text.tag_config("warning", foreground="#FFB86C")
+        self.log_text.tag_config("info", foreground="#8BE9FD")
         
-        # Progress bar
+        # Progress bar (whole batch, fed by structured progress events)
         self.progress = ttk.Progressbar(
             log_frame,
-            mode='indeterminate'
+            mode='determinate',
+            maximum=100
         )
         self.progress.pack(fill=tk.X, pady=(10, 0))
+        self.progress_label = ttk.Label(log_frame, text="")
+        self.progress_label.pack(anchor=tk.W)
     
     def browse_folder(self):
         """Open folder browser dialog"""
@@ -230,69 +318,79 @@ class VideoDownloaderGUI:
         self.progress.stop()
     
     def log(self, message, level="INFO"):
-        """Add message to log display"""
-        self.log_text.config(state=tk.NORMAL)
-        
-        # Color coding
-        if level == "ERROR":
-            color_tag = "error"
-            prefix = "❌"
-        elif level == "SUCCESS":
-            color_tag = "success"
-            prefix = "✅"
-        elif level == "WARNING":
-            color_tag = "warning"
-            prefix = "⚠️"
-        else:
-            color_tag = "info"
-            prefix = "ℹ️"
-        
-        self.log_text.tag_config("error", foreground="#FF5555")
-        self.log_text.tag_config("success", foreground="#50FA7B")
-        self.log_text.tag_config("warning", foreground="#FFB86C")
-        self.log_text.tag_config("info", foreground="#8BE9FD")
-        
-        self.log_text.insert(tk.END, f"{prefix} {message}\n", color_tag)
-        self.log_text.see(tk.END)
-        self.log_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()
+        """Queue a message for the log display; safe to call from any thread"""
+        color_tag, prefix = LOG_STYLES.get(level, ("info", "ℹ️"))
+        line = f"{prefix} {message}\n"
+        self.log_queue.append((line, color_tag))
+        if self.log_file is not None:
+            with self.log_file_lock:
+                if self.log_file is not None:
+                    self.log_file.write(f"{time.strftime('%H:%M:%S')} {line}")
+    
+    def flush_log(self):
+        """Draw queued log lines in one batch, then trim the window to LOG_MAX_LINES"""
+        try:
+            batch = []
+            while True:
+                try:
+                    line, tag = self.log_queue.popleft()
+                except IndexError:
+                    break
+                # Consecutive lines with the same color go in with one insert
+                if batch and batch[-1][1] == tag:
+                    batch[-1][0].append(line)
+                else:
+                    batch.append(([line], tag))
+            if batch:
+                self.log_text.config(state=tk.NORMAL)
+                for lines, tag in batch:
+                    self.log_text.insert(tk.END, "".join(lines), tag)
+                # The text always ends with an empty line after the last newline
+                excess = int(self.log_text.index("end-1c").split(".")[0]) - 1 - LOG_MAX_LINES
+                if excess > 0:
+                    self.log_text.delete("1.0", f"{excess + 1}.0")
+                self.log_text.see(tk.END)
+                self.log_text.config(state=tk.DISABLED)
+        finally:
+            self.root.after(LOG_FLUSH_MS, self.flush_log)
+    
+    def open_log_file(self, output_path):
+        """Start appending the full log to output_path/LOG_FILE_NAME"""
+        try:
+            log_file = open(output_path / LOG_FILE_NAME, "a", encoding="utf-8")
+        except OSError as e:
+            self.log(f"Could not open log file: {e}", "WARNING")
+            return
+        log_file.write(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S')} =====\n")
+        with self.log_file_lock:
+            self.log_file = log_file
+    
+    def close_log_file(self):
+        with self.log_file_lock:
+            log_file, self.log_file = self.log_file, None
+        if log_file is not None:
+            log_file.close()
     
     def check_dependencies(self):
-        """Check if yt-dlp and ffmpeg are installed"""
+        """Check if yt-dlp and ffmpeg are installed (in the background, cached between starts)"""
         self.log("Checking dependencies...", "INFO")
-        
-        # Check yt-dlp
-        try:
-            result = subprocess.run(
-                [sys.executable, '-m', 'yt_dlp', '--version'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                version = result.stdout.strip()
-                self.log(f"yt-dlp {version} is installed", "SUCCESS")
-            else:
-                self.install_ytdlp()
-        except (subprocess.TimeoutExpired, FileNotFoundError, subprocess.CalledProcessError):
+        self.dependencies.start(self.report_dependencies)
+    
+    def report_dependencies(self, results):
+        """DependencyProbe callback (background thread): log the results, install yt-dlp if missing"""
+        module = results['yt_dlp_module']
+        if module['found']:
+            self.log(f"yt-dlp {module['version']} is installed", "SUCCESS")
+        else:
             self.install_ytdlp()
         
-        # Check ffmpeg
-        try:
-            result = subprocess.run(
-                ['ffmpeg', '-version'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            if result.returncode == 0:
-                self.log("ffmpeg is installed", "SUCCESS")
-            else:
-                self.log("⚠️ ffmpeg not found - required for high-quality videos!", "WARNING")
-                self.log("Run AUTO_INSTALL_FFMPEG.bat to install it", "WARNING")
-        except (subprocess.TimeoutExpired, FileNotFoundError):
+        ffmpeg = results['ffmpeg']
+        if ffmpeg['found']:
+            self.log(f"ffmpeg {ffmpeg['version']} is installed" if ffmpeg['version'] else "ffmpeg is installed", "SUCCESS")
+        else:
             self.log("⚠️ ffmpeg not found - required for high-quality videos!", "WARNING")
             self.log("Double-click AUTO_INSTALL_FFMPEG.bat to install it", "WARNING")
+        self.log(f"⏱️ Dependency check: {describe(results)}", "INFO")
     
     def install_ytdlp(self):
         """Install yt-dlp"""
@@ -303,12 +401,13 @@ class VideoDownloaderGUI:
                 capture_output=True,
                 check=True
             )
+            self.dependencies.invalidate()
             self.log("yt-dlp installed successfully!", "SUCCESS")
         except subprocess.CalledProcessError:
             self.log("Failed to install yt-dlp. Please install manually: pip install yt-dlp", "ERROR")
     
     def get_urls(self):
-        """Extract URLs from text box"""
+        """Extract URLs from text box (cleaned up, each video once)"""
         text = self.url_text.get("1.0", tk.END)
         urls = []
         for line in text.split('\n'):
@@ -316,7 +415,7 @@ class VideoDownloaderGUI:
             # Skip comments and empty lines
             if line and not line.startswith('#') and line.startswith('http'):
                 urls.append(line)
-        return urls
+        return unique_urls(urls)
     
     def start_download(self):
         """Start the download process in a separate thread"""
@@ -332,10 +431,12 @@ class VideoDownloaderGUI:
         
         # Disable download button
         self.download_btn.config(state=tk.DISABLED, text="⏳ Downloading...")
-        self.progress.start()
+        self.progress.config(value=0)
+        self.progress_label.config(text="")
         self.is_downloading = True
         
         # Clear previous logs
+        self.log_queue.clear()
         self.log_text.config(state=tk.NORMAL)
         self.log_text.delete("1.0", tk.END)
         self.log_text.config(state=tk.DISABLED)
@@ -345,6 +446,29 @@ class VideoDownloaderGUI:
         thread.daemon = True
         thread.start()
     
+    def restore_unfinished_batch(self):
+        """Put the URLs of a batch that was interrupted last time back in the URL box"""
+        path = Path(self.output_dir.get()) / JOURNAL_FILE
+        if not path.exists():
+            return
+        journal = JobJournal(path)
+        try:
+            urls = journal.unfinished_batch()
+        finally:
+            journal.close()
+        if urls and not self.get_urls():
+            self.url_text.insert("1.0", "\n".join(urls))
+            self.log(f"♻️ Restored {len(urls)} URL(s) from an interrupted batch - "
+                     "click Download to continue where it stopped", "WARNING")
+    
+    def speed_limit_bytes(self):
+        """The speed limit setting in bytes/s (0 if empty or not a number)"""
+        try:
+            return max(0.0, float(self.speed_limit.get() or 0)) * MB
+        except ValueError:
+            self.log(f"Ignoring speed limit {self.speed_limit.get()!r} - not a number", "WARNING")
+            return 0
+    
     def download_videos(self, urls):
         """Download videos using yt-dlp"""
         self.log(f"Starting download of {len(urls)} video(s)...", "INFO")
@@ -355,84 +479,331 @@ class VideoDownloaderGUI:
         # Create output directory
         output_path = Path(self.output_dir.get())
         output_path.mkdir(parents=True, exist_ok=True)
+        if self.save_log.get():
+            self.open_log_file(output_path)
         
         success_count = 0
         failed_count = 0
+        skipped_count = 0
+        
+        self.cookie_cache = self.create_cookie_cache()
+        session_pool = self.create_session_pool()
+        archive = DownloadArchive(output_path / "download_archive.db") if self.skip_downloaded.get() else None
+        fmt = self.format_selector()
+        journal = JobJournal(output_path / JOURNAL_FILE)
+        states = journal.open_batch(urls, fmt)
+        left = sum(1 for state in states.values() if state != DONE)
+        if left < len(urls):
+            self.log(f"♻️ Resuming interrupted batch: {left} of {len(urls)} video(s) left", "INFO")
+        # Resolve everything that isn't archived yet before the first download starts
+        probe_cache = self.probe_urls(
+            [url for idx, url in enumerate(urls, 1)
+             if states.get(idx) != DONE and (archive is None or archive.lookup(url, fmt) is None)],
+            session_pool)
+        tracker = ProgressTracker(len(urls), self.show_progress)
+        bandwidth = BandwidthManager(self.speed_limit_bytes())
+        if bandwidth.limit:
+            self.log(f"Speed limit: {bandwidth.limit / MB:g} MB/s", "INFO")
+        recorder = MetricsRecorder(output_path / EVENT_LOG_FILE, output_path / METRICS_FILE)
+        disk = DiskBudget(output_path, DISK_MIN_FREE_MB * MB, DISK_HEADROOM)
         
         for idx, url in enumerate(urls, 1):
+            if not self.is_downloading:
+                break
+            
+            # Skip videos that are already in the archive without touching the network
+            entry = archive.lookup(url, fmt) if archive is not None else None
+            if states.get(idx) == DONE or entry is not None:
+                title = entry['title'] if entry is not None else None
+                self.log(f"[{idx}/{len(urls)}] ⏭️ Already downloaded: {title or url}", "INFO")
+                skipped_count += 1
+                tracker.start(idx)
+                tracker.finish(idx)
+                journal.set_state(idx, DONE)
+                continue
+            
             self.log(f"[{idx}/{len(urls)}] Downloading: {url}", "INFO")
+            tracker.start(idx)
+            journal.set_state(idx, EXTRACTING)
+            metrics = recorder.start(idx, url)
+            stats = {}
+            returncode = 1
             
-            # Build yt-dlp command
-            cmd = self.build_command(url)
+            def progress(event, idx=idx, metrics=metrics):
+                tracker.update(idx, event)
+                journal.track(idx, event)
+                metrics.event(event)
             
+            share = bandwidth.open(get_host(url))
+            reservation = None
             try:
-                # Run yt-dlp
-                self.current_process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1,
-                    universal_newlines=True
-                )
-                process = self.current_process
+                info = probe_cache.get(url) if probe_cache is not None else None
+                # One video at a time: this fails straight away if it can't fit
+                reservation = disk.reserve(expected_size(info, self.max_quality.get()))
+                returncode = self.run_download(url, info, session_pool, archive, progress, share, stats)
+                if returncode != 0 and info is not None and self.is_downloading:
+                    # Cached stream URLs can be revoked early - resolve the page again
+                    probe_cache.invalidate(url)
+                    returncode = self.run_download(url, None, session_pool, archive, progress, share, stats)
                 
-                # Stream output
-                for line in process.stdout:
-                    line = line.strip()
-                    if line:
-                        # Check for cookie errors and provide helpful message
-                        if 'could not copy' in line.lower() and 'cookie' in line.lower():
-                            self.log(f"  ⚠️ Cookie access error - Close your browser or disable 'Use browser cookies'", "WARNING")
-                        # Check for ffmpeg errors
-                        elif 'ffmpeg not found' in line.lower():
-                            self.log(f"  ❌ FFmpeg is required but not installed!", "ERROR")
-                            self.log(f"  💡 Run AUTO_INSTALL_FFMPEG.bat to fix this", "WARNING")
-                        # Only show important lines
-                        elif any(keyword in line.lower() for keyword in ['download', 'merge', 'destination', 'error', 'already']):
-                            self.log(f"  {line}", "INFO")
-                
-                process.wait()
-                
-                if process.returncode == 0:
+                if returncode == 0:
                     self.log(f"✅ Successfully downloaded!", "SUCCESS")
                     success_count += 1
-                else:
+                    journal.set_state(idx, DONE)
+                elif self.is_downloading:
                     self.log(f"❌ Download failed", "ERROR")
                     failed_count += 1
+                    journal.set_state(idx, FAILED)
+                # Cancelled jobs stay unfinished so a resume picks them up
                     
+            except DownloadCancelled:
+                pass  # Raised by check_cancelled in fast mode: unfinished too, not failed
             except Exception as e:
                 self.log(f"❌ Error: {str(e)}", "ERROR")
                 failed_count += 1
+                journal.set_state(idx, FAILED, str(e))
+                stats['error'] = str(e)
             
+            if reservation is not None:
+                reservation.release()
+            share.close()
+            tracker.finish(idx)
+            if not self.is_downloading:
+                stats['cancelled'] = True
+            recorder.finish(metrics, returncode == 0, stats)
             self.log("-" * 60, "INFO")
+            if not self.is_downloading:
+                break
+        
+        if session_pool is not None:
+            session_pool.close()
+        if archive is not None:
+            archive.close()
+        if probe_cache is not None:
+            probe_cache.close()
+        # A cancelled batch stays unfinished, so it can be resumed later
+        journal.finish_batch()
+        journal.close()
+        summary = format_summary(recorder.summary())
+        recorder.close()
         
         # Summary
         self.log("", "INFO")
         self.log("=" * 60, "INFO")
         self.log("DOWNLOAD COMPLETE!", "SUCCESS")
         self.log(f"✅ Successful: {success_count}/{len(urls)}", "SUCCESS")
+        if skipped_count > 0:
+            self.log(f"⏭️ Already downloaded (skipped): {skipped_count}/{len(urls)}", "INFO")
         if failed_count > 0:
             self.log(f"❌ Failed: {failed_count}/{len(urls)}", "ERROR")
+        for line in summary:
+            self.log(line, "INFO")
         self.log(f"📁 Files saved to: {output_path.absolute()}", "INFO")
         self.log("=" * 60, "INFO")
+        self.close_log_file()
         
+        self.is_downloading = False
+        self.current_process = None
+        # Tk widgets may only be touched from the main thread
+        self.root.after(0, self.finish_download, success_count, len(urls), output_path)
+    
+    def finish_download(self, success_count, total, output_path):
+        """Reset the buttons and show the summary (runs on the Tk thread)"""
         # Re-enable download button, disable cancel button
         self.download_btn.config(state=tk.NORMAL, text="📥 Download Videos")
         self.cancel_btn.config(state=tk.DISABLED)
         self.progress.stop()
-        self.is_downloading = False
-        self.current_process = None
         
         # Show completion message
         if success_count > 0:
             messagebox.showinfo(
                 "Download Complete",
-                f"Successfully downloaded {success_count}/{len(urls)} video(s)!\n\n"
+                f"Successfully downloaded {success_count}/{total} video(s)!\n\n"
                 f"Saved to: {output_path.absolute()}"
             )
     
-    def build_command(self, url):
+    def create_session_pool(self):
+        """Set up shared in-process yt-dlp sessions when fast mode is on"""
+        if not self.fast_engine.get():
+            return None
+        if not ytdlp_engine.is_available():
+            self.log("Fast mode needs yt_dlp importable - using one process per video", "WARNING")
+            return None
+        # The options don't depend on the URL, so build them once for the batch
+        pool = ytdlp_engine.SessionPool.from_command(
+            self.build_command('URL'),
+            logger_factory=lambda: ytdlp_engine.JobLogger(self.show_output_line),
+            cookies=self.cookie_cache,
+        )
+        pool.params['progress_hooks'] = [self.check_cancelled]
+        pool.params['noprogress'] = True  # Progress comes from the hooks, not text lines
+        self.log("🚀 Fast mode: reusing yt-dlp sessions between videos", "INFO")
+        return pool
+    
+    def create_cookie_cache(self):
+        """The browser cookie cache for this batch (the previous batch's if the browser is the same)"""
+        if not self.use_cookies.get() or not ytdlp_engine.is_available():
+            return None  # Without yt_dlp to import, every yt-dlp process reads them itself
+        browser = self.browser.get()
+        if self.cookie_cache is None or self.cookie_cache.browser != browser:
+            return BrowserCookieCache(browser, log=self.log)
+        return self.cookie_cache
+    
+    def probe_urls(self, urls, session_pool):
+        """Resolve metadata for all URLs up front (cached on disk); returns the cache"""
+        if not urls or not ytdlp_engine.is_available():
+            return None
+        probe_cache = ProbeCache()
+        pool = session_pool or ytdlp_engine.SessionPool.from_command(
+            self.build_command('URL'), logger_factory=ytdlp_engine.JobLogger, cookies=self.cookie_cache)
+        self.log(f"🔎 Resolving {len(urls)} URL(s)...", "INFO")
+        hits = probe_cache.hits
+        try:
+            results = probe_all(urls, pool, probe_cache)
+        finally:
+            if pool is not session_pool:
+                pool.close()
+        resolved = sum(1 for info in results.values() if info is not None)
+        self.log(f"Resolved {resolved}/{len(urls)} ({probe_cache.hits - hits} from cache)", "INFO")
+        return probe_cache
+    
+    def run_download(self, url, info, session_pool, archive, progress=None, bandwidth=None, stats=None):
+        """Download one URL on the chosen engine; returns 0 on success
+        
+        If `info` (cached metadata) is given, the page isn't fetched again.
+        progress(event) receives a ProgressEvent for every update and
+        `bandwidth` (a BandwidthShare) caps the speed. `stats` (a dict) gets
+        the engine, retries and last error line for the job metrics.
+        """
+        host = get_host(url)
+        controller = self.tuner.controller(host, 4)
+        stats = stats if stats is not None else {}
+        stats['engine'] = 'yt-dlp-inprocess' if session_pool is not None else 'yt-dlp-subprocess'
+        try:
+            return self._run_download(url, info, session_pool, archive, controller, progress, bandwidth,
+                                      ErrorWatcher(stats))
+        finally:
+            self.tuner.remember(host, controller)
+            stats['concurrency'] = controller.snapshot()
+            stats['retries'] = stats.get('retries', 0) + controller.errors
+    
+    def _run_download(self, url, info, session_pool, archive, controller, progress, bandwidth, watcher):
+        fmt = self.format_selector()
+        throttle = YtDlpThrottle(bandwidth) if bandwidth is not None else None
+        if session_pool is not None:
+            monitors = [controller, watcher] + ([EventHooks(progress)] if progress else [])
+            params = {'concurrent_fragment_downloads': controller.value}
+            if throttle is not None:
+                monitors.append(throttle)
+                params['ratelimit'] = bandwidth.rate or None
+            result, _output = session_pool.download(url, info, params, monitors)
+            if result is not None and archive is not None:
+                archive.record_info(fmt, result, url)
+            return 0 if result is not None else 1
+        
+        cmd = self.build_command(url, controller.value) + progress_args()
+        if bandwidth is not None and bandwidth.rate:
+            cmd.extend(['--limit-rate', str(int(bandwidth.rate))])
+        temp_files = []
+        if info is not None:
+            cmd, info_path = info_file_command(cmd, url, info)
+            temp_files.append(info_path)
+        cookie_file = self.cookie_cache.write_file(url) if self.cookie_cache is not None else None
+        if cookie_file is not None:
+            temp_files.append(cookie_file)
+            cmd.extend(['--cookies', cookie_file])
+        printed = None
+        if archive is not None:
+            # Have yt-dlp report the video id etc. so it can be archived
+            fd, printed = tempfile.mkstemp(prefix='yt-dlp-', suffix='.txt')
+            os.close(fd)
+            temp_files.append(printed)
+            cmd.extend(['--print-to-file', DownloadArchive.PRINT_TEMPLATE, printed])
+        try:
+            def on_progress(event):
+                # The process keeps the rate it started with; its bytes still count towards the limit
+                if throttle is not None and event.phase == 'download':
+                    throttle.count(event.filename, event.downloaded)
+                if progress:
+                    progress(event)
+            
+            def on_line(line):
+                controller.log_line(line)
+                watcher.log_line(line)
+            returncode = self.run_subprocess(cmd, on_line, on_progress)
+            if returncode == 0 and printed:
+                archive.record_printed(fmt, printed, url)
+        finally:
+            for path in temp_files:
+                os.remove(path)
+        return returncode
+    
+    def show_progress(self, tracker):
+        """ProgressTracker listener: update the bar from the download thread"""
+        snapshot = tracker.snapshot()
+        text = format_status(snapshot, tracker.total_jobs)
+        # Tk widgets may only be touched from the main thread
+        self.root.after(0, lambda: (
+            self.progress.config(value=snapshot['fraction'] * 100),
+            self.progress_label.config(text=text),
+        ))
+    
+    def check_cancelled(self, status):
+        """yt-dlp progress hook: stop an in-process download after Cancel"""
+        if not self.is_downloading:
+            raise ytdlp_engine.load_yt_dlp().utils.DownloadCancelled("Download cancelled by user")
+    
+    def run_subprocess(self, cmd, on_line=None, on_progress=None):
+        """Run one yt-dlp process, streaming its output to the log (and to on_line)
+        
+        Progress lines (see progress_events) go to on_progress as events instead.
+        """
+        self.current_process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            universal_newlines=True
+        )
+        process = self.current_process
+        
+        # Stream output
+        for line in process.stdout:
+            event = parse_line(line)
+            if event is not None:
+                if on_progress:
+                    on_progress(event)
+                continue
+            if on_line:
+                on_line(line)
+            self.show_output_line(line)
+        
+        process.wait()
+        return process.returncode
+    
+    def show_output_line(self, line, level="INFO"):
+        """Show the interesting lines of yt-dlp output in the log"""
+        line = line.strip()
+        if not line:
+            return
+        # Check for cookie errors and provide helpful message
+        if 'could not copy' in line.lower() and 'cookie' in line.lower():
+            self.log(f"  ⚠️ Cookie access error - Close your browser or disable 'Use browser cookies'", "WARNING")
+        # Check for ffmpeg errors
+        elif 'ffmpeg not found' in line.lower():
+            self.log(f"  ❌ FFmpeg is required but not installed!", "ERROR")
+            self.log(f"  💡 Run AUTO_INSTALL_FFMPEG.bat to fix this", "WARNING")
+        # Only show important lines
+        elif any(keyword in line.lower() for keyword in ['download', 'merge', 'destination', 'error', 'already']):
+            self.log(f"  {line}", "INFO")
+    
+    def format_selector(self):
+        """yt-dlp format selection for the chosen max quality"""
+        max_q = self.max_quality.get()
+        return f'bestvideo[height<={max_q}]+bestaudio/best[height<={max_q}]/best'
+    
+    def build_command(self, url, fragments=4):
         """Build yt-dlp command"""
         output_template = str(Path(self.output_dir.get()) / '%(title)s.%(ext)s')
         
@@ -447,14 +818,13 @@ class VideoDownloaderGUI:
             '--ignore-errors',
             '--no-check-certificate',
             '--add-metadata',
-            '--concurrent-fragments', '4',
+            '--concurrent-fragments', str(fragments),
             '--retries', '10',
             '--fragment-retries', '10',
         ]
         
         # Format/Quality
-        max_q = self.max_quality.get()
-        cmd.extend(['-f', f'bestvideo[height<={max_q}]+bestaudio/best[height<={max_q}]/best'])
+        cmd.extend(['-f', self.format_selector()])
         
         # Skip ads
         if self.skip_ads.get():
@@ -466,7 +836,8 @@ class VideoDownloaderGUI:
         # Browser cookies (only if enabled)
         # Note: Most sites like YouTube, TikTok, etc. don't need cookies
         # Only enable for sites requiring login
-        if self.use_cookies.get():
+        # (with the cookie cache, each job gets a cookie file of its own instead)
+        if self.use_cookies.get() and self.cookie_cache is None:
             try:
                 cmd.extend(['--cookies-from-browser', self.browser.get()])
             except:
@@ -482,11 +853,7 @@ class VideoDownloaderGUI:
         cmd.extend(['--geo-bypass', '--age-limit', '99'])
         
         # Try to locate ffmpeg if not in PATH (works with common install locations)
-        ffmpeg_paths = [
-            r'C:\ffmpeg\bin\ffmpeg.exe',
-            r'C:\Program Files\ffmpeg\bin\ffmpeg.exe',
-        ]
-        for ffmpeg_path in ffmpeg_paths:
+        for ffmpeg_path in FFMPEG_PATHS:
             if os.path.exists(ffmpeg_path):
                 cmd.extend(['--ffmpeg-location', ffmpeg_path])
                 break
@@ -0,0 +1,364 @@
+"""
+IN-PROCESS ENGINE - Drive yt-dlp from Python instead of one process per URL
+
+The classic path starts a new `yt-dlp` process for every URL, which pays for
+interpreter startup, importing yt_dlp, building the extractor list and fresh
+TLS connections each time. This engine keeps long-lived YoutubeDL sessions
+instead, one per website, so URLs from the same site reuse open connections,
+cookies and already-initialised extractors.
+
+Options are not duplicated here: the command lists built by
+`build_yt_dlp_command` / `build_command` are parsed with yt-dlp's own option
+parser, so both engines always download with exactly the same settings.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+from download_scheduler import DownloadCancelled, get_host
+
+_yt_dlp = None
+
+
+def load_yt_dlp():
+    """Import yt_dlp on first use (returns None if it isn't installed)"""
+    global _yt_dlp
+    if _yt_dlp is None:
+        try:
+            import yt_dlp
+            _yt_dlp = yt_dlp
+        except ImportError:
+            return None
+    return _yt_dlp
+
+
+def is_available():
+    """True if the in-process engine can be used"""
+    return load_yt_dlp() is not None
+
+
+def command_args(cmd):
+    """Strip the executable part ('yt-dlp' or 'python -m yt_dlp') from a command"""
+    if len(cmd) >= 3 and cmd[1] == '-m' and cmd[2] == 'yt_dlp':
+        return list(cmd[3:])
+    return list(cmd[1:])
+
+
+def options_from_command(cmd):
+    """Turn a yt-dlp command line into YoutubeDL params
+
+    Returns (urls, params). Raises ValueError if yt-dlp rejects the options.
+    """
+    yt_dlp = load_yt_dlp()
+    if yt_dlp is None:
+        raise RuntimeError("yt_dlp is not installed")
+    try:
+        parsed = yt_dlp.parse_options(command_args(cmd))
+    except SystemExit as e:  # optparse reports bad options by exiting
+        raise ValueError(f"Invalid yt-dlp options: {e}")
+    return list(parsed.urls), parsed.ydl_opts
+
+
+def finished_downloads(info):
+    """The per-file info dicts of a download result (every entry of a playlist)"""
+    if not info:
+        return []
+    if info.get('_type') == 'playlist':
+        return [download for entry in info.get('entries') or [] for download in finished_downloads(entry)]
+    # yt-dlp trims requested_downloads to the per-file fields; the rest is on the video
+    video = {key: value for key, value in info.items() if key != 'requested_downloads'}
+    downloads = info.get('requested_downloads') or ([info] if info.get('filepath') else [])
+    return [dict(video, **download) for download in downloads]
+
+
+def iter_entries(entries):
+    """Go through raw playlist entries lazily; nested playlists are flattened"""
+    if entries is None:
+        return
+    if isinstance(entries, load_yt_dlp().utils.PagedList):
+        size = getattr(entries, '_pagesize', None) or 50
+        start = 0
+        while True:
+            page = entries.getslice(start, start + size)
+            if not page:
+                return
+            for entry in page:
+                yield from _flatten(entry)
+            start += len(page)
+    else:
+        for entry in entries:
+            yield from _flatten(entry)
+
+
+def _flatten(entry):
+    if entry and entry.get('_type') == 'playlist':
+        yield from iter_entries(entry.get('entries'))
+    elif entry:
+        yield entry
+
+
+class JobLogger:
+    """yt-dlp logger that hands every line to a callback (or collects them)"""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lines = []
+        self.listener = None  # Extra per-download watcher, called with every line
+        self.on_error = None  # Called with the exception behind an error line, if there is one
+
+    def _emit(self, level, msg):
+        if self.listener:
+            self.listener(msg)
+        if self.callback:
+            self.callback(msg, level)
+        else:
+            self.lines.append(msg)
+
+    def debug(self, msg):
+        # yt-dlp sends normal screen output through debug() too
+        if not msg.startswith('[debug] '):
+            self._emit("INFO", msg)
+
+    def info(self, msg):
+        self._emit("INFO", msg)
+
+    def warning(self, msg):
+        self._emit("WARNING", msg)
+
+    def error(self, msg):
+        # With ignoreerrors yt-dlp only logs a failure, from inside the except block that caught it
+        error = sys.exc_info()[1]
+        if self.on_error is not None and error is not None:
+            self.on_error(error)
+        self._emit("ERROR", msg)
+
+
+class YtDlpSession:
+    """One long-lived YoutubeDL instance, used by one download at a time"""
+
+    def __init__(self, params, logger=None, host=None):
+        yt_dlp = load_yt_dlp()
+        self.host = host
+        self.params = dict(params)
+        self.logger = logger
+        if logger is not None:
+            self.params['logger'] = logger
+            logger.listener = self._log_line
+            logger.on_error = self._error
+        # Hooks are installed once; each download points them at its own monitors
+        self.monitors = ()
+        self.params['progress_hooks'] = list(params.get('progress_hooks') or []) + [self._progress_hook]
+        self.params['postprocessor_hooks'] = (
+            list(params.get('postprocessor_hooks') or []) + [self._postprocessor_hook])
+        self.ydl = yt_dlp.YoutubeDL(self.params)
+        self.urls_done = 0
+        self.cookie_generation = None  # Which read of a BrowserCookieCache the cookie jar has
+
+    def _progress_hook(self, status):
+        self._call_monitors('progress_hook', status)
+
+    def _postprocessor_hook(self, status):
+        self._call_monitors('postprocessor_hook', status)
+
+    def _call_monitors(self, name, status):
+        try:
+            for monitor in self.monitors:
+                if hasattr(monitor, name):
+                    getattr(monitor, name)(status)
+        except DownloadCancelled as e:
+            # yt-dlp reports other exceptions from hooks as a failed download
+            raise load_yt_dlp().utils.DownloadCancelled(str(e)) from e
+
+    def _error(self, error):
+        self._call_monitors('error_hook', error)
+
+    def _log_line(self, msg):
+        for monitor in self.monitors:
+            if hasattr(monitor, 'log_line'):
+                monitor.log_line(msg)
+
+    def download(self, url, info=None, params=None, monitors=()):
+        """Download one URL; returns the info dict on success, None on failure
+
+        If `info` (a cached extraction result) is given, the page isn't
+        fetched again; format selection still runs on the cached formats.
+        `params` override session options for this URL only. Each of
+        `monitors` may have progress_hook(status), postprocessor_hook(status)
+        and (when output is captured) log_line(msg); they are called for
+        this download only. attach(params) on a monitor receives the live
+        YoutubeDL params, for monitors that adjust options mid-download.
+        A hook raising DownloadCancelled stops the download and the
+        DownloadCancelled is raised from here. error_hook(exception) on a
+        monitor receives the exception behind each error yt-dlp reports
+        (needs a logger: with ignoreerrors nothing is raised).
+        """
+        yt_dlp = load_yt_dlp()
+        if self.logger is not None:
+            self.logger.lines = []
+        # The return code is sticky inside YoutubeDL, reset it for every URL
+        self.ydl._download_retcode = 0
+        saved = {key: self.ydl.params[key] for key in params or {} if key in self.ydl.params}
+        self.ydl.params.update(params or {})
+        self.monitors = tuple(monitors)
+        for monitor in self.monitors:
+            if hasattr(monitor, 'attach'):
+                monitor.attach(self.ydl.params)
+        try:
+            if info is not None:
+                info = self.ydl.process_ie_result(
+                    self.ydl.sanitize_info(info, remove_private_keys=True), download=True)
+            else:
+                info = self.ydl.extract_info(url, download=True)
+        except yt_dlp.utils.DownloadError:
+            info = None  # Without ignoreerrors; the logger has seen the error already
+        except yt_dlp.utils.DownloadCancelled as e:
+            raise DownloadCancelled(str(e)) from e
+        finally:
+            self.urls_done += 1
+            self.monitors = ()
+            for key in params or {}:
+                self.ydl.params.pop(key, None)
+            self.ydl.params.update(saved)
+        if info is None or self.ydl._download_retcode != 0:
+            return None
+        return info
+
+    def probe(self, url):
+        """Extract a URL's metadata and formats without downloading (raw, unselected)"""
+        yt_dlp = load_yt_dlp()
+        try:
+            info = self.ydl.extract_info(url, download=False, process=False)
+        except yt_dlp.utils.DownloadError:
+            return None
+        if info is None:
+            return None
+        return self.ydl.sanitize_info(info)
+
+    def expand(self, url):
+        """Extract a URL without resolving playlist entries; returns (info, entries)
+
+        For a playlist, `entries` is an iterator that enumerates them as it's
+        consumed (paged sites fetch the next page only when it's needed) and
+        info is the playlist without them. For anything else entries is None
+        and info is the same as probe()'s. Raises DownloadError.
+        """
+        first = info = self.ydl.extract_info(url, download=False, process=False)
+        for _hop in range(5):
+            # Channel/user URLs often just redirect to the tab holding the videos
+            if not info or info.get('_type') != 'url' or not info.get('url'):
+                break
+            info = self.ydl.extract_info(info['url'], download=False, process=False,
+                                         ie_key=info.get('ie_key'))
+        if info and info.get('_type') == 'playlist':
+            entries = info.get('entries')
+            playlist = {key: value for key, value in info.items() if key != 'entries'}
+            return playlist, iter_entries(entries)
+        return (self.ydl.sanitize_info(first) if first else None), None
+
+    def close(self):
+        self.ydl.close()
+
+
+class SessionPool:
+    """Keeps idle sessions per website so the next URL from it reuses one
+
+    At most `max_idle` sessions are kept open; the least recently used one is
+    closed when the pool is full. With `cookies` (a BrowserCookieCache) every
+    session gets the browser cookies of its website.
+    """
+
+    def __init__(self, params, max_idle=8, logger_factory=None, cookies=None):
+        self.params = params
+        self.max_idle = max_idle
+        self.logger_factory = logger_factory
+        self.cookies = cookies
+        self._idle = OrderedDict()  # (host, n) -> session, oldest first
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.sessions_created = 0
+
+    @classmethod
+    def from_command(cls, cmd, **kwargs):
+        """Build a pool whose sessions use the options of a yt-dlp command"""
+        _urls, params = options_from_command(cmd)
+        return cls(params, **kwargs)
+
+    def acquire(self, url):
+        """Get a session for this URL's website (creates one if none is idle)"""
+        host = get_host(url)
+        session = None
+        with self._lock:
+            for key in reversed(self._idle):
+                if key[0] == host:
+                    session = self._idle.pop(key)
+                    break
+        if session is None:
+            logger = self.logger_factory() if self.logger_factory else None
+            session = YtDlpSession(self.params, logger=logger, host=host)
+            with self._lock:
+                self.sessions_created += 1
+        if self.cookies is not None:
+            self.cookies.apply(session, url)
+        return session
+
+    def release(self, session):
+        """Return a session to the pool once its download has finished"""
+        with self._lock:
+            self._counter += 1
+            self._idle[(session.host, self._counter)] = session
+            while len(self._idle) > self.max_idle:
+                _key, oldest = self._idle.popitem(last=False)
+                oldest.close()
+
+    def download(self, url, info=None, params=None, monitors=()):
+        """Download a URL on a pooled session; returns (info or None, log lines)"""
+        session = self.acquire(url)
+        try:
+            info = session.download(url, info, params, monitors)
+            lines = list(session.logger.lines) if session.logger is not None else []
+            return info, lines
+        finally:
+            self.release(session)
+
+    def probe(self, url):
+        """Extract a URL's metadata on a pooled session (see YtDlpSession.probe)"""
+        session = self.acquire(url)
+        try:
+            return session.probe(url)
+        finally:
+            self.release(session)
+
+    def expand(self, url):
+        """Expand a URL on a pooled session (see YtDlpSession.expand)
+
+        Returns (None, None) if extraction fails. A playlist's entries keep
+        the session until they're used up or closed.
+        """
+        yt_dlp = load_yt_dlp()
+        session = self.acquire(url)
+        try:
+            info, entries = session.expand(url)
+        except yt_dlp.utils.DownloadError:
+            self.release(session)
+            return None, None
+        except BaseException:
+            self.release(session)
+            raise
+        if entries is None:
+            self.release(session)
+            return info, None
+
+        def hold(entries):
+            try:
+                yield from entries
+            finally:
+                self.release(session)
+        return info, hold(entries)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._idle.values())
+            self._idle.clear()
+        for session in sessions:
+            session.close()